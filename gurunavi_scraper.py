@@ -10,27 +10,44 @@ import time
 import os
 import re
 from urllib.parse import urljoin, quote, urlparse, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import threading
+import queue
 from datetime import datetime
 import random
+import heapq
+from collections import deque, Counter
 import json
+import csv
+import unicodedata
+import sqlite3
+import argparse
+import sys
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 import subprocess
 import shutil
 import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+import multiprocessing
+import cProfile
+import pstats
+import linecache
+from array import array
 import requests
+import numpy as np
 import pandas as pd
+from bs4 import BeautifulSoup
 
 # Selenium imports
 try:
     from selenium import webdriver
     from selenium.webdriver.chrome.options import Options
     from selenium.webdriver.chrome.service import Service
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.common.exceptions import TimeoutException, NoSuchElementException
+    from selenium.common.exceptions import WebDriverException
     try:
         from webdriver_manager.chrome import ChromeDriverManager
         WEBDRIVER_MANAGER_AVAILABLE = True
@@ -41,11 +58,19 @@ except ImportError:
     SELENIUM_AVAILABLE = False
     WEBDRIVER_MANAGER_AVAILABLE = False
 
+# psutil（ブラウザのメモリ監視用・任意）
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
 class GurunaviURLGenerator:
     """ぐるなびURL自動生成クラス"""
     
-    def __init__(self):
+    def __init__(self, catalog=None):
         self.base_url = "https://r.gnavi.co.jp"
+        self.catalog = catalog
         
         # 都道府県マッピング
         self.prefecture_map = {
@@ -107,6 +132,12 @@ class GurunaviURLGenerator:
             city_code = self.city_codes[city]
             return f"{self.base_url}/city/{city_code}/rs/"
         
+        # エリアカタログに登録されている場合
+        if self.catalog:
+            node = self.catalog.find(pref_code, city)
+            if node:
+                return node['url']
+        
         # 未登録の場合はフリーワード検索
         params = {'fwp': city}
         query_string = urlencode(params)
@@ -114,6 +145,15 @@ class GurunaviURLGenerator:
     
     def get_supported_cities(self, prefecture):
         """指定都道府県でサポートされている市区町村を取得"""
+        cities = self.get_builtin_cities(prefecture)
+        if self.catalog and prefecture in self.prefecture_map:
+            for city in self.catalog.cities(self.prefecture_map[prefecture]):
+                if city not in cities:
+                    cities.append(city)
+        return cities
+    
+    def get_builtin_cities(self, prefecture):
+        """組み込みの市区町村コード表に登録されている市区町村"""
         if prefecture == '東京都':
             return [city for city in self.city_codes.keys() if '区' in city and not any(x in city for x in ['市', '町', '村'])]
         elif prefecture in ['神奈川県']:
@@ -129,6 +169,206 @@ class GurunaviURLGenerator:
         else:
             return []
 
+class AreaCatalog:
+    """エリアカタログ（都道府県 → 市区町村 → 駅・エリアの階層）
+    
+    ぐるなびの一覧ページに載っている下位エリアへのリンクを一度だけ巡回して階層を調べ、
+    JSONファイルにキャッシュする。参照はすべて辞書引きで行う。
+    異なる都道府県の巡回は並行して行ってよい（結果の差し替えと保存は排他）。
+    """
+    
+    CACHE_VERSION = 1
+    AREA_LINK_PATTERN = re.compile(r'^https?://r\.gnavi\.co\.jp/(area|city|eki)/([A-Za-z0-9]+)/rs/?$')
+    COUNT_PATTERN = re.compile(r'([\d,]+)\s*件')
+    
+    def __init__(self, cache_file, logger, max_age_days=30):
+        self.cache_file = Path(cache_file)
+        self.logger = logger
+        self.max_age_days = max_age_days
+        self.nodes = {}          # キー("city/cwtav1130000" 等) → ノード
+        self.name_index = {}     # (都道府県コード, エリア名) → キー
+        self.prefectures = {}    # 都道府県コード → {'key': ..., 'discovered_at': ...}
+        self._lock = threading.Lock()
+        self.load()
+    
+    def load(self):
+        """キャッシュ読み込み"""
+        try:
+            if self.cache_file.exists():
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == self.CACHE_VERSION:
+                    self.nodes = data.get('nodes', {})
+                    self.prefectures = data.get('prefectures', {})
+                    self._rebuild_index()
+        except Exception as e:
+            self.logger.error(f"エリアカタログ読み込みエラー: {e}")
+    
+    def save(self):
+        """キャッシュ保存"""
+        try:
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': self.CACHE_VERSION,
+                    'prefectures': self.prefectures,
+                    'nodes': self.nodes
+                }, f, ensure_ascii=False)
+        except Exception as e:
+            self.logger.error(f"エリアカタログ保存エラー: {e}")
+    
+    def is_fresh(self, pref_code):
+        """都道府県のカタログが有効期限内か"""
+        entry = self.prefectures.get(pref_code)
+        if not entry:
+            return False
+        return time.time() - entry['discovered_at'] < self.max_age_days * 86400
+    
+    def prefecture_node(self, pref_code):
+        """都道府県ノード"""
+        entry = self.prefectures.get(pref_code)
+        return self.nodes.get(entry['key']) if entry else None
+    
+    def find(self, pref_code, name):
+        """エリア名からノード取得"""
+        key = self.name_index.get((pref_code, name))
+        return self.nodes.get(key) if key else None
+    
+    def children(self, key):
+        """直下のエリア"""
+        node = self.nodes.get(key)
+        if not node:
+            return []
+        return [self.nodes[child] for child in node['children'] if child in self.nodes]
+    
+    def cities(self, pref_code):
+        """都道府県直下のエリア名一覧"""
+        node = self.prefecture_node(pref_code)
+        return [child['name'] for child in self.children(node['key'])] if node else []
+    
+    def discover(self, pref_code, pref_url, session, max_depth=2, delay=None, should_continue=None,
+                 timeout=15):
+        """都道府県のエリア階層を巡回して登録（幅優先）
+        
+        max_depth 階層目までのページを取得して件数を調べ、それより下のリンクは辿らない。
+        新しい階層は一時辞書に組み立て、都道府県ページを取得でき、かつ中断されずに
+        巡回を終えた場合だけ差し替える。それ以外は既存の階層を残して例外を送出する。
+        """
+        should_continue = should_continue or (lambda: True)
+        root_key = self.key_from_url(pref_url) or f"area/{pref_code}"
+        
+        others = {key: node for key, node in self.nodes.items() if node.get('pref') != pref_code}
+        tree = {root_key: self._new_node(root_key, pref_code, pref_url, pref_code, None, 0)}
+        
+        pending = deque([root_key])
+        fetched = 0
+        while pending and should_continue():
+            node = tree[pending.popleft()]
+            try:
+                response = session.get(node['url'], timeout=timeout)
+                response.raise_for_status()
+                count, links = self.parse_area_page(node['url'], response.text)
+                fetched += 1
+            except Exception as e:
+                if node['key'] == root_key:
+                    raise Exception(f"都道府県ページを取得できません ({node['url']}): {e}")
+                self.logger.warning(f"エリアページ取得エラー ({node['url']}): {e}")
+                continue
+            finally:
+                if delay:
+                    delay()
+            
+            node['count'] = count
+            if node['level'] >= max_depth:
+                continue
+            
+            for name, url, key in links:
+                # 先に見つかった親を優先（他エリアへの横リンクは無視）
+                if key in tree or key in others:
+                    continue
+                tree[key] = self._new_node(key, name, url, pref_code, node['key'], node['level'] + 1)
+                node['children'].append(key)
+                pending.append(key)
+        
+        if pending:
+            raise Exception(f"エリア巡回が中断されました ({pref_code}: {fetched}ページ取得)")
+        
+        with self._lock:
+            # 巡回中に他の都道府県が更新されている場合があるため、差し替え直前の状態に重ねる
+            nodes = {key: node for key, node in self.nodes.items() if node.get('pref') != pref_code}
+            nodes.update(tree)
+            self.nodes = nodes
+            self.prefectures[pref_code] = {'key': root_key, 'discovered_at': time.time()}
+            self._rebuild_index()
+            self.save()
+        self.logger.info(f"エリアカタログ更新: {pref_code} ({len(tree)}エリア, {fetched}ページ取得)")
+    
+    def partition(self, key, cap):
+        """件数が cap 以下になるまで下位エリアに分割し、開始URLのリストを返す"""
+        node = self.nodes.get(key)
+        if not node:
+            return []
+        
+        children = self.children(key)
+        count = node.get('count')
+        if (count is not None and count <= cap) or not children:
+            if count is not None and count > cap:
+                self.logger.warning(f"これ以上分割できないエリア: {node['name']} ({count}件)")
+            return [node['url']]
+        
+        urls = []
+        for child in children:
+            urls.extend(self.partition(child['key'], cap))
+        return urls
+    
+    @classmethod
+    def key_from_url(cls, url):
+        """エリアURLからキーを生成"""
+        match = cls.AREA_LINK_PATTERN.match(url.split('?')[0])
+        if not match:
+            return None
+        return f"{match.group(1)}/{match.group(2)}"
+    
+    @classmethod
+    def parse_area_page(cls, url, html):
+        """エリア一覧ページ解析
+        
+        Returns:
+            tuple: (該当件数 or None, [(エリア名, URL, キー), ...])
+        """
+        soup = BeautifulSoup(html, 'lxml')
+        own_key = cls.key_from_url(url)
+        
+        count = None
+        match = cls.COUNT_PATTERN.search(soup.get_text(' ', strip=True))
+        if match:
+            count = int(match.group(1).replace(',', ''))
+        
+        links = []
+        seen = set()
+        for anchor in soup.select('a[href]'):
+            href = urljoin(url, anchor.get('href')).split('?')[0]
+            key = cls.key_from_url(href)
+            name = anchor.get_text(strip=True)
+            if not key or key == own_key or key in seen or not name:
+                continue
+            seen.add(key)
+            links.append((name, href, key))
+        return count, links
+    
+    @staticmethod
+    def _new_node(key, name, url, pref_code, parent, level):
+        """ノード生成"""
+        return {'key': key, 'name': name, 'url': url, 'pref': pref_code,
+                'parent': parent, 'level': level, 'children': [], 'count': None}
+    
+    def _rebuild_index(self):
+        """名称索引の再構築（同名エリアは上位階層を優先）"""
+        name_index = {}
+        for key, node in sorted(self.nodes.items(), key=lambda item: -item[1]['level']):
+            if node['level'] > 0:
+                name_index[(node['pref'], node['name'])] = key
+        self.name_index = name_index
+
 class ChromeDriverFixer:
     """ChromeDriver修正クラス"""
     
@@ -220,70 +460,3619 @@ class ChromeDriverFixer:
             print(f"ダウンロードエラー: {e}")
             return None
 
-class GurunaviScraper:
-    """ぐるなびスクレイピングメインクラス"""
+# 取得項目（Excel出力の列順）
+STORE_FIELDS = (
+    'URL', '店舗名', '電話番号', '住所', 'ジャンル',
+    '営業時間', '定休日', 'クレジットカード', '取得日時'
+)
+
+class RecordStore:
+    """店舗データのコンパクト格納クラス（列指向）
+    
+    店舗ごとの辞書を持たず、項目ごとの列として保持する。
+    値の種類が少ない項目はカテゴリ番号で、取得日時はUNIX秒の整数で格納する。
+    """
+    
+    CATEGORICAL_FIELDS = ('ジャンル', '定休日', 'クレジットカード')
+    TEXT_FIELDS = ('URL', '店舗名', '電話番号', '住所', '営業時間')
+    TIMESTAMP_FIELD = '取得日時'
+    TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
     
     def __init__(self):
-        self.window = tk.Tk()
-        self.window.title("ぐるなびおすすめ店舗取得ツール v2.1")
-        self.window.geometry("950x750")
-        self.window.resizable(True, True)
+        self.clear()
+    
+    def clear(self):
+        """全データ削除"""
+        self._count = 0
+        self._text = {field: [] for field in self.TEXT_FIELDS}
+        self._codes = {field: array('I') for field in self.CATEGORICAL_FIELDS}
+        self._categories = {field: [] for field in self.CATEGORICAL_FIELDS}
+        self._category_index = {field: {} for field in self.CATEGORICAL_FIELDS}
+        self._timestamps = array('q')
+    
+    def __len__(self):
+        return self._count
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self.row(index)
+    
+    def __iter__(self):
+        for index in range(self._count):
+            yield self.row(index)
+    
+    def append(self, record):
+        """1店舗分の辞書を追加"""
+        for field in self.TEXT_FIELDS:
+            self._text[field].append(record.get(field, '-'))
         
-        # 設定
-        self.app_dir = Path.cwd()
-        self.config_file = self.app_dir / "scraper_config.json"
-        self.log_file = self.app_dir / "scraper.log"
+        for field in self.CATEGORICAL_FIELDS:
+            self._codes[field].append(self._category_code(field, record.get(field, '-')))
         
-        # 初期化
-        self.default_save_path = os.path.join(os.path.expanduser("~"), "Downloads")
-        self.is_scraping = False
-        self.scraped_data = []
-        self.driver = None
+        self._timestamps.append(self.to_epoch(record.get(self.TIMESTAMP_FIELD)))
         
-        # URL生成器
-        self.url_generator = GurunaviURLGenerator()
+        # 全列の追加後に件数を更新（他スレッドからの参照で不完全な行を見せない）
+        self._count += 1
+    
+    def row(self, index):
+        """1店舗分を辞書として復元"""
+        record = {}
+        for field in STORE_FIELDS:
+            if field in self._text:
+                record[field] = self._text[field][index]
+            elif field in self._codes:
+                record[field] = self._categories[field][self._codes[field][index]]
+            else:
+                record[field] = self.format_timestamp(self._timestamps[index])
+        return record
+    
+    def column(self, field):
+        """1項目分の値リスト"""
+        count = self._count
+        if field in self._text:
+            return self._text[field][:count]
+        if field in self._codes:
+            categories = self._categories[field]
+            return [categories[code] for code in self._codes[field][:count]]
+        return [self.format_timestamp(ts) for ts in self._timestamps[:count]]
+    
+    def to_dataframe(self):
+        """DataFrame生成（カテゴリ項目は pandas.Categorical）"""
+        count = self._count
+        data = {}
+        for field in STORE_FIELDS:
+            if field in self._codes:
+                data[field] = pd.Categorical.from_codes(
+                    list(self._codes[field][:count]),
+                    categories=pd.Index(self._categories[field], dtype=object)
+                ) if count else pd.Categorical([])
+            else:
+                data[field] = self.column(field)
+        return pd.DataFrame(data, columns=list(STORE_FIELDS))
+    
+    def _category_code(self, field, value):
+        """カテゴリ値を番号に変換（初出の値は登録）"""
+        index = self._category_index[field]
+        code = index.get(value)
+        if code is None:
+            code = len(self._categories[field])
+            self._categories[field].append(value)
+            index[value] = code
+        return code
+    
+    @classmethod
+    def to_epoch(cls, value):
+        """取得日時をUNIX秒に変換"""
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, str) and value:
+            try:
+                return int(datetime.strptime(value, cls.TIMESTAMP_FORMAT).timestamp())
+            except ValueError:
+                pass
+        return int(time.time())
+    
+    @classmethod
+    def format_timestamp(cls, epoch):
+        """UNIX秒を表示用文字列に変換"""
+        return datetime.fromtimestamp(epoch).strftime(cls.TIMESTAMP_FORMAT)
+
+class LiveStats:
+    """取得中の逐次集計（項目充足率・ジャンル/定休日の頻度・エラー件数）
+    
+    レコードが書き込まれるたびに更新し、終了後に全件を読み直さずに統計シートを作る。
+    直近 RECENT_WINDOW 件の充足率が全体の COLLAPSE_RATIO 倍を下回った項目は
+    サイト側の変更等で取得できなくなった可能性があるため警告対象とする。
+    """
+    
+    FIELDS = ('店舗名', '電話番号', '住所', 'ジャンル', '営業時間', '定休日', 'クレジットカード')
+    FREQUENCY_FIELDS = ('ジャンル', '定休日')
+    RECENT_WINDOW = 50
+    MIN_SAMPLES = 20
+    COLLAPSE_RATIO = 0.5
+    
+    def __init__(self, fields=None):
+        self.fields = tuple(field for field in self.FIELDS if not fields or field in fields)
+        self.total = 0
+        self.filled = dict.fromkeys(self.fields, 0)
+        self.frequencies = {field: Counter() for field in self.FREQUENCY_FIELDS if field in self.fields}
+        self.retries = 0
+        self.failures = 0
+        self.errors = Counter()
+        self._recent = deque(maxlen=self.RECENT_WINDOW)
+        self._warned = set()
+        self._lock = threading.Lock()
+    
+    def add(self, record):
+        """1件追加
         
-        # ログ・設定
-        self.setup_logging()
-        self.load_config()
+        Returns:
+            list: 新たに充足率が急落した項目
+        """
+        with self._lock:
+            self.total += 1
+            filled = []
+            for field in self.fields:
+                value = record.get(field, '-')
+                present = bool(value) and value != '-'
+                filled.append(present)
+                if present:
+                    self.filled[field] += 1
+            for field, counter in self.frequencies.items():
+                value = record.get(field, '-')
+                if value and value != '-':
+                    counter[value] += 1
+            self._recent.append(filled)
+            return self._collapsed()
+    
+    def record_error(self, error, retry):
+        """取得・解析エラーの記録"""
+        with self._lock:
+            if retry:
+                self.retries += 1
+            else:
+                self.failures += 1
+            self.errors[str(error).splitlines()[0][:80] if str(error) else type(error).__name__] += 1
+    
+    def fill_rate(self, field):
+        """項目の充足率 (0-1)"""
+        return self.filled[field] / self.total if self.total else 0.0
+    
+    def _collapsed(self):
+        """直近の充足率が急落した項目（各項目1回だけ報告）"""
+        if self.total < self.MIN_SAMPLES or len(self._recent) < self.RECENT_WINDOW:
+            return []
+        collapsed = []
+        for position, field in enumerate(self.fields):
+            if field in self._warned:
+                continue
+            recent_rate = sum(1 for filled in self._recent if filled[position]) / len(self._recent)
+            if recent_rate < self.fill_rate(field) * self.COLLAPSE_RATIO:
+                self._warned.add(field)
+                collapsed.append(field)
+        return collapsed
+    
+    def describe(self):
+        """画面表示用の要約"""
+        with self._lock:
+            rates = " ".join(f"{field}{self.fill_rate(field) * 100:.0f}%" for field in self.fields)
+            return f"充足率: {rates} / エラー: 再試行{self.retries}件・失敗{self.failures}件"
+    
+    def stats_rows(self, prefecture):
+        """取得統計シートの行（項目, 値, 充足率）"""
+        with self._lock:
+            rows = [('対象都道府県', prefecture, ''), ('総取得件数', self.total, '')]
+            labels = {'クレジットカード': 'クレジットカード情報あり'}
+            for field in self.fields:
+                rows.append((labels.get(field, f"{field}あり"), self.filled[field],
+                             f"{self.fill_rate(field) * 100:.1f}%"))
+            rows.append(('取得エラー（再試行）', self.retries, ''))
+            rows.append(('取得失敗（再試行上限）', self.failures, ''))
+            return rows
+    
+    def frequency_rows(self, top=50):
+        """頻度集計シートの行（区分, 値, 件数）"""
+        with self._lock:
+            rows = []
+            for field, counter in self.frequencies.items():
+                rows.extend((field, value, count) for value, count in counter.most_common(top))
+            rows.extend(('エラー', message, count) for message, count in self.errors.most_common(top))
+            return rows
+
+# 同梱の市区町村表（exe化した場合は展開先フォルダ）
+MUNICIPALITY_FILE = Path(getattr(sys, '_MEIPASS', Path(__file__).resolve().parent)) / "municipalities.csv"
+
+class AddressIndex:
+    """住所の正規化と市区町村コード付与（前方一致トライ）
+    
+    市区町村表（code, prefecture, municipality）から「都道府県+市区町村」と、
+    名前が一意に決まる市区町村名単体をキーにしたトライを作り、住所の先頭から
+    最長一致で都道府県コード・市区町村コードを求める。表にない市区町村は
+    都道府県コードだけを返す。
+    """
+    
+    TERMINAL = ''
+    POSTAL_PATTERN = re.compile(r'^〒?\d{3}-?\d{4}')
+    HYPHEN_PATTERN = re.compile(r'(?<=\d)[‐‑‒–—―−ーｰ－](?=\d)')
+    VARIANTS = str.maketrans({'ヶ': 'ケ', 'ゕ': 'ケ', 'ヵ': 'カ'})
+    
+    def __init__(self):
+        self.root = {}
+        self.names = {}             # コード → (都道府県, 市区町村)
+        self.prefecture_codes = {}  # 都道府県名 → 都道府県コード
+        self.parents = {}           # 政令市の区コード → 市コード
+    
+    @classmethod
+    def load(cls, path=MUNICIPALITY_FILE):
+        """市区町村表の読み込み"""
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = [(row['code'], row['prefecture'], row['municipality']) for row in csv.DictReader(f)]
+        index = cls()
+        index.build(rows)
+        return index
+    
+    def build(self, rows):
+        """トライ構築"""
+        keys = {}
+        name_codes = {}
+        for code, prefecture, municipality in rows:
+            self.names[code] = (prefecture, municipality)
+            if not municipality:
+                self.prefecture_codes[prefecture] = code
+            keys[self.normalize_text(prefecture + municipality)] = code
+            if municipality:
+                name_codes.setdefault(self.normalize_text(municipality), set()).add(code)
         
-        self.setup_ui()
+        # 市区町村名だけで書かれた住所用（同名の市区町村がある場合は登録しない）
+        for name, codes in name_codes.items():
+            if len(codes) == 1:
+                keys.setdefault(name, next(iter(codes)))
+        
+        # 政令市の区 → 市（「横浜市中区」の親は「横浜市」）
+        for code, (prefecture, municipality) in self.names.items():
+            for parent_code, (parent_pref, parent_name) in self.names.items():
+                if (parent_pref == prefecture and parent_name.endswith('市') and parent_code != code
+                        and municipality.startswith(parent_name)):
+                    self.parents[code] = parent_code
+                    break
+        
+        for key, code in keys.items():
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+            node[self.TERMINAL] = code
     
-    def setup_logging(self):
-        """ログ設定"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(self.log_file, encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
-        self.logger = logging.getLogger(__name__)
-        self.logger.info("アプリケーション開始 v2.1")
+    @classmethod
+    def normalize_text(cls, text):
+        """表記ゆれの正規化（NFKC・空白除去・郵便番号除去・数字間のハイフン統一）"""
+        text = unicodedata.normalize('NFKC', text or '').translate(cls.VARIANTS)
+        text = ''.join(text.split())
+        text = cls.POSTAL_PATTERN.sub('', text)
+        return cls.HYPHEN_PATTERN.sub('-', text)
     
-    def load_config(self):
-        """設定読み込み"""
-        default_config = {
-            "last_save_path": self.default_save_path,
-            "delay_min": 0.5,
-            "delay_max": 1.0,
-            "timeout": 15,
-            "headless": True,
-            "window_size": "1280,720",
-            "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "chromedriver_path": ""
-        }
+    def lookup(self, address):
+        """住所1件の変換
+        
+        Returns:
+            tuple: (都道府県コード, 市区町村コード, 正規化住所)。該当なしは空文字
+        """
+        text = self.normalize_text(address)
+        node = self.root
+        code, end = None, 0
+        for position, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            if self.TERMINAL in node:
+                code, end = node[self.TERMINAL], position + 1
+        
+        if code is None:
+            return '', '', text
+        prefecture, municipality = self.names[code]
+        return code[:2], code if len(code) == 5 else '', prefecture + municipality + text[end:]
+    
+    def lookup_column(self, addresses):
+        """住所列の一括変換（同一住所は1回だけ解析）"""
+        cache = {}
+        results = []
+        for address in addresses:
+            result = cache.get(address)
+            if result is None:
+                result = cache[address] = self.lookup(address)
+            results.append(result)
+        return results
+    
+    def area_codes(self, prefecture, city=''):
+        """検索エリアに対応する市区町村コード（市区町村名が表にない場合は空）"""
+        if not city:
+            return set()
+        target = self.normalize_text(city)
+        return {code for code, (pref, municipality) in self.names.items()
+                if pref == prefecture and municipality and self.normalize_text(municipality) == target}
+    
+    def in_area(self, pref_code, city_code, prefecture, area_codes=()):
+        """変換結果が検索エリア内か
+        
+        Returns:
+            bool or None: 判定できない場合（住所が解析できない等）は None
+        """
+        if not pref_code:
+            return None
+        if pref_code != self.prefecture_codes.get(prefecture):
+            return False
+        if not area_codes:
+            return True
+        if city_code in area_codes or self.parents.get(city_code) in area_codes:
+            return True
+        if not city_code or any(self.parents.get(code) == city_code for code in area_codes):
+            # 市区町村まで特定できない・政令市までしか特定できない
+            return None
+        return False
+
+def normalize_phone(phone):
+    """電話番号の正規化（数字のみ・国番号除去。桁数が足りない場合は空文字）"""
+    digits = re.sub(r'\D', '', unicodedata.normalize('NFKC', phone or ''))
+    if digits.startswith('81') and len(digits) >= 11:
+        digits = '0' + digits[2:]
+    return digits if len(digits) >= 9 else ''
+
+class DuplicateFinder:
+    """近似重複店舗の検出（ブロッキング + MinHash/LSH + Union-Find）
+    
+    電話番号が一致する店舗をまとめ、店舗名の文字n-gramのMinHashを帯に分けて
+    市区町村ごとのバケットに入れ、同じバケットに入った店舗だけを比較する。
+    全件総当たりを行わないため、件数にほぼ比例する時間で処理できる。
+    住所・電話番号がどちらも判明していて両方とも異なる組は重複としない。
+    
+    各バケットでは直前の window 件（既定 BUCKET_WINDOW）とだけ比較するため、
+    同じ住所の大型ビル等で1バケットが window 件を超えると、離れた位置の重複は
+    見逃す（再現率と処理時間の兼ね合い。大きくするほど見逃しは減る）。
+    """
+    
+    NGRAM = 2
+    NUM_PERM = 64
+    BANDS = 16
+    THRESHOLD = 0.6         # 店舗名の類似度(Jaccard)
+    SAME_ADDRESS_THRESHOLD = 0.3
+    BUCKET_WINDOW = 8       # バケット内で比較する直前の件数（巨大バケット対策、再現率の上限になる）
+    PRIME = (1 << 61) - 1
+    NAME_NOISE = re.compile(r'[\s・･\-‐ー－()（）「」【】\[\]/／]')
+    ADDRESS_BLOCK = re.compile(r'^(.*?\d+(?:-\d+)*)')
+    
+    def __init__(self, address_index=None, threshold=None, num_perm=None, bands=None, window=None):
+        self.address_index = address_index
+        self.threshold = threshold or self.THRESHOLD
+        self.window = max(int(window or self.BUCKET_WINDOW), 1)
+        self.num_perm = num_perm or self.NUM_PERM
+        self.bands = bands or self.BANDS
+        if self.num_perm % self.bands:
+            raise ValueError("num_perm は bands で割り切れる必要があります")
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, 1 << 31, size=self.num_perm, dtype=np.uint64)   # a * hash が64bitに収まる範囲
+        self._b = rng.integers(0, self.PRIME, size=self.num_perm, dtype=np.uint64)
+    
+    def find(self, records):
+        """重複クラスタの検出
+        
+        Returns:
+            list: [(レコード番号のリスト, 根拠の集合)]（2件以上のクラスタのみ）
+        """
+        keys = [self._keys(record) for record in records]
+        parent = list(range(len(records)))
+        reasons = {}
+        
+        def find_root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        
+        def union(i, j, reason):
+            root_i, root_j = find_root(i), find_root(j)
+            if root_i != root_j:
+                parent[root_j] = root_i
+                reasons.setdefault(root_i, set()).update(reasons.pop(root_j, ()))
+            reasons.setdefault(root_i, set()).add(reason)
+        
+        # 電話番号ブロック
+        phone_first = {}
+        for i, (phone, address, area, shingles) in enumerate(keys):
+            if not phone:
+                continue
+            j = phone_first.setdefault(phone, i)
+            if j != i and not self._contradicts(keys[i], keys[j], check_phone=False):
+                union(j, i, "電話番号一致")
+        
+        # 住所ブロック + 店舗名LSH（市区町村ごとのバケット）
+        buckets = {}
+        rows = self.num_perm // self.bands
+        signatures = self.minhash_batch([shingles for _, _, _, shingles in keys])
+        # 帯ごとのハッシュ（帯内の行を乱数倍して加算、64bitで桁あふれさせる）
+        band_hashes = (signatures.reshape(len(keys), self.bands, rows) * self._a[:rows]).sum(axis=2).tolist()
+        for i, (phone, address, area, shingles) in enumerate(keys):
+            bucket_keys = []
+            if address:
+                bucket_keys.append(('address', address))
+            if shingles:
+                bucket_keys.extend(('name', area, band, value) for band, value in enumerate(band_hashes[i]))
+            for bucket_key in bucket_keys:
+                members = buckets.setdefault(bucket_key, [])
+                for j in members[-self.window:]:
+                    if find_root(i) == find_root(j):
+                        continue
+                    reason = self._verify(keys[i], keys[j])
+                    if reason:
+                        union(j, i, reason)
+                members.append(i)
+        
+        clusters = {}
+        for i in range(len(records)):
+            clusters.setdefault(find_root(i), []).append(i)
+        return [(members, reasons.get(root, set())) for root, members in clusters.items() if len(members) > 1]
+    
+    def minhash_batch(self, shingle_sets, chunk_size=20000):
+        """MinHashシグネチャの一括計算（n-gramが空のレコードの行は未使用）"""
+        signatures = np.zeros((len(shingle_sets), self.num_perm), dtype=np.uint64)
+        for start in range(0, len(shingle_sets), chunk_size):
+            chunk = [(i, shingles) for i, shingles in enumerate(shingle_sets[start:start + chunk_size], start)
+                     if shingles]
+            if not chunk:
+                continue
+            hashes = np.array([zlib.crc32(shingle.encode('utf-8'))
+                               for _, shingles in chunk for shingle in shingles], dtype=np.uint64)
+            offsets = np.cumsum([0] + [len(shingles) for _, shingles in chunk[:-1]])
+            values = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % np.uint64(self.PRIME)
+            signatures[[i for i, _ in chunk]] = np.minimum.reduceat(values, offsets, axis=0)
+        return signatures
+    
+    def _keys(self, record):
+        """ブロッキング用のキー（電話番号, 番地までの住所, 市区町村, 店舗名n-gram）"""
+        phone = normalize_phone(record.get('電話番号'))
+        
+        # 建物名・階数（番地の後の空白以降）は除く
+        address = re.split(r'(?<=\d)\s', unicodedata.normalize('NFKC', record.get('住所') or ''))[0]
+        area = ''
+        if address in ('', '-'):
+            address = ''
+        elif self.address_index:
+            pref_code, city_code, address = self.address_index.lookup(address)
+            area = city_code or pref_code
+        else:
+            address = AddressIndex.normalize_text(address)
+        address = re.sub(r'(\d+)(?:丁目|番地?)', r'\1-', address)
+        address = re.sub(r'(\d+)号', r'\1', address)
+        match = self.ADDRESS_BLOCK.match(address)
+        address = match.group(1).rstrip('-') if match else ''
+        
+        name = record.get('店舗名') or ''
+        name = '' if name == '-' else self.NAME_NOISE.sub('', unicodedata.normalize('NFKC', name).lower())
+        if len(name) < self.NGRAM:
+            shingles = {name} if name else set()
+        else:
+            shingles = {name[k:k + self.NGRAM] for k in range(len(name) - self.NGRAM + 1)}
+        return phone, address, area, shingles
+    
+    @staticmethod
+    def _contradicts(keys_i, keys_j, check_phone=True):
+        """住所（と電話番号）がどちらも判明していて異なるか"""
+        phone_differs = keys_i[0] and keys_j[0] and keys_i[0] != keys_j[0]
+        address_differs = keys_i[1] and keys_j[1] and keys_i[1] != keys_j[1]
+        return address_differs and (phone_differs or not check_phone)
+    
+    def _verify(self, keys_i, keys_j):
+        """候補組の判定（重複なら根拠、そうでなければ None）"""
+        if self._contradicts(keys_i, keys_j):
+            return None
+        shingles_i, shingles_j = keys_i[3], keys_j[3]
+        if not shingles_i or not shingles_j:
+            return None
+        similarity = len(shingles_i & shingles_j) / len(shingles_i | shingles_j)
+        if keys_i[1] and keys_i[1] == keys_j[1] and similarity >= self.SAME_ADDRESS_THRESHOLD:
+            return "住所一致・店舗名類似"
+        if similarity >= self.threshold:
+            return "店舗名類似"
+        return None
+
+def shop_id_from_url(url):
+    """店舗URLから店舗IDを取得（例: https://r.gnavi.co.jp/abc1234/ → abc1234）"""
+    match = re.search(r'r\.gnavi\.co\.jp/([A-Za-z0-9]+)', url or '')
+    return match.group(1) if match else url
+
+# 店舗IDの一覧ファイル（1行1件、店舗IDまたは店舗URL。CSVの場合は先頭列）
+STORE_URL_TEMPLATE = "https://r.gnavi.co.jp/{}/"
+SHOP_ID_PATTERN = re.compile(r'^[A-Za-z0-9]+$')
+SHOP_ID_HEADERS = {'url', 'id', 'shop_id', '店舗id'}
+
+def store_url_from_id(shop_id):
+    """店舗IDから詳細ページURLを生成"""
+    return STORE_URL_TEMPLATE.format(shop_id)
+
+def load_shop_ids(path):
+    """店舗ID一覧ファイルの読み込み（空行・#行・重複は除外）
+    
+    Returns:
+        tuple: (店舗IDのリスト, 解釈できなかった行数)
+    """
+    shop_ids = []
+    seen = set()
+    invalid = 0
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line_number, line in enumerate(f):
+            value = re.split(r'[,\t]', line.strip(), 1)[0].strip().strip('"')
+            if not value or value.startswith('#'):
+                continue
+            if line_number == 0 and value.lower() in SHOP_ID_HEADERS:
+                continue
+            shop_id = shop_id_from_url(value) if 'gnavi.co.jp' in value else value
+            if not SHOP_ID_PATTERN.match(shop_id):
+                invalid += 1
+                continue
+            if shop_id not in seen:
+                seen.add(shop_id)
+                shop_ids.append(shop_id)
+    return shop_ids, invalid
+
+def in_shard(shop_id, shard, shards):
+    """店舗IDが分割 shard/shards（0始まり）に属するか（crc32 による固定割り当て）"""
+    return zlib.crc32(shop_id.encode('utf-8')) % shards == shard
+
+class ScrapeDatabase:
+    """取得データのローカルDB（SQLite、店舗名・住所・ジャンルの全文検索付き）
+    
+    店舗IDを主キーとして上書き保存する。全文検索は FTS5 の trigram で行うため、
+    3文字未満の検索語は LIKE 検索になる。
+    """
+    
+    COLUMNS = {
+        'URL': 'url', '店舗名': 'name', '電話番号': 'phone', '住所': 'address',
+        'ジャンル': 'genre', '営業時間': 'hours', '定休日': 'holiday',
+        'クレジットカード': 'credit_card'
+    }
+    FTS_COLUMNS = ('name', 'address', 'genre')
+    BATCH_SIZE = 200
+    
+    def __init__(self, db_path, fields=None):
+        self.db_path = str(db_path)
+        # 既存店舗の上書きは取得した項目だけ（fields 指定時、取得していない項目は保持）
+        self.update_columns = [column for field, column in self.COLUMNS.items()
+                               if fields is None or field == 'URL' or field in fields]
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._pending = []
+        self.fts_available = self._create_schema()
+    
+    def _create_schema(self):
+        """テーブル・索引作成（FTS5が使えない環境ではFalseを返す）"""
+        columns = ", ".join(f"{column} TEXT" for column in self.COLUMNS.values())
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS stores (
+                shop_id TEXT PRIMARY KEY,
+                {columns},
+                prefecture TEXT,
+                city TEXT,
+                fetched_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_stores_prefecture ON stores(prefecture);
+            CREATE INDEX IF NOT EXISTS idx_stores_genre ON stores(genre);
+        """)
         
+        fts_columns = ", ".join(self.FTS_COLUMNS)
+        new_values = ", ".join(f"new.{column}" for column in self.FTS_COLUMNS)
+        old_values = ", ".join(f"old.{column}" for column in self.FTS_COLUMNS)
         try:
-            if self.config_file.exists():
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    loaded_config = json.load(f)
-                    default_config.update(loaded_config)
-        except Exception as e:
-            self.logger.error(f"設定読み込みエラー: {e}")
+            self.conn.executescript(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS stores_fts USING fts5(
+                    {fts_columns}, content='stores', content_rowid='rowid', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS stores_ai AFTER INSERT ON stores BEGIN
+                    INSERT INTO stores_fts(rowid, {fts_columns}) VALUES (new.rowid, {new_values});
+                END;
+                CREATE TRIGGER IF NOT EXISTS stores_ad AFTER DELETE ON stores BEGIN
+                    INSERT INTO stores_fts(stores_fts, rowid, {fts_columns})
+                    VALUES ('delete', old.rowid, {old_values});
+                END;
+                CREATE TRIGGER IF NOT EXISTS stores_au AFTER UPDATE ON stores BEGIN
+                    INSERT INTO stores_fts(stores_fts, rowid, {fts_columns})
+                    VALUES ('delete', old.rowid, {old_values});
+                    INSERT INTO stores_fts(rowid, {fts_columns}) VALUES (new.rowid, {new_values});
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False
+    
+    def write(self, record, prefecture='', city=''):
+        """1件書き込み（BATCH_SIZE件ごとにまとめてコミット）"""
+        fetched_at = record.get('取得日時')
+        if isinstance(fetched_at, str):
+            fetched_at = RecordStore.to_epoch(fetched_at)
+        row = [shop_id_from_url(record.get('URL'))]
+        row += [record.get(field, '-') for field in self.COLUMNS]
+        row += [prefecture, city, int(fetched_at or time.time())]
+        self._pending.append(row)
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+    
+    def flush(self):
+        """未コミット分の書き込み"""
+        if not self._pending:
+            return
+        columns = list(self.COLUMNS.values())
+        names = ", ".join(['shop_id'] + columns + ['prefecture', 'city', 'fetched_at'])
+        placeholders = ", ".join("?" * (len(columns) + 4))
+        updates = ", ".join([f"{name}=excluded.{name}" for name in self.update_columns + ['fetched_at']] +
+                            # 店舗ID指定の再取得では都道府県・市区町村が空のため既存の値を残す
+                            [f"{name}=COALESCE(NULLIF(excluded.{name}, ''), stores.{name})"
+                             for name in ('prefecture', 'city')])
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO stores ({names}) VALUES ({placeholders}) "
+                f"ON CONFLICT(shop_id) DO UPDATE SET {updates}",
+                self._pending
+            )
+        self._pending = []
+    
+    def search(self, text=None, prefecture=None, genre=None, accepts_card=False, limit=100):
+        """店舗検索
+        
+        Args:
+            text: 店舗名・住所・ジャンルの全文検索語
+            prefecture: 都道府県（完全一致）
+            genre: ジャンル（部分一致）
+            accepts_card: Trueの場合クレジットカード利用可の店舗のみ
+        """
+        where = []
+        params = []
+        fts_terms = []
+        
+        for column, term in ((None, text), ('genre', genre)):
+            if not term:
+                continue
+            if self.fts_available and len(term) >= 3:
+                quoted = '"' + term.replace('"', '""') + '"'
+                fts_terms.append(f"{column} : {quoted}" if column else quoted)
+            else:
+                targets = [column] if column else list(self.FTS_COLUMNS)
+                where.append("(" + " OR ".join(f"s.{c} LIKE ?" for c in targets) + ")")
+                params.extend([f"%{term}%"] * len(targets))
+        
+        if prefecture:
+            where.append("s.prefecture = ?")
+            params.append(prefecture)
+        if accepts_card:
+            where.append("s.credit_card NOT IN ('-', '') AND s.credit_card NOT LIKE '%不可%'")
+        
+        sql = "SELECT s.* FROM stores s"
+        if fts_terms:
+            sql += " JOIN stores_fts f ON f.rowid = s.rowid"
+            where.insert(0, "stores_fts MATCH ?")
+            params.insert(0, " AND ".join(fts_terms))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " LIMIT ?"
+        params.append(int(limit))
+        
+        return [dict(row) for row in self.conn.execute(sql, params)]
+    
+    def iter_records(self, prefecture=None):
+        """登録店舗の読み出し（画面・Excelと同じ項目名のレコード）"""
+        sql = "SELECT * FROM stores"
+        params = []
+        if prefecture:
+            sql += " WHERE prefecture = ?"
+            params.append(prefecture)
+        for row in self.conn.execute(sql, params):
+            record = {field: row[column] for field, column in self.COLUMNS.items()}
+            record['店舗ID'] = row['shop_id']
+            record['都道府県'] = row['prefecture']
+            yield record
+    
+    def fetched_since(self, since):
+        """指定時刻（UNIX秒）以降に取得済みの店舗ID"""
+        return {row[0] for row in self.conn.execute("SELECT shop_id FROM stores WHERE fetched_at >= ?", (int(since),))}
+    
+    def count(self):
+        """登録店舗数"""
+        return self.conn.execute("SELECT COUNT(*) FROM stores").fetchone()[0]
+    
+    def close(self):
+        """書き込み確定・切断"""
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+class RetryScheduler:
+    """取得URLスケジューラ（失敗URLは指数バックオフで再投入）
+    
+    新規URLは即時実行キューへ、失敗したURLは待機ヒープへ入れるため、
+    再試行待ちのURLが正常なURLの取得を妨げない。
+    """
+    
+    def __init__(self, max_retries=3, backoff_base=2.0, backoff_max=60.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._ready = deque()
+        self._delayed = []
+        self._seq = 0
+        self.attempts = {}
+        self.last_errors = {}
+        self.failed = []
+    
+    def add(self, url):
+        """URL追加（登録済みURLは無視）"""
+        if url in self.attempts:
+            return False
+        self.attempts[url] = 0
+        self._ready.append(url)
+        return True
+    
+    def next_url(self):
+        """実行可能なURLを1件取得（なければNone）"""
+        self._promote_due()
+        if self._ready:
+            return self._ready.popleft()
+        return None
+    
+    def next_wait(self):
+        """次の再試行までの秒数（待機中URLがなければNone）"""
+        if not self._delayed:
+            return None
+        return max(self._delayed[0][0] - time.time(), 0.0)
+    
+    def peek_url(self):
+        """次に実行されるURLを参照（取り出さない）"""
+        self._promote_due()
+        if self._ready:
+            return self._ready[0]
+        return None
+    
+    def ready_count(self):
+        """即時実行可能なURL数"""
+        self._promote_due()
+        return len(self._ready)
+    
+    def has_pending(self):
+        """未処理URLの有無"""
+        return bool(self._ready or self._delayed)
+    
+    def record_success(self, url):
+        """取得成功を記録"""
+        self.last_errors.pop(url, None)
+    
+    def record_failure(self, url, error):
+        """取得失敗を記録（上限を超えたら恒久失敗、それ以外は再投入）
+        
+        Returns:
+            bool: 再試行される場合True
+        """
+        self.attempts[url] = self.attempts.get(url, 0) + 1
+        self.last_errors[url] = str(error)
+        
+        if self.attempts[url] > self.max_retries:
+            self.failed.append({
+                'URL': url,
+                '試行回数': self.attempts[url],
+                '最終エラー': self.last_errors.pop(url)
+            })
+            return False
+        
+        delay = min(self.backoff_base * (2 ** (self.attempts[url] - 1)), self.backoff_max)
+        delay *= random.uniform(0.8, 1.2)
+        self._seq += 1
+        heapq.heappush(self._delayed, (time.time() + delay, self._seq, url))
+        return True
+    
+    def _promote_due(self):
+        """待機時間を過ぎたURLを実行キューへ移動"""
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, url = heapq.heappop(self._delayed)
+            self._ready.append(url)
+
+class CircuitBreaker:
+    """サーキットブレーカー（直近のエラー率が高い場合に取得を一時停止）"""
+    
+    def __init__(self, window=20, error_rate=0.5, min_samples=5, cooldown=30.0):
+        self.error_rate = error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._half_open = False
+        self.trip_count = 0
+    
+    def allow(self):
+        """取得可否（停止中でもクールダウン経過後は試行を1件だけ許可し、結果が出るまで他は止める）"""
+        if self._opened_at is None:
+            return True
+        if not self._half_open and time.time() - self._opened_at >= self.cooldown:
+            self._half_open = True
+            return True
+        return False
+    
+    def release(self):
+        """allow() で許可された試行を使わなかった場合に戻す"""
+        self._half_open = False
+    
+    def remaining(self):
+        """停止解除までの秒数"""
+        if self._opened_at is None:
+            return 0.0
+        return max(self.cooldown - (time.time() - self._opened_at), 0.0)
+    
+    def record(self, success):
+        """取得結果を記録"""
+        if self._half_open:
+            self._half_open = False
+            if success:
+                self._opened_at = None
+                self._outcomes.clear()
+            else:
+                self._opened_at = time.time()
+                self.trip_count += 1
+            return
+        
+        self._outcomes.append(success)
+        if self._opened_at is None and len(self._outcomes) >= self.min_samples:
+            failures = self._outcomes.count(False)
+            if failures / len(self._outcomes) >= self.error_rate:
+                self._opened_at = time.time()
+                self.trip_count += 1
+    
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+class BrowserManager:
+    """ブラウザセッション管理クラス
+    
+    表示ページ数とブラウザのメモリ使用量(RSS)を監視し、しきい値に達したら
+    セッションを計画的に作り直す。しきい値の手前で予備のブラウザを裏で起動しておき、
+    入れ替え時の待ち時間をなくす。
+    """
+    
+    PREWARM_RATIO = 0.8        # しきい値に対してこの割合に達したら予備を起動
+    RSS_CHECK_INTERVAL = 10    # RSS確認間隔（ページ数）
+    
+    def __init__(self, factory, logger, max_pages=300, max_rss_mb=1500, prewarm=True, timeouts=None,
+                 route=None):
+        self.factory = factory
+        self.logger = logger
+        self.route = route         # 送信経路（プロキシ・User-Agent）
+        self.timeouts = timeouts   # () -> ページ読み込みタイムアウト秒
+        self._applied_timeouts = None
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.prewarm = prewarm
+        self.driver = None
+        self.page_count = 0
+        self.recycle_count = 0
+        self.last_rss_mb = 0.0
+        self._spare = None
+        self._spare_thread = None
+        self._discard_spare = False    # 終了後に起動完了した予備は破棄する
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """初回セッション起動"""
+        self.driver = self.factory()
+        self.page_count = 0
+    
+    def get(self, url):
+        """ページ遷移（必要に応じて事前にセッションを入れ替え）"""
+        self.check_health()
+        self.apply_timeouts()
+        try:
+            self.driver.get(url)
+        except WebDriverException:
+            # ブラウザが落ちていれば入れ替えてから呼び出し元に失敗を返す
+            if not self.is_alive():
+                self.recycle("ブラウザ応答なし")
+            raise
+        finally:
+            self.page_count += 1
+    
+    def check_health(self):
+        """しきい値確認（予備の起動・セッション入れ替え）"""
+        if self.page_count and self.page_count % self.RSS_CHECK_INTERVAL == 0:
+            self.last_rss_mb = self.rss_mb()
+        
+        near_limit = (self.page_count >= self.max_pages * self.PREWARM_RATIO or
+                      self.last_rss_mb >= self.max_rss_mb * self.PREWARM_RATIO)
+        if near_limit and self.prewarm:
+            self._prepare_spare()
+        
+        if self.page_count >= self.max_pages:
+            self.recycle(f"ページ数上限 ({self.page_count}ページ)")
+        elif self.last_rss_mb >= self.max_rss_mb:
+            self.recycle(f"メモリ上限 ({self.last_rss_mb:.0f}MB)")
+    
+    def apply_timeouts(self):
+        """タイムアウト設定の反映（実行中の設定変更に追従）"""
+        if not self.timeouts:
+            return
+        page_load_timeout = self.timeouts()
+        if page_load_timeout == self._applied_timeouts:
+            return
+        self.driver.set_page_load_timeout(page_load_timeout)
+        self._applied_timeouts = page_load_timeout
+    
+    def rss_mb(self):
+        """ブラウザ関連プロセス(chromedriver + Chrome)の合計RSS(MB)"""
+        if not PSUTIL_AVAILABLE or not self.driver:
+            return 0.0
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            total = root.memory_info().rss
+            for child in root.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    continue
+            return total / (1024 * 1024)
+        except Exception:
+            return 0.0
+    
+    def is_alive(self):
+        """セッション生存確認"""
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+    
+    def recycle(self, reason):
+        """セッション入れ替え（予備があれば使用）"""
+        self.logger.info(f"ブラウザ再起動: {reason}")
+        old_driver = self.driver
+        
+        new_driver = self._take_spare()
+        if new_driver is None:
+            new_driver = self.factory()
         
-        self.config = default_config
+        self.driver = new_driver
+        self._applied_timeouts = None
+        self.page_count = 0
+        self.last_rss_mb = 0.0
+        self.recycle_count += 1
+        self._quit(old_driver)
+    
+    def quit(self):
+        """全セッション終了（起動中の予備は待たず、起動完了時に終了させる）"""
+        self._quit(self.driver)
+        self.driver = None
+        with self._lock:
+            spare, self._spare = self._spare, None
+            thread, self._spare_thread = self._spare_thread, None
+            if spare is None and thread is not None and thread.is_alive():
+                self._discard_spare = True
+        self._quit(spare)
+    
+    def _prepare_spare(self):
+        """予備セッションをバックグラウンドで起動"""
+        with self._lock:
+            if self._spare is not None or self._spare_thread is not None:
+                return
+            self._spare_thread = threading.Thread(target=self._build_spare, daemon=True)
+            self._spare_thread.start()
+    
+    def _build_spare(self):
+        """予備セッション生成（バックグラウンドスレッド）"""
+        try:
+            spare = self.factory()
+        except Exception as e:
+            self.logger.warning(f"予備ブラウザ起動エラー: {e}")
+            spare = None
+        with self._lock:
+            discard, self._discard_spare = self._discard_spare, False
+            if not discard:
+                self._spare = spare
+        if discard:
+            self._quit(spare)
+    
+    def _take_spare(self):
+        """予備セッションを取り出す（起動中なら完了を待つ）"""
+        thread = self._spare_thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            spare = self._spare
+            self._spare = None
+            self._spare_thread = None
+        return spare
+    
+    @staticmethod
+    def _quit(driver):
+        """セッション終了（エラーは無視）"""
+        if driver is None:
+            return
+        try:
+            driver.quit()
+        except:
+            pass
+
+class Tracer:
+    """処理時間トレース（Chrome trace-event形式）
+    
+    span() で囲んだ区間を完了イベント(ph: X)として記録し、店舗・一覧ページごとの
+    取得開始から確定までを非同期イベント(ph: b/e)として記録する。
+    出力したJSONは chrome://tracing や Perfetto で開ける。
+    """
+    
+    MAX_EVENTS = 500000   # 記録上限（超えた分は捨てる）
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.events = []
+        self.dropped = 0
+        self._threads = {}
+        self._open = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def now_us():
+        """現在時刻(µs)（プロセス間で比較できるよう壁時計を使う）"""
+        return time.time_ns() // 1000
+    
+    def span(self, name, cat='scrape', **args):
+        """区間記録用のコンテキストマネージャ"""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, cat, args)
+    
+    @contextmanager
+    def _span(self, name, cat, args):
+        start = self.now_us()
+        try:
+            yield
+        finally:
+            self._add({'name': name, 'cat': cat, 'ph': 'X', 'ts': start,
+                       'dur': self.now_us() - start, 'args': args})
+    
+    def begin(self, key, name, cat='store', **args):
+        """非同期区間の開始（店舗・一覧ページ単位）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._open.add(key)
+        self._add({'name': name, 'cat': cat, 'ph': 'b', 'id': key, 'ts': self.now_us(), 'args': args})
+    
+    def end(self, key, name, cat='store', **args):
+        """非同期区間の終了（開始していない区間は無視）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if key not in self._open:
+                return
+            self._open.discard(key)
+        self._add({'name': name, 'cat': cat, 'ph': 'e', 'id': key, 'ts': self.now_us(), 'args': args})
+    
+    def extend(self, events):
+        """他プロセスで記録したイベントの取り込み"""
+        with self._lock:
+            room = self.MAX_EVENTS - len(self.events)
+            self.events.extend(events[:max(room, 0)])
+            self.dropped += max(len(events) - max(room, 0), 0)
+    
+    def export(self):
+        """イベント一覧（スレッド名のメタデータを含む）"""
+        with self._lock:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                         'args': {'name': name}} for tid, name in self._threads.items()]
+            return self.events + metadata
+    
+    def write(self, path):
+        """トレースファイル出力"""
+        data = {'traceEvents': self.export(), 'displayTimeUnit': 'ms'}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    
+    def _add(self, event):
+        thread = threading.current_thread()
+        event['pid'] = self.pid
+        event['tid'] = thread.ident
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            if len(self.events) >= self.MAX_EVENTS:
+                self.dropped += 1
+                return
+            self.events.append(event)
+
+NULL_TRACER = Tracer(enabled=False)
+
+def polite_wait(seconds, cancel_event=None):
+    """アクセス間隔・頻度制限のための待機（停止要求で中断した場合は True）
+    
+    ScrapeProfiler はこの関数を含むスタックを「待機(sleep)」に分類する。
+    """
+    if cancel_event is None:
+        time.sleep(seconds)
+        return False
+    return cancel_event.wait(seconds)
+
+class ScrapeProfiler:
+    """取得処理のプロファイラ（決定的プロファイル + サンプリング）
+    
+    wrap() したスレッドごとに cProfile を有効にして pstats ファイルにまとめ、
+    別スレッドで sys._current_frames() を一定間隔で採取して collapsed-stack 形式
+    （flamegraph.pl / speedscope で読める）に集計する。採取したスタックから
+    取得処理の経過時間を Python処理 / WebDriver通信 / 待機 / キュー待ち に分類する。
+    解析プロセスプール内の処理はサンプリング対象外。
+    """
+    
+    SAMPLE_INTERVAL = 0.005
+    CATEGORIES = ('Python処理', 'WebDriver通信', '待機(sleep)', 'キュー待ち')
+    IO_MODULES = ('selenium', 'urllib3', 'requests', os.path.join('http', 'client.py'), 'socket.py', 'ssl.py')
+    WAIT_MODULES = ('threading.py', 'queue.py', os.path.join('concurrent', 'futures'))
+    
+    def __init__(self, interval=None):
+        self.interval = interval or self.SAMPLE_INTERVAL
+        self.stacks = Counter()
+        self.split = dict.fromkeys(self.CATEGORIES, 0)
+        self.samples = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self._profiles = []
+        self._main_profile = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self._cpu_started = None
+        self._main_ident = threading.main_thread().ident
+    
+    def start(self):
+        """計測開始（呼び出しスレッドも決定的プロファイルの対象）"""
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._main_profile = self._enable()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._sampler.start()
+    
+    def stop(self):
+        """計測終了"""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self._main_profile is not None:
+            self._main_profile.disable()
+        self.wall_seconds = time.perf_counter() - self._started
+        self.cpu_seconds = time.process_time() - self._cpu_started
+    
+    def wrap(self, func):
+        """スレッド関数を決定的プロファイル付きにする"""
+        def run(*args):
+            profile = self._enable()
+            try:
+                return func(*args)
+            finally:
+                if profile is not None:
+                    profile.disable()
+        return run
+    
+    def _enable(self):
+        """スレッド用プロファイル開始（他のプロファイラが有効な環境では省略）"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12以降は同時に1つしか有効にできない
+            return None
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+    
+    def _sample_loop(self):
+        """スタック採取（別スレッド）"""
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in (own_ident, self._main_ident):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame)
+                    frame = frame.f_back
+                # このモジュールの処理を含むスレッドだけ集計（ログ出力スレッド等は除外）
+                if not any(f.f_code.co_filename == __file__ for f in stack):
+                    continue
+                labels = [f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_code.co_firstlineno})"
+                          for f in reversed(stack)]
+                self.stacks[";".join([names.get(ident, str(ident))] + labels)] += 1
+                self.split[self.classify(stack)] += 1
+                self.samples += 1
+    
+    @classmethod
+    def classify(cls, stack):
+        """スタック（末端から順）の分類"""
+        if any(frame.f_code is polite_wait.__code__ for frame in stack):
+            return '待機(sleep)'
+        for frame in stack:
+            filename = frame.f_code.co_filename
+            if any(module in filename for module in cls.IO_MODULES):
+                return 'WebDriver通信'
+        leaf = stack[0]
+        line = linecache.getline(leaf.f_code.co_filename, leaf.f_lineno)
+        if 'sleep(' in line:
+            return '待機(sleep)'
+        if any(leaf.f_code.co_filename.endswith(module) or module in leaf.f_code.co_filename
+               for module in cls.WAIT_MODULES):
+            return 'キュー待ち'
+        return 'Python処理'
+    
+    def summary(self):
+        """経過時間の内訳"""
+        total = max(self.samples, 1)
+        lines = [f"経過時間: {self.wall_seconds:.1f}秒 / CPU時間(本プロセス): {self.cpu_seconds:.1f}秒",
+                 f"サンプル数: {self.samples} (間隔 {self.interval * 1000:.0f}ms、取得スレッド合計)"]
+        for category in self.CATEGORIES:
+            count = self.split[category]
+            lines.append(f"  {category}: {count / total * 100:.1f}% ({count * self.interval:.1f}秒相当)")
+        return lines
+    
+    def write(self, base_path):
+        """pstats・collapsed-stack・内訳ファイル出力
+        
+        Returns:
+            list: 出力したファイルパス
+        """
+        paths = []
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # 計測データのないプロファイル
+                continue
+        if stats is not None:
+            stats.dump_stats(f"{base_path}_profile.pstats")
+            paths.append(f"{base_path}_profile.pstats")
+        
+        with open(f"{base_path}_profile.collapsed.txt", 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        paths.append(f"{base_path}_profile.collapsed.txt")
+        
+        with open(f"{base_path}_profile_summary.txt", 'w', encoding='utf-8') as f:
+            f.write("\n".join(self.summary()) + "\n")
+        paths.append(f"{base_path}_profile_summary.txt")
+        return paths
+
+def traced_call(func, args):
+    """解析関数をトレース付きで実行（プロセスプールで実行）
+    
+    Returns:
+        tuple: (解析結果, トレースイベントのリスト)
+    """
+    tracer = Tracer()
+    result = func(*args, tracer=tracer)
+    return result, tracer.export()
+
+# 店舗詳細ページの項目別セレクタ（先頭から順に試す）
+STORE_FIELD_SELECTORS = {
+    '店舗名': ['h1', '.shop-name', '.restaurant-name'],
+    '電話番号': ['a[href^="tel:"]', '.phone', '.tel', '[class*="phone"]'],
+    '住所': ['.address', '.shop-address', '[class*="address"]'],
+    'ジャンル': ['.genre', '.category', '[class*="genre"]'],
+    '営業時間': ['.business-hours', '.opening-hours', '[class*="hours"]'],
+    '定休日': ['.holiday', '.closed', '[class*="holiday"]'],
+    'クレジットカード': ['.credit-card', '[class*="credit"]', '[class*="card"]']
+}
+
+# 一覧ページの店舗リンク・次ページリンクのセレクタ
+STORE_LINK_SELECTORS = [
+    "a[href*='r.gnavi.co.jp/'][href*='/']",
+    ".shop-info a",
+    ".restaurant-item a",
+    ".shop-list a",
+    ".shop-name a",
+    "li a[href*='r.gnavi.co.jp']"
+]
+NEXT_PAGE_SELECTORS = ["a[class*='next']", ".pager_next a", ".next a"]
+MAX_LINKS_PER_PAGE = 30
+MAX_STORE_COUNT = 3000     # 1ジョブの最大取得店舗数（一覧の上限を超える分はエリア分割で取得）
+
+# 一覧ページの店舗カードと、カード内で取得できる項目のセレクタ
+LISTING_CARD_SELECTORS = [
+    "[class*='result-cassette']",
+    ".shop-info",
+    ".restaurant-item",
+    ".shop-list li",
+    "article"
+]
+LISTING_FIELD_SELECTORS = {
+    '店舗名': ["[class*='title']", '.shop-name', 'h2', 'h3'],
+    'ジャンル': ["[class*='genre']", '.category', "[class*='category']"],
+    '住所': ["[class*='area']", "[class*='access']", "[class*='address']"]
+}
+# 一覧カードの値が詳細ページと同じ項目（カードの住所は最寄り駅・アクセス表記のことが多い）
+LISTING_EXACT_FIELDS = ('店舗名', 'ジャンル')
+
+def plan_fields(fields, listing_only=False, listing_detail_fields=()):
+    """取得項目から取得方法を決める
+    
+    fields（取得項目、空なら全項目）が全て LISTING_EXACT_FIELDS の場合は詳細ページを取得しない。
+    住所は一覧カードでは駅・アクセス表記になるため、listing_only を明示した場合だけカードから取る。
+    
+    Returns:
+        tuple: (一覧のみで取得するか, 詳細ページで取得する項目 or None（全項目）)
+    """
+    listing_detail_fields = tuple(field for field in STORE_FIELD_SELECTORS if field in listing_detail_fields)
+    if not fields:
+        return listing_only, (listing_detail_fields if listing_only else None)
+    requested = [field for field in STORE_FIELD_SELECTORS if field in fields]
+    if listing_only:
+        return True, tuple(field for field in listing_detail_fields if field in requested)
+    if all(field in LISTING_EXACT_FIELDS for field in requested):
+        return True, ()
+    return False, tuple(requested)
+
+def is_valid_store_url(url):
+    """有効店舗URLチェック"""
+    if not url:
+        return False
+    
+    # 除外パターン
+    exclude_patterns = ['/rs/', '/area/', '/search', '/guide', '/api/']
+    for pattern in exclude_patterns:
+        if pattern in url:
+            return False
+    
+    # 有効パターン
+    valid_patterns = [
+        r'r\.gnavi\.co\.jp/[a-zA-Z0-9]+/?',
+        r'r\.gnavi\.co\.jp/[a-zA-Z0-9]+/[a-zA-Z0-9]*/?'
+    ]
+    
+    return any(re.search(pattern, url) for pattern in valid_patterns)
+
+def select_text(soup, selectors):
+    """セレクタ順にテキスト抽出（最初に空でない値を返す）"""
+    return select_text_hit(soup, selectors)[0]
+
+def select_text_hit(soup, selectors):
+    """セレクタ順にテキスト抽出
+    
+    Returns:
+        tuple: (テキスト, 命中したセレクタ or None, 試したセレクタ数)
+    """
+    for tried, selector in enumerate(selectors, 1):
+        try:
+            element = soup.select_one(selector)
+        except Exception:
+            continue
+        if element is None:
+            continue
+        text = element.get_text(' ', strip=True)
+        if text:
+            return text, selector, tried
+    return '', None, len(selectors)
+
+def parse_listing_cards(soup, url, fetched_at, fields=None):
+    """一覧ページの店舗カードから部分レコードを生成
+    
+    カードに載っていない項目と、fields 指定時にそれ以外の項目は「-」とする。
+    """
+    cards = []
+    for selector in LISTING_CARD_SELECTORS:
+        try:
+            elements = soup.select(selector)
+        except Exception:
+            continue
+        
+        seen = set()
+        for element in elements:
+            store_url = None
+            for anchor in element.select('a[href]'):
+                href = urljoin(url, anchor.get('href'))
+                if is_valid_store_url(href):
+                    store_url = href
+                    break
+            if store_url is None or store_url in seen:
+                continue
+            seen.add(store_url)
+            
+            record = {field: '-' for field in STORE_FIELDS}
+            record['URL'] = store_url
+            record['取得日時'] = fetched_at
+            for field, field_selectors in LISTING_FIELD_SELECTORS.items():
+                if fields is None or field in fields:
+                    record[field] = select_text(element, field_selectors) or '-'
+            cards.append(record)
+        
+        # 最初に店舗カードが見つかったセレクタの結果を採用
+        if cards:
+            break
+    
+    return cards
+
+def parse_listing_html(url, html, fetched_at, fields=None, tracer=None):
+    """一覧ページHTMLの解析（プロセスプールで実行、fields: カードから取る項目）
+    
+    Returns:
+        tuple: (店舗URLリスト, 次ページURL or None, 店舗カードの部分レコードリスト)
+    """
+    tracer = tracer or NULL_TRACER
+    with tracer.span("HTML解析", 'parse', url=url):
+        soup = BeautifulSoup(html, 'lxml')
+    with tracer.span("カード抽出", 'parse', url=url):
+        cards = parse_listing_cards(soup, url, fetched_at, fields)
+    
+    links = [card['URL'] for card in cards][:MAX_LINKS_PER_PAGE]
+    for selector in STORE_LINK_SELECTORS:
+        if len(links) >= MAX_LINKS_PER_PAGE:
+            break
+        try:
+            elements = soup.select(selector)
+        except Exception:
+            continue
+        for element in elements:
+            href = element.get('href')
+            if not href:
+                continue
+            href = urljoin(url, href)
+            if is_valid_store_url(href) and href not in links:
+                links.append(href)
+                if len(links) >= MAX_LINKS_PER_PAGE:
+                    break
+    
+    next_url = None
+    for selector in NEXT_PAGE_SELECTORS:
+        element = soup.select_one(selector)
+        if element is not None and element.get('href'):
+            next_url = urljoin(url, element.get('href'))
+            break
+    
+    return links, next_url, cards
+
+def parse_store_html(url, html, fetched_at, fields=None, selector_plan=None, tracer=None):
+    """店舗詳細HTMLの解析（プロセスプールで実行）
+    
+    fields を指定した場合はその項目だけを探索する（詳細ページの項目がなければ ValueError）。
+    selector_plan（項目 → セレクタ順）を指定した場合はその順で探索する。
+    店舗ページかどうかは取得項目によらず店舗名の有無で判定し、店舗名も対象項目も
+    見つからないページ（ブロック・空ページ）は取得失敗として例外を送出する。
+    店舗ページで見つからない項目は '-' とする。
+    
+    Returns:
+        tuple: (店舗データ, {項目: (命中セレクタ or None, 試したセレクタのリスト)})
+    """
+    tracer = tracer or NULL_TRACER
+    with tracer.span("HTML解析", 'parse', url=url):
+        soup = BeautifulSoup(html, 'lxml')
+    targets = [field for field in STORE_FIELD_SELECTORS if fields is None or field in fields]
+    if not targets:
+        raise ValueError(f"詳細ページで取得できる項目が指定されていません: {fields}")
+    selector_plan = selector_plan or STORE_FIELD_SELECTORS
+    
+    store_data = {'URL': url}
+    hits = {}
+    for field in targets:
+        selectors = selector_plan.get(field) or STORE_FIELD_SELECTORS[field]
+        with tracer.span(f"抽出 {field}", 'parse', url=url):
+            text, hit, tried = select_text_hit(soup, selectors)
+        hits[field] = (hit, selectors[:tried])
+        if field == '電話番号' and text:
+            phone_match = re.search(r'(\d{2,4}[-\s]?\d{2,4}[-\s]?\d{4})', text)
+            if phone_match:
+                text = phone_match.group(1)
+        store_data[field] = text.strip() or '-'
+    store_data['取得日時'] = fetched_at
+    
+    if all(store_data[field] == '-' for field in targets):
+        if '店舗名' in targets:
+            raise ValueError("店舗情報を取得できませんでした")
+        name, _, _ = select_text_hit(soup, selector_plan.get('店舗名') or STORE_FIELD_SELECTORS['店舗名'])
+        if not name.strip():
+            raise ValueError("店舗情報を取得できませんでした")
+    
+    return store_data, hits
+
+class SelectorStats:
+    """セレクタ命中統計（項目ごとの探索順の学習）
+    
+    項目・セレクタごとに命中数と試行数を記録してファイルに保存し、
+    命中率の高い順に探索順を並べ替える。十分試して一度も命中しないセレクタは
+    探索順から外すが、サイト変更に備えて一定間隔で全セレクタを試す。
+    """
+    
+    MIN_TRIES_TO_DROP = 50      # この回数試して命中0なら探索順から外す
+    REPROBE_INTERVAL = 100      # 全セレクタを試す間隔（計画回数）
+    
+    def __init__(self, stats_file, logger):
+        self.stats_file = Path(stats_file)
+        self.logger = logger
+        self.stats = {}          # 項目 → {セレクタ: [命中数, 試行数]}
+        self._plans = 0
+        self._lock = threading.Lock()
+        self.load()
+    
+    def load(self):
+        """統計読み込み"""
+        try:
+            if self.stats_file.exists():
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    self.stats = json.load(f)
+        except Exception as e:
+            self.logger.error(f"セレクタ統計読み込みエラー: {e}")
+    
+    def save(self):
+        """統計保存（一時ファイルに書いて置き換えるため、同時に保存しても壊れない）"""
+        try:
+            temp_file = self.stats_file.with_name(self.stats_file.name + '.tmp')
+            with self._lock:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.stats, f, ensure_ascii=False, indent=2)
+                os.replace(temp_file, self.stats_file)
+        except Exception as e:
+            self.logger.error(f"セレクタ統計保存エラー: {e}")
+    
+    def plan(self, field_selectors=None):
+        """項目ごとの探索順"""
+        field_selectors = field_selectors or STORE_FIELD_SELECTORS
+        with self._lock:
+            self._plans += 1
+            reprobe = self._plans % self.REPROBE_INTERVAL == 0
+            return {field: self._order(field, selectors, reprobe)
+                    for field, selectors in field_selectors.items()}
+    
+    def _order(self, field, selectors, reprobe):
+        """命中率順に並べ替え（未試行のセレクタは中程度として扱う）"""
+        field_stats = self.stats.get(field, {})
+        
+        def score(selector):
+            hits, tries = field_stats.get(selector, (0, 0))
+            return (hits + 1) / (tries + 2)
+        
+        ordered = sorted(selectors, key=score, reverse=True)
+        if reprobe:
+            return ordered
+        
+        kept = [selector for selector in ordered
+                if not (field_stats.get(selector, (0, 0))[1] >= self.MIN_TRIES_TO_DROP and
+                        field_stats.get(selector, (0, 0))[0] == 0)]
+        return kept or ordered
+    
+    def record(self, hits):
+        """解析結果の命中状況を記録"""
+        with self._lock:
+            for field, (hit, tried) in hits.items():
+                field_stats = self.stats.setdefault(field, {})
+                for selector in tried:
+                    entry = field_stats.setdefault(selector, [0, 0])
+                    entry[1] += 1
+                    if selector == hit:
+                        entry[0] += 1
+
+class PipelineStage:
+    """パイプライン段（上限付き入力キューと統計）"""
+    
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.queue = queue.Queue(maxsize)
+        self.processed = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()   # 取得段は複数スレッドから統計を更新する
+    
+    def put(self, item, should_abort):
+        """投入（キューが満杯の間は待機し、待ち時間を背圧として記録）"""
+        start = time.time()
+        while True:
+            try:
+                self.queue.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                if should_abort():
+                    with self._lock:
+                        self.blocked_seconds += time.time() - start
+                    return False
+        with self._lock:
+            self.blocked_seconds += time.time() - start
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+    
+    def get(self, timeout=0.2):
+        """取り出し（タイムアウト時はqueue.Emptyを送出）"""
+        return self.queue.get(timeout=timeout)
+    
+    def add_processed(self):
+        """処理件数の加算"""
+        with self._lock:
+            self.processed += 1
+    
+    def depth(self):
+        """現在のキュー滞留数"""
+        return self.queue.qsize()
+    
+    def summary(self):
+        """統計文字列"""
+        return (f"{self.name}: 待ち{self.depth()}/{self.queue.maxsize} "
+                f"(最大{self.max_depth}) 処理{self.processed}件 背圧{self.blocked_seconds:.1f}秒")
+
+class ScrapePipeline:
+    """取得パイプライン（取得 → 解析 → 書き込みの3段構成）
+    
+    取得段（スレッド・ブラウザごとに1本）がHTMLを取得し、解析段（プロセスプール）が
+    HTMLから項目を抽出し、書き込み段（単一スレッド）がレコードを保存する。
+    段の間は上限付きキューで接続し、下流が詰まると上流が待機する。
+    一覧ページも同じ段を通り、解析結果の店舗URLがスケジューラに追加される。
+    開始URLを複数渡した場合（エリア分割）は、エリアごとにページ送りを並行して行う。
+    
+    cancel_event がセットされると投入と待機を打ち切り、取得済みのHTMLは解析して
+    書き込み段まで流してから終了する。ページ遷移中で応答しない取得スレッドは
+    SHUTDOWN_TIMEOUT 秒だけ待って切り離す。
+    
+    run() に detail_urls を渡すと一覧ページを巡回せずに店舗URLを直接取得する
+    （大量のURLはスケジューラの待ちが少なくなった分ずつ投入する）。
+    
+    egress（EgressPool）を渡した場合、取得段は送信経路ごとのキューに分かれ、
+    各ブラウザは自分の経路のキューを処理する。店舗URLは見つけた一覧ページの
+    エリア（開始URL）に属し、エリアごとに固定された経路のキューに入る。
+    自分のキューが空になった取得スレッドは他の経路のキューから引き取って処理する
+    （エリアが経路数より少ないジョブでも全経路のブラウザを使う）。
+    経路の健全性は解析結果まで含めて記録し（ブロック画面・空ページも失敗扱い）、
+    停止中の経路のキューに残ったタスクは他の経路へ移す。
+    """
+    
+    SENTINEL = None
+    STATUS_INTERVAL = 1.0
+    PLAN_REFRESH = 20
+    SHUTDOWN_TIMEOUT = 0.5
+    
+    def __init__(self, browsers, scheduler, breaker, sink, logger, max_count,
+                 max_pages=10, parse_workers=2, queue_size=16, delay=None,
+                 page_delay=2.0, is_running=None, on_status=None,
+                 listing_only=False, detail_fields=(), browser_factory=None,
+                 worker_limit=None, selector_stats=None, tracer=None, profiler=None,
+                 cancel_event=None, on_error=None, rate_limiter=None, egress=None, fields=None):
+        self.browsers = browsers
+        self.scheduler = scheduler
+        self.breaker = breaker
+        self.sink = sink
+        self.logger = logger
+        self.max_count = max_count
+        self.max_pages = max_pages
+        self.parse_workers = parse_workers
+        self.delay = delay
+        self.page_delay = page_delay if callable(page_delay) else (lambda: page_delay)
+        self.rate_limiter = rate_limiter    # 他のジョブと共用するアクセス頻度制限
+        self.egress = egress
+        
+        # 取得スレッド数は worker_limit() に追従する（増加分は browser_factory で起動）
+        self.browser_factory = browser_factory
+        self.worker_limit = worker_limit
+        self._fetch_threads = []
+        self._thread_browsers = {}      # 取得スレッド番号 → 使用中のブラウザ
+        self._closing = threading.Event()
+        
+        # セレクタ探索順（命中統計から定期的に更新）
+        self.selector_stats = selector_stats
+        self._selector_plan = None
+        self._plan_uses = 0
+        
+        # 処理時間トレース（無効時は何も記録しない）
+        self.tracer = tracer or NULL_TRACER
+        self.profiler = profiler
+        self.is_running = is_running or (lambda: True)
+        self.on_status = on_status
+        self.on_error = on_error
+        
+        # 一覧のみモード: 一覧カードから部分レコードを作り、
+        # detail_fields が指定された場合だけ詳細ページでその項目を補う
+        self.listing_only = listing_only
+        self.detail_fields = tuple(detail_fields)
+        # 取得項目（None なら全項目）。指定外の項目はセレクタを探索しない
+        self.fields = tuple(fields) if fields else None
+        self._partials = {}
+        self._emitted = set()
+        
+        self.fetch_stage = PipelineStage("取得", queue_size)
+        self._route_stages = {}     # 経路名 → 取得段（egress 指定時）
+        self._routes = {}           # 経路名 → 経路
+        self._fetched_by = {}       # 結果未確定のURL → 取得した経路
+        self._worker_routes = []    # 取得スレッド番号 → 経路名
+        self._queue_size = queue_size
+        self.parse_stage = PipelineStage("解析", queue_size)
+        self.sink_stage = PipelineStage("書込", queue_size)
+        
+        self._lock = threading.Lock()
+        self._stop = cancel_event or threading.Event()
+        self._done = threading.Event()
+        self._sink_thread = None
+        self._kinds = {}
+        self._inflight = 0          # 投入済みで結果未確定のタスク数
+        self._reserved = 0          # 取得中・保存待ちを含む店舗数
+        self._pending_starts = deque()
+        self._pending_details = deque()  # 直接指定された店舗URL（未投入分）
+        self._chains = []           # 巡回中の一覧ページ列（開始URLごと）
+        self._list_chain = {}       # 一覧ページURL → 巡回列
+        self._areas = {}            # URL → エリア（開始URL）
+        self._pages_queued = 0
+        self.written = 0
+    
+    def run(self, start_urls, detail_urls=()):
+        """パイプライン実行（呼び出しスレッドで投入制御を行う）"""
+        if isinstance(start_urls, str):
+            start_urls = [start_urls]
+        self._pending_starts.extend(start_urls)
+        self._pending_details.extend(detail_urls)
+        
+        self._worker_routes = [self._route_key(browser) for browser in self.browsers]
+        self._thread_browsers = dict(enumerate(self.browsers))
+        self._fetch_threads = [self._thread(f"fetch-{index}", self._fetch_worker, browser, index)
+                               for index, browser in enumerate(self.browsers)]
+        parse_thread = self._thread("parse", self._parse_dispatcher)
+        sink_thread = self._thread("sink", self._sink_writer)
+        self._sink_thread = sink_thread
+        for thread in self._fetch_threads + [parse_thread, sink_thread]:
+            thread.start()
+        
+        try:
+            self._coordinate()
+        finally:
+            # 上流から順に終了させる（停止要求時は取得スレッドの待ち時間に上限を設ける）
+            with self._lock:
+                self._closing.set()
+            deadline = time.time() + self.SHUTDOWN_TIMEOUT if self._stop.is_set() else None
+            for key, stage in self._fetch_stages():
+                threads = [thread for thread, route in zip(list(self._fetch_threads), self._worker_routes)
+                           if route == key]
+                self._shutdown_stage(stage, threads, deadline)
+            self._shutdown_stage(self.parse_stage, [parse_thread])
+            self._shutdown_stage(self.sink_stage, [sink_thread])
+            self.logger.info("パイプライン統計: " + " / ".join(self.stage_summaries()))
+    
+    def stop(self):
+        """停止要求"""
+        self._stop.set()
+    
+    def stalled_browsers(self):
+        """終了後も取得スレッドが応答していないブラウザ（使用中のため再利用できない）"""
+        return [self._thread_browsers[index] for index, thread in enumerate(self._fetch_threads)
+                if thread.is_alive() and index in self._thread_browsers]
+    
+    def _thread(self, name, target, *args):
+        """段のスレッド生成（プロファイル時は計測付き）"""
+        if self.profiler is not None:
+            target = self.profiler.wrap(target)
+        return threading.Thread(target=target, args=args, name=name, daemon=True)
+    
+    def stage_summaries(self):
+        """各段の統計"""
+        stages = [stage for _, stage in self._fetch_stages()] + [self.parse_stage, self.sink_stage]
+        return [stage.summary() for stage in stages]
+    
+    def _route_key(self, browser):
+        """ブラウザの経路名（経路を使わない場合は None）"""
+        route = getattr(browser, 'route', None) if self.egress is not None else None
+        if route is None:
+            return None
+        with self._lock:
+            if route.name not in self._route_stages:
+                self._route_stages[route.name] = PipelineStage(f"取得[{route.name}]", self._queue_size)
+                self._routes[route.name] = route
+        return route.name
+    
+    def _fetch_stages(self):
+        """取得段の一覧 (経路名, 段)"""
+        if not self._route_stages:
+            return [(None, self.fetch_stage)]
+        return list(self._route_stages.items())
+    
+    def _dispatch_stage(self, url):
+        """URLを処理する取得段（エリアに固定された経路のキュー）"""
+        if not self._route_stages:
+            return self.fetch_stage
+        active = self._worker_routes[:self._worker_target()]
+        candidates = {key for key in active if key is not None} or set(self._route_stages)
+        route = self.egress.assign(self._areas.get(url, url), candidates)
+        return self._route_stages.get(route.name, self.fetch_stage)
+    
+    def _halted(self):
+        """投入・待機を打ち切るべきか"""
+        return self._stop.is_set() or self._done.is_set() or not self.is_running()
+    
+    def _sink_closed(self):
+        """書き込み段が終了済みか（停止要求後も取得済みのレコードは書き込む）"""
+        return self._sink_thread is not None and not self._sink_thread.is_alive()
+    
+    def _coordinate(self):
+        """投入制御（スケジューラから取得段へ）"""
+        last_status = 0.0
+        while not self._halted():
+            now = time.time()
+            if self.on_status and now - last_status >= self.STATUS_INTERVAL:
+                last_status = now
+                self.on_status(" / ".join(self.stage_summaries()))
+            self._scale_workers()
+            
+            with self._lock:
+                self._queue_listing_if_needed()
+                
+                url = None
+                if self._has_capacity() and self.breaker.allow():
+                    url = self.scheduler.next_url()
+                    if url is None:
+                        self.breaker.release()
+                    else:
+                        self._inflight += 1
+                        if self._kinds.get(url) != 'list':
+                            self._reserved += 1
+                
+                finished = (url is None and self._inflight == 0 and
+                            not self.scheduler.has_pending() and not self._more_listing())
+            
+            if finished:
+                break
+            if url is None:
+                self._stop.wait(0.05)
+                continue
+            
+            kind = self._kinds.get(url, 'detail')
+            self.tracer.begin(url, "一覧ページ" if kind == 'list' else "店舗", url=url)
+            if not self._dispatch_stage(url).put((kind, url), self._halted):
+                break
+    
+    def _worker_target(self):
+        """現在の取得スレッド数の目標値"""
+        if self.worker_limit is None:
+            return max(len(self.browsers), 1)
+        return max(int(self.worker_limit()), 1)
+    
+    def _worker_paused(self, index):
+        """目標スレッド数を超えた取得スレッドか（経路のキューに残りがあり他の担当がいなければ続行）"""
+        target = self._worker_target()
+        if index < target:
+            return False
+        key = self._worker_routes[index] if index < len(self._worker_routes) else None
+        return key is None or key in self._worker_routes[:target] or self._route_stages[key].depth() == 0
+    
+    def _scale_workers(self):
+        """取得スレッドの追加（目標値が増えた場合）"""
+        if self.browser_factory is None:
+            return
+        while len(self._fetch_threads) < self._worker_target():
+            index = len(self._fetch_threads)
+            thread = self._thread(f"fetch-{index}", self._spawn_fetch_worker, index)
+            self._fetch_threads.append(thread)
+            self._worker_routes.append(None)
+            thread.start()
+            self.logger.info(f"取得スレッド追加: {index + 1}本目")
+    
+    def _spawn_fetch_worker(self, index):
+        """ブラウザを起動して取得スレッドを開始"""
+        try:
+            browser = self.browser_factory()
+        except Exception as e:
+            self.logger.error(f"取得スレッド用ブラウザ起動エラー: {e}")
+            return
+        with self._lock:
+            closing = self._closing.is_set()
+            if not closing:
+                # 終了処理の開始後に起動し終えたブラウザは返却対象に入らないため、ここで終了する
+                self.browsers.append(browser)
+                self._thread_browsers[index] = browser
+        if closing:
+            browser.quit()
+            return
+        self._worker_routes[index] = self._route_key(browser)
+        self._fetch_worker(browser, index)
+    
+    def _has_capacity(self):
+        """次のURLを投入してよいか（店舗は目標件数分まで）"""
+        head = self.scheduler.peek_url()
+        if head is None:
+            return False
+        if self._kinds.get(head) == 'list':
+            return True
+        return self._reserved < self.max_count
+    
+    def _chain_active(self, chain):
+        """巡回列に未取得のページが残っているか"""
+        return chain['inflight'] or (chain['next'] is not None and chain['pages'] < self.max_pages)
+    
+    def _more_listing(self):
+        """未取得の一覧ページ・未投入の店舗URLがあるか"""
+        return (bool(self._pending_starts) or bool(self._pending_details) or
+                any(self._chain_active(chain) for chain in self._chains))
+    
+    def _queue_listing_if_needed(self):
+        """店舗URLの残りが少なくなったら次の一覧ページを投入"""
+        # 終了した巡回列を外し、空きがあれば次の開始URLから巡回を始める
+        self._chains = [chain for chain in self._chains if self._chain_active(chain)]
+        while self._pending_starts and len(self._chains) < self._worker_target():
+            start_url = self._pending_starts.popleft()
+            self._chains.append({'next': start_url, 'area': start_url, 'pages': 0, 'inflight': False})
+        
+        if self._reserved >= self.max_count:
+            return
+        low_water = max(self._worker_target() * 2, 4)
+        while self._pending_details and self.scheduler.ready_count() < low_water:
+            url = self._pending_details.popleft()
+            if self.scheduler.add(url):
+                self._kinds[url] = 'detail'
+        if self.scheduler.ready_count() >= low_water:
+            return
+        
+        for chain in self._chains:
+            if chain['inflight'] or chain['next'] is None or chain['pages'] >= self.max_pages:
+                continue
+            url = chain['next']
+            chain['next'] = None
+            if self.scheduler.add(url):
+                self._kinds[url] = 'list'
+                self._list_chain[url] = chain
+                self._areas[url] = chain['area']
+                chain['inflight'] = True
+                chain['pages'] += 1
+                self._pages_queued += 1
+                self.logger.info(f"ページ {chain['pages']} 処理開始: {url}")
+    
+    def _release_chain(self, url, next_url=None):
+        """一覧ページの処理完了（巡回列に次ページを設定）"""
+        chain = self._list_chain.pop(url, None)
+        if chain is not None:
+            chain['next'] = next_url
+            chain['inflight'] = False
+    
+    def _fetch_worker(self, browser, index):
+        """取得段（ブラウザ1つにつき1スレッド）"""
+        key = self._worker_routes[index] if index < len(self._worker_routes) else None
+        stage = self._route_stages.get(key, self.fetch_stage)
+        route = getattr(browser, 'route', None) if key is not None else None
+        while True:
+            # 目標スレッド数を超えている間は待機
+            if self._worker_paused(index):
+                if self._closing.is_set() or self._stop.is_set():
+                    return
+                self._stop.wait(0.2)
+                continue
+            # 経路の停止中は取得せず、キューに残ったタスクを他の経路へ移す
+            if self._route_parked(route):
+                if not self._reroute_tasks(stage) or self._stop.is_set():
+                    return
+                self._stop.wait(0.2)
+                continue
+            source = stage
+            try:
+                task = stage.get()
+            except queue.Empty:
+                # 投入終了後にキューが空なら終端マーカーを待たずに終了
+                if self._stop.is_set() or self._closing.is_set():
+                    return
+                task, source = self._steal_task(key)
+                if task is None:
+                    continue
+            if task is self.SENTINEL:
+                return
+            
+            kind, url = task
+            if self._halted():
+                self._task_dropped(kind, url)
+                continue
+            
+            chain = self._list_chain.get(url)
+            if kind == 'list' and chain and chain['pages'] > 1:
+                with self.tracer.span("ページ間待機", 'sleep', url=url):
+                    polite_wait(self.page_delay(), self._stop)
+                if self._halted():
+                    self._task_dropped(kind, url)
+                    continue
+            
+            limiters = [limiter for limiter in (self.rate_limiter, route and route.limiter) if limiter]
+            if limiters:
+                with self.tracer.span("頻度制限待ち", 'sleep', url=url):
+                    allowed = all(limiter.acquire(self._stop) for limiter in limiters)
+                if not allowed:
+                    self._task_dropped(kind, url)
+                    continue
+            
+            if route is not None:
+                # 経路の成否は解析結果が出た時点で記録する
+                self._fetched_by[url] = route
+            try:
+                with self.tracer.span("ページ遷移", 'webdriver', url=url):
+                    browser.get(url)
+                with self.tracer.span("HTML取得", 'webdriver', url=url):
+                    html = browser.driver.page_source
+                fetched_at = int(time.time())
+            except Exception as e:
+                if self._stop.is_set():
+                    # 停止に伴うブラウザ終了による失敗は記録しない
+                    self._task_dropped(kind, url)
+                else:
+                    self._task_failed(kind, url, e)
+                continue
+            finally:
+                source.add_processed()
+            
+            with self.tracer.span("解析キュー待ち", 'queue', url=url):
+                queued = self.parse_stage.put((kind, url, html, fetched_at), self._halted)
+            if not queued:
+                self._task_dropped(kind, url)
+                continue
+            
+            if kind == 'detail' and self.delay:
+                with self.tracer.span("待機", 'sleep', url=url):
+                    self.delay()
+    
+    def _route_parked(self, route):
+        """経路が停止中で、稼働中の他の経路に利用可能なものがあるか"""
+        if route is None or route.healthy():
+            return False
+        active = {key for key in self._worker_routes[:self._worker_target()] if key not in (None, route.name)}
+        return any(self._routes[key].healthy() for key in active)
+    
+    def _reroute_tasks(self, stage):
+        """停止中の経路のキューに残ったタスクを他の経路のキューへ移す
+        
+        Returns:
+            bool: 終端マーカーを受け取った場合は False
+        """
+        while True:
+            try:
+                task = stage.queue.get_nowait()
+            except queue.Empty:
+                return True
+            if task is self.SENTINEL:
+                return False
+            kind, url = task
+            target = self._dispatch_stage(url)
+            if not target.put(task, self._halted):
+                self._task_dropped(kind, url)
+            if target is stage:
+                return True
+    
+    def _record_route(self, url, success):
+        """URLを取得した経路の成否を記録"""
+        route = self._fetched_by.pop(url, None)
+        if route is not None:
+            self.egress.record(route, success)
+    
+    def _steal_task(self, key):
+        """他の経路のキューからタスクを引き取る（滞留の多いキューから）
+        
+        Returns:
+            tuple: (タスク, 取り出した段)。引き取れるタスクがなければ (None, None)
+        """
+        if key is None:
+            return None, None
+        stages = sorted(((name, stage) for name, stage in self._route_stages.items() if name != key),
+                        key=lambda item: -item[1].depth())
+        for _, stage in stages:
+            try:
+                task = stage.queue.get_nowait()
+            except queue.Empty:
+                continue
+            if task is self.SENTINEL:
+                # 終端マーカーは本来の担当スレッドに戻す
+                stage.queue.put(task)
+                continue
+            return task, stage
+        return None, None
+    
+    def _parse_dispatcher(self):
+        """解析段（プロセスプールへの投入と結果回収）"""
+        executor = None
+        if self.parse_workers > 0:
+            try:
+                executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+            except Exception as e:
+                self.logger.warning(f"プロセスプール起動エラー、スレッド内で解析します: {e}")
+        
+        inflight = deque()
+        limit = max(self.parse_workers * 2, 1)
+        try:
+            while True:
+                try:
+                    task = self.parse_stage.get()
+                except queue.Empty:
+                    # 停止要求後もキューに残った取得済みHTMLは終端マーカーまで解析する
+                    self._collect_parsed(inflight, block=False)
+                    continue
+                if task is self.SENTINEL:
+                    break
+                
+                kind, url, html, fetched_at = task
+                if kind == 'list':
+                    func, args = parse_listing_html, (url, html, fetched_at, self.fields)
+                else:
+                    fields = self.detail_fields if self.listing_only else self.fields
+                    func, args = parse_store_html, (url, html, fetched_at, fields, self._current_plan())
+                if self.tracer.enabled:
+                    func, args = traced_call, (func, args)
+                
+                if executor is None:
+                    try:
+                        result = func(*args)
+                    except Exception as e:
+                        self._task_failed(kind, url, e)
+                    else:
+                        self._handle_parsed(kind, url, result)
+                    self.parse_stage.add_processed()
+                    continue
+                
+                inflight.append((kind, url, executor.submit(func, *args)))
+                self._collect_parsed(inflight, block=len(inflight) >= limit)
+            
+            while inflight:
+                self._collect_parsed(inflight, block=True)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _current_plan(self):
+        """セレクタ探索順（PLAN_REFRESH件ごとに統計から作り直す）"""
+        if self.selector_stats is None:
+            return None
+        if self._selector_plan is None or self._plan_uses >= self.PLAN_REFRESH:
+            self._selector_plan = self.selector_stats.plan()
+            self._plan_uses = 0
+        self._plan_uses += 1
+        return self._selector_plan
+    
+    def _collect_parsed(self, inflight, block):
+        """完了した解析結果を投入順に回収"""
+        while inflight and (block or inflight[0][2].done()):
+            kind, url, future = inflight.popleft()
+            block = False
+            try:
+                result = future.result()
+            except Exception as e:
+                self._task_failed(kind, url, e)
+            else:
+                self._handle_parsed(kind, url, result)
+            self.parse_stage.add_processed()
+    
+    def _handle_parsed(self, kind, url, result):
+        """解析結果の振り分け（一覧 → スケジューラ、店舗 → 書き込み段）"""
+        if self.tracer.enabled:
+            result, events = result
+            self.tracer.extend(events)
+        
+        if kind == 'list':
+            links, next_url, cards = result
+            if not (links or next_url or cards):
+                # 店舗も次ページもない一覧はブロック画面・空ページとみなして再試行する
+                self._task_failed(kind, url, ValueError("一覧ページから店舗を取得できませんでした"))
+                return
+            self._record_route(url, True)
+            if self.listing_only:
+                self._handle_cards(cards)
+                links = [card['URL'] for card in cards] if self.detail_fields else []
+            
+            with self._lock:
+                added = 0
+                area = self._areas.get(url, url)
+                for link in links:
+                    if self.scheduler.add(link):
+                        self._kinds[link] = 'detail'
+                        self._areas[link] = area
+                        added += 1
+                self._release_chain(url, next_url)
+                self._inflight -= 1
+                self.scheduler.record_success(url)
+                self.breaker.record(True)
+            self.tracer.end(url, "一覧ページ", links=added)
+            self.logger.info(f"一覧ページで {added} 件発見: {url}")
+            return
+        
+        result, hits = result
+        self._record_route(url, True)
+        if self.selector_stats is not None:
+            self.selector_stats.record(hits)
+        
+        with self._lock:
+            self.scheduler.record_success(url)
+            self.breaker.record(True)
+            partial = self._partials.pop(url, None)
+        if partial is not None:
+            partial.update(result)
+            result = partial
+        if not self.sink_stage.put(result, self._sink_closed):
+            self._task_dropped(kind, url)
+    
+    def _handle_cards(self, cards):
+        """一覧カードの部分レコード処理"""
+        if self.detail_fields:
+            # 詳細ページ取得後に結合する
+            with self._lock:
+                for card in cards:
+                    self._partials.setdefault(card['URL'], card)
+            return
+        
+        # 詳細ページ不要: そのまま書き込み段へ
+        for card in cards:
+            with self._lock:
+                if card['URL'] in self._emitted or self._reserved >= self.max_count:
+                    continue
+                self._emitted.add(card['URL'])
+                self._reserved += 1
+                self._inflight += 1
+            if not self.sink_stage.put(card, self._sink_closed):
+                self._task_dropped('detail', card['URL'])
+    
+    def _sink_writer(self):
+        """書き込み段（単一スレッドで保存）"""
+        while True:
+            try:
+                record = self.sink_stage.get()
+            except queue.Empty:
+                continue
+            if record is self.SENTINEL:
+                return
+            
+            if self.written < self.max_count:
+                try:
+                    with self.tracer.span("書き込み", 'sink', url=record.get('URL')):
+                        self.sink(record)
+                    self.written += 1
+                except Exception as e:
+                    self.logger.error(f"書き込みエラー ({record.get('URL')}): {e}")
+            self.tracer.end(record.get('URL'), "店舗")
+            self.sink_stage.add_processed()
+            
+            with self._lock:
+                self._inflight -= 1
+            if self.written >= self.max_count:
+                self._done.set()
+    
+    def _task_failed(self, kind, url, error):
+        """タスク失敗（再試行判定）"""
+        self._record_route(url, False)
+        partial = None
+        with self._lock:
+            self.breaker.record(False)
+            retry = self.scheduler.record_failure(url, error)
+            if kind == 'detail' and not retry:
+                # 一覧のみモードでは一覧カードの内容だけでも保存する
+                partial = self._partials.pop(url, None)
+            if partial is None:
+                self._inflight -= 1
+                if kind == 'detail':
+                    self._reserved -= 1
+                elif not retry:
+                    self._release_chain(url)
+        
+        self.tracer.end(url, "一覧ページ" if kind == 'list' else "店舗", error=str(error), retry=retry)
+        if self.on_error:
+            self.on_error(error, retry)
+        if retry:
+            self.logger.warning(f"取得エラー、再試行予定 ({url}): {error}")
+        else:
+            self.logger.error(f"取得失敗、再試行上限 ({url}): {error}")
+        
+        if partial is not None and not self.sink_stage.put(partial, self._sink_closed):
+            self._task_dropped(kind, url)
+    
+    def _task_dropped(self, kind, url):
+        """停止によりタスクを破棄"""
+        self._fetched_by.pop(url, None)
+        self.tracer.end(url, "一覧ページ" if kind == 'list' else "店舗", dropped=True)
+        with self._lock:
+            self._inflight -= 1
+            if kind == 'detail':
+                self._reserved -= 1
+            else:
+                self._release_chain(url)
+    
+    def _shutdown_stage(self, stage, threads, deadline=None):
+        """段の終了（終端マーカー投入とスレッド待機）
+        
+        deadline を指定した場合、その時刻までに終わらないスレッドは待たずに切り離す。
+        """
+        def expired():
+            return deadline is not None and time.time() >= deadline
+        
+        for _ in threads:
+            while any(thread.is_alive() for thread in threads) and not expired():
+                try:
+                    stage.queue.put(self.SENTINEL, timeout=0.05 if deadline else 0.2)
+                    break
+                except queue.Full:
+                    continue
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - time.time(), 0))
+        
+        stalled = sum(1 for thread in threads if thread.is_alive())
+        if stalled:
+            self.logger.warning(f"{stage.name}段: 応答のないスレッド{stalled}本を待たずに終了")
+
+# 性能プロファイル（待機・タイムアウト・並列数の設定一式）
+# custom の場合は設定ファイルの同名キーを使用する
+PERFORMANCE_PROFILES = {
+    'fast': {
+        'delay_min': 0.2, 'delay_max': 0.5, 'page_delay': 0.5,
+        'page_load_timeout': 10, 'timeout': 10,
+        'fetch_workers': 3, 'parse_workers': 4, 'pipeline_queue_size': 32
+    },
+    'balanced': {
+        'delay_min': 0.5, 'delay_max': 1.0, 'page_delay': 2.0,
+        'page_load_timeout': 15, 'timeout': 15,
+        'fetch_workers': 1, 'parse_workers': 2, 'pipeline_queue_size': 16
+    },
+    'polite': {
+        'delay_min': 2.0, 'delay_max': 5.0, 'page_delay': 5.0,
+        'page_load_timeout': 30, 'timeout': 30,
+        'fetch_workers': 1, 'parse_workers': 1, 'pipeline_queue_size': 8
+    }
+}
+PROFILE_NAMES = {'fast': '高速', 'balanced': '標準', 'polite': '低負荷', 'custom': 'カスタム'}
+
+def default_config(app_dir):
+    """既定設定（設定ファイルの値で上書きされる）"""
+    return {
+        "last_save_path": os.path.join(os.path.expanduser("~"), "Downloads"),
+        "performance_profile": "balanced",
+        "delay_min": 0.5,
+        "delay_max": 1.0,
+        "page_delay": 2.0,
+        "timeout": 15,
+        "page_load_timeout": 15,
+        "headless": True,
+        "window_size": "1280,720",
+        "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        "chromedriver_path": "",
+        "max_retries": 3,
+        "retry_backoff": 2.0,
+        "breaker_error_rate": 0.5,
+        "breaker_cooldown": 30,
+        "browser_recycle_pages": 300,
+        "browser_max_rss_mb": 1500,
+        "browser_prewarm": True,
+        "trace_enabled": False,
+        "profile_enabled": False,
+        "fetch_workers": 1,
+        "parse_workers": 2,
+        "pipeline_queue_size": 16,
+        "listing_only": False,
+        "listing_detail_fields": [],
+        "dedup_bucket_window": DuplicateFinder.BUCKET_WINDOW,
+        "fields": [],
+        "auto_partition": True,
+        "area_catalog_max_age_days": 30,
+        "database_enabled": True,
+        "database_path": str(Path(app_dir) / "gurunavi.db"),
+        "global_rate_per_sec": 0,
+        "service_workers": 2,
+        "egress_routes": [],
+        "egress_max_failures": 5,
+        "egress_cooldown": 120
+    }
+
+def load_config_file(config_file, app_dir, logger):
+    """設定読み込み（既定設定に設定ファイルの値を上書き）"""
+    config = default_config(app_dir)
+    try:
+        if Path(config_file).exists():
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+    except Exception as e:
+        logger.error(f"設定読み込みエラー: {e}")
+    
+    # 詳細ページで取得できない項目名（入力誤り）は除外する
+    detail_fields = config.get("listing_detail_fields") or []
+    unknown = [field for field in detail_fields if field not in STORE_FIELD_SELECTORS]
+    if unknown:
+        logger.warning(f"listing_detail_fields の不明な項目を無視します: {', '.join(map(str, unknown))}")
+        config["listing_detail_fields"] = [field for field in detail_fields if field in STORE_FIELD_SELECTORS]
+    return config
+
+def setup_logging(log_file, max_bytes=5 * 1024 * 1024, backup_count=3):
+    """ログ設定（キュー経由の非同期出力・サイズローテーション）
+    
+    Returns:
+        tuple: (ロガー, キューリスナー)。終了時にリスナーを stop() すること
+    """
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    
+    # 呼び出し側スレッドはキューに積むだけで、ファイルI/Oはリスナースレッドが行う
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+    
+    return logging.getLogger(__name__), listener
+
+class TokenBucket:
+    """トークンバケット式のアクセス頻度制御（複数スレッド・ジョブで共用）
+    
+    rate 回/秒まで許可し、burst 回までは連続して許可する。rate が0以下なら制限しない。
+    """
+    
+    def __init__(self, rate, burst=1.0):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, cancel_event=None):
+        """1回分の許可を待つ（停止要求で中断した場合は False）"""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 不足分は先取りして待つ（後続の呼び出しはさらに後ろに並ぶ）
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait <= 0:
+            return True
+        return not polite_wait(wait, cancel_event)
+
+class BrowserPool:
+    """起動済みブラウザの共用プール（ジョブ間でブラウザを使い回す）
+    
+    max_idle 個までの空きブラウザを保持し、それを超えて返却されたものは終了する。
+    ブラウザは送信経路ごとに起動するため、同じ経路の空きブラウザだけを使い回す。
+    """
+    
+    def __init__(self, factory, max_idle=0):
+        self.factory = factory
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+    
+    def acquire(self, route=None):
+        """ブラウザ取得（同じ経路の空きがなければ起動）"""
+        browser = None
+        with self._lock:
+            for index in range(len(self._idle) - 1, -1, -1):
+                if self._idle[index].route is route:
+                    browser = self._idle.pop(index)
+                    break
+        if browser is not None and browser.is_alive():
+            return browser
+        if browser is not None:
+            browser.quit()
+        return self.factory(route)
+    
+    def release(self, browsers):
+        """ブラウザ返却"""
+        for browser in browsers:
+            if browser.recycle_count:
+                browser.logger.info(f"ブラウザ再起動回数: {browser.recycle_count}回")
+                browser.recycle_count = 0
+            with self._lock:
+                keep = len(self._idle) < self.max_idle
+                if keep:
+                    self._idle.append(browser)
+            if not keep:
+                browser.quit()
+    
+    def close(self):
+        """空きブラウザを全て終了"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for browser in idle:
+            browser.quit()
+
+class EgressRoute:
+    """送信経路（プロキシ・User-Agent、経路ごとのアクセス頻度制限と健全性）"""
+    
+    def __init__(self, name, proxy='', user_agent='', rate=0.0):
+        self.name = name
+        self.proxy = proxy
+        self.user_agent = user_agent
+        self.limiter = TokenBucket(rate)
+        self.failures = 0           # 連続失敗数
+        self.requests = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self.areas = 0              # 固定割り当て中のエリア数
+    
+    def healthy(self, now=None):
+        """利用可能か（停止期間中でない）"""
+        return (now or time.time()) >= self.down_until
+    
+    def describe(self):
+        """ログ表示用の要約"""
+        state = "利用可" if self.healthy() else f"停止中(残り{self.down_until - time.time():.0f}秒)"
+        return f"{self.name}: {state} 取得{self.requests}件 失敗{self.errors}件 エリア{self.areas}"
+
+class EgressPool:
+    """送信経路のプール（経路ごとの頻度制限・健全性管理・エリア単位の固定割り当て）
+    
+    設定の egress_routes（name, proxy, user_agent, rate_per_sec のリスト）から経路を作る。
+    未設定の場合は user_agent の直接接続1経路のみ。エリアは最初に割り当てた経路に
+    固定し、その経路が MAX_FAILURES 回続けて失敗すると COOLDOWN 秒停止して
+    エリアを他の経路に移す。
+    """
+    
+    MAX_FAILURES = 5
+    COOLDOWN = 120
+    BLOCK_STATUSES = (403, 429)
+    
+    def __init__(self, routes, logger, max_failures=MAX_FAILURES, cooldown=COOLDOWN):
+        if not routes:
+            raise ValueError("送信経路がありません")
+        self.routes = list(routes)
+        self.logger = logger
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._sticky = {}           # エリア → 経路
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config, logger):
+        """設定から生成"""
+        routes = []
+        for index, spec in enumerate(config.get("egress_routes") or []):
+            routes.append(EgressRoute(
+                spec.get('name') or f"exit{index + 1}",
+                proxy=spec.get('proxy', ''),
+                user_agent=spec.get('user_agent') or config.get("user_agent", ""),
+                rate=float(spec.get('rate_per_sec', 0) or 0)
+            ))
+        if not routes:
+            routes.append(EgressRoute('direct', user_agent=config.get("user_agent", "")))
+        return cls(routes, logger,
+                   max_failures=int(config.get("egress_max_failures", cls.MAX_FAILURES)),
+                   cooldown=float(config.get("egress_cooldown", cls.COOLDOWN)))
+    
+    def _usable(self, candidates=None):
+        """候補のうち利用可能な経路（全て停止中なら停止明けの早い順に全候補）"""
+        routes = [route for route in self.routes if candidates is None or route.name in candidates]
+        now = time.time()
+        healthy = [route for route in routes if route.healthy(now)]
+        return healthy or sorted(routes, key=lambda route: route.down_until)
+    
+    def next_route(self):
+        """ブラウザ起動用の経路（利用可能な経路を順番に使う）"""
+        with self._lock:
+            routes = self._usable()
+            route = routes[self._next % len(routes)]
+            self._next += 1
+            return route
+    
+    def assign(self, area, candidates=None):
+        """エリアの経路（固定割り当て。停止中・候補外なら割り当ての少ない経路）"""
+        with self._lock:
+            route = self._sticky.get(area)
+            usable = self._usable(candidates)
+            if route in usable:
+                return route
+            chosen = min(usable, key=lambda candidate: (candidate.areas, candidate.requests))
+            # 候補外なだけで利用可能な固定経路は、次回のために残す
+            if route is None or not route.healthy():
+                if route is not None:
+                    route.areas -= 1
+                self._sticky[area] = chosen
+                chosen.areas += 1
+            return chosen
+    
+    def record(self, route, success):
+        """取得結果の記録（連続失敗が上限に達したら経路を一時停止）"""
+        with self._lock:
+            route.requests += 1
+            if success:
+                route.failures = 0
+                return
+            route.errors += 1
+            route.failures += 1
+            if route.failures < self.max_failures or not route.healthy():
+                return
+            route.failures = 0
+            route.down_until = time.time() + self.cooldown
+        self.logger.warning(f"送信経路 {route.name} を{self.cooldown:.0f}秒停止します（連続{self.max_failures}回失敗）")
+    
+    def session(self, route, cancel_event=None):
+        """経路を通す HTTP セッション"""
+        return EgressSession(self, route, cancel_event)
+    
+    def summary(self):
+        """各経路の状態"""
+        with self._lock:
+            return [route.describe() for route in self.routes]
+
+class EgressSession(requests.Session):
+    """送信経路を通す HTTP セッション（経路の頻度制限と健全性記録付き）"""
+    
+    def __init__(self, pool, route, cancel_event=None):
+        super().__init__()
+        self.pool = pool
+        self.route = route
+        self.cancel_event = cancel_event
+        if route.proxy:
+            self.proxies.update({'http': route.proxy, 'https': route.proxy})
+        if route.user_agent:
+            self.headers['User-Agent'] = route.user_agent
+    
+    def request(self, method, url, *args, **kwargs):
+        if not self.route.limiter.acquire(self.cancel_event):
+            raise requests.exceptions.RequestException("停止要求により中断しました")
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            self.pool.record(self.route, False)
+            raise
+        self.pool.record(self.route, response.status_code < 500 and
+                         response.status_code not in self.pool.BLOCK_STATUSES)
+        return response
+
+class ScrapeJob:
+    """取得ジョブ（条件・停止要求・取得結果・進捗通知）
+    
+    params のキー: prefecture, city, max_count, listing_only, auto_partition, trace, profile, save_path, filename,
+    fields（出力項目、省略時は全項目）, format（ジョブサービスの出力形式）,
+    shop_ids（指定時は一覧を巡回せずこの店舗だけを取得）, checkpoint（取得レコードの追記先、JSON Lines）,
+    fetch_workers（取得スレッド数、省略時は性能プロファイルの値）
+    listener には post_ui と同じ形式 (種類, *引数) で進捗が通知される。
+    """
+    
+    def __init__(self, params=None, cancel_event=None, listener=None, job_id=None):
+        self.id = job_id or datetime.now().strftime('%Y%m%d%H%M%S') + f"_{random.randrange(16 ** 4):04x}"
+        self.params = dict(params or {})
+        self.cancel_event = cancel_event or threading.Event()
+        self.listener = listener
+        self.records = RecordStore()
+        self.stats = LiveStats(self.params.get('fields'))
+        self.failed_urls = []
+        self.latest = {}
+        self.state = 'queued'
+        self.error = None
+        self.output_path = None
+        self.checkpoint = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+    
+    def notify(self, kind, *args):
+        """進捗通知"""
+        self.latest[kind] = args
+        if self.listener:
+            self.listener(kind, *args)
+
+class ScrapeEngine:
+    """取得処理本体（画面に依存しない。GUI・ジョブサービスで共用）
+    
+    ブラウザプール・エリアカタログ・セレクタ統計・アクセス頻度制御を保持し、
+    run() でジョブを1件実行する。複数スレッドから同時に run() を呼び出せる。
+    """
+    
+    MAX_LIST_PAGES = 10                # 一覧ページの最大巡回数
+    ADDRESS_COLUMNS = ('正規化住所', '都道府県コード', '市区町村コード')
+    
+    def __init__(self, config, logger, app_dir):
+        self.config = config
+        self.logger = logger
+        self.app_dir = Path(app_dir)
+        self.drivers_dir = self.app_dir / "drivers"
+        self.drivers_dir.mkdir(exist_ok=True)
+        self.chromedriver_path = self.drivers_dir / "chromedriver.exe"
+        
+        # エリアカタログ・URL生成器
+        self.area_catalog = AreaCatalog(
+            self.app_dir / "area_catalog.json", self.logger,
+            max_age_days=float(self.config.get("area_catalog_max_age_days", 30))
+        )
+        self.url_generator = GurunaviURLGenerator(self.area_catalog)
+        self._catalog_locks = {}            # 都道府県コード → 巡回中のロック
+        self._catalog_locks_lock = threading.Lock()
+        
+        # セレクタ命中統計
+        self.selector_stats = SelectorStats(self.app_dir / "selector_stats.json", self.logger)
+        
+        # 住所の市区町村コード付与
+        try:
+            self.address_index = AddressIndex.load()
+        except Exception as e:
+            self.logger.warning(f"市区町村表読み込みエラー、住所コード付与を省略します: {e}")
+            self.address_index = None
+        
+        # 全ジョブ共通のアクセス頻度制限・送信経路・ブラウザ
+        self.rate_limiter = TokenBucket(float(self.config.get("global_rate_per_sec", 0) or 0))
+        self.egress = EgressPool.from_config(self.config, self.logger)
+        self.browser_pool = BrowserPool(self.new_browser)
+        if len(self.egress.routes) > 1:
+            self.logger.info(f"送信経路: {', '.join(route.name for route in self.egress.routes)}")
+    
+    def close(self):
+        """共用リソースの解放"""
+        self.browser_pool.close()
+    
+    def perf(self, key):
+        """現在の性能プロファイルの設定値（実行中の変更も即時反映）"""
+        name = self.config.get("performance_profile", "balanced")
+        profile = PERFORMANCE_PROFILES.get(name)
+        if profile is None:
+            return self.config.get(key, PERFORMANCE_PROFILES['balanced'][key])
+        return profile[key]
+    
+    def fetch_workers(self, job):
+        """ジョブの取得スレッド数（ジョブ指定がなければ性能プロファイルの値）"""
+        return max(int(job.params.get('fetch_workers') or self.perf("fetch_workers")), 1)
+    
+    def smart_delay(self, cancel_event=None):
+        """遅延制御（停止要求で即時に戻る）"""
+        delay_min = float(self.perf("delay_min"))
+        delay_max = max(float(self.perf("delay_max")), delay_min)
+        polite_wait(random.uniform(delay_min, delay_max), cancel_event)
+    
+    def run(self, job):
+        """ジョブ実行（呼び出しスレッドで完了まで処理）"""
+        job.state = 'running'
+        job.started_at = time.time()
+        profiler = None
+        if job.params.get('profile'):
+            profiler = ScrapeProfiler()
+            profiler.start()
+        
+        browsers = []
+        database = None
+        try:
+            self.logger.info("おすすめ店舗取得開始")
+            job.notify('status', "初期化中...")
+            
+            try:
+                for _ in range(self.fetch_workers(job)):
+                    browsers.append(self.browser_pool.acquire(self.egress.next_route()))
+                if not PSUTIL_AVAILABLE:
+                    self.logger.info("psutil未導入のため、ブラウザ再起動はページ数のみで判定します")
+                self.logger.info("Webドライバー初期化完了")
+            except Exception as e:
+                self.logger.error(f"ドライバー初期化エラー: {e}")
+                raise Exception(f"ブラウザドライバー初期化失敗:\n{e}")
+            
+            if self.config.get("database_enabled", True):
+                # 一覧のみモードのレコードはカードの項目と詳細ページ取得項目以外が「-」のため、
+                # 実際に取得する列だけを更新する（既存の値を「-」で上書きしない）
+                fields = job.params.get('fields') or None
+                if not job.params.get('shop_ids'):
+                    listing_only, detail_fields = plan_fields(fields, job.params.get('listing_only', False),
+                                                              self.config.get("listing_detail_fields", []))
+                    if listing_only:
+                        fields = [field for field in LISTING_FIELD_SELECTORS if fields is None or field in fields]
+                        fields += list(detail_fields)
+                database = ScrapeDatabase(self.config.get("database_path", self.app_dir / "gurunavi.db"),
+                                          fields=fields)
+            if job.params.get('checkpoint'):
+                job.checkpoint = open(job.params['checkpoint'], 'a', encoding='utf-8', buffering=1)
+            
+            self.perform_scraping(job, browsers, database, profiler)
+            job.state = 'cancelled' if job.cancel_event.is_set() else 'done'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+            raise
+        finally:
+            self.browser_pool.release(browsers)
+            self.close_database(database)
+            if job.checkpoint is not None:
+                job.checkpoint.close()
+                job.checkpoint = None
+            if profiler is not None:
+                self.save_profile(profiler, job.params)
+            job.finished_at = time.time()
+    
+    def perform_scraping(self, job, browsers, database, profiler=None):
+        """スクレイピング実行"""
+        params = job.params
+        prefecture = params['prefecture']
+        city = params.get('city', '')
+        max_count = params['max_count']
+        shop_ids = params.get('shop_ids')
+        fields = params.get('fields') or None
+        
+        if shop_ids:
+            # 店舗ID指定: 一覧ページは巡回せず、詳細ページを直接取得する
+            search_target = f"指定店舗{len(shop_ids)}件"
+            self.logger.info(f"店舗ID指定の再取得: {len(shop_ids)}件 (取得スレッド: {self.fetch_workers(job)})")
+            listing_only = False
+            detail_fields = tuple(field for field in STORE_FIELD_SELECTORS if field in fields) if fields else None
+        else:
+            if city:
+                search_url = self.url_generator.generate_city_url(prefecture, city)
+                search_target = f"{prefecture} {city}"
+            else:
+                search_url = self.url_generator.generate_prefecture_url(prefecture)
+                search_target = prefecture
+            self.logger.info(f"検索URL: {search_url}")
+            listing_only, detail_fields = plan_fields(fields, params.get('listing_only', False),
+                                                      self.config.get("listing_detail_fields", []))
+        
+        self.logger.info(f"目標取得数: {max_count}件")
+        if fields:
+            self.logger.info(f"取得項目: {', '.join(fields)}")
+        if listing_only:
+            if not params.get('listing_only'):
+                self.logger.info("取得項目が全て一覧ページにあるため、詳細ページを取得しません")
+            self.logger.info(f"一覧のみモード (詳細ページ取得項目: {', '.join(detail_fields) or 'なし'})")
+        
+        job.notify('status', f"{search_target}のおすすめ店舗にアクセス中...")
+        
+        scheduler = RetryScheduler(
+            max_retries=int(self.config.get("max_retries", 3)),
+            backoff_base=float(self.config.get("retry_backoff", 2.0))
+        )
+        breaker = CircuitBreaker(
+            error_rate=float(self.config.get("breaker_error_rate", 0.5)),
+            cooldown=float(self.config.get("breaker_cooldown", 30))
+        )
+        
+        if shop_ids:
+            start_urls, detail_urls = [], [store_url_from_id(shop_id) for shop_id in shop_ids]
+        else:
+            start_urls, detail_urls = self.plan_start_urls(job, search_url), []
+        tracer = Tracer(enabled=params.get('trace', False))
+        
+        job.run_started_at = time.time()
+        pipeline = ScrapePipeline(
+            browsers, scheduler, breaker,
+            lambda record: self.store_record(job, database, record), self.logger,
+            max_count=max_count,
+            max_pages=self.MAX_LIST_PAGES,
+            parse_workers=int(self.perf("parse_workers")),
+            queue_size=int(self.perf("pipeline_queue_size")),
+            delay=lambda: self.smart_delay(job.cancel_event),
+            page_delay=lambda: float(self.perf("page_delay")),
+            browser_factory=lambda: self.browser_pool.acquire(self.egress.next_route()),
+            worker_limit=lambda: self.fetch_workers(job),
+            selector_stats=self.selector_stats,
+            tracer=tracer,
+            profiler=profiler,
+            cancel_event=job.cancel_event,
+            rate_limiter=self.rate_limiter,
+            egress=self.egress,
+            on_error=lambda error, retry: self.record_error(job, error, retry),
+            on_status=lambda text: job.notify('pipeline', text),
+            listing_only=listing_only,
+            detail_fields=detail_fields or (),
+            fields=fields
+        )
+        try:
+            pipeline.run(start_urls, detail_urls)
+        finally:
+            # 応答のない取得スレッドが使用中のブラウザはプールに戻さず終了する
+            stalled = pipeline.stalled_browsers()
+            if stalled:
+                self.logger.warning(f"応答のない取得スレッドのブラウザ{len(stalled)}個を終了します")
+            for browser in stalled:
+                browsers.remove(browser)
+                browser.quit()
+            self.selector_stats.save()
+            if tracer.enabled:
+                self.save_trace(tracer, params)
+        
+        job.failed_urls = scheduler.failed
+        if job.failed_urls:
+            self.logger.warning(f"取得失敗URL: {len(job.failed_urls)}件")
+            for failure in job.failed_urls:
+                self.logger.warning(f"  {failure['URL']} (試行{failure['試行回数']}回): {failure['最終エラー']}")
+        if breaker.trip_count:
+            self.logger.warning(f"サーキットブレーカー作動回数: {breaker.trip_count}回")
+        if len(self.egress.routes) > 1:
+            for line in self.egress.summary():
+                self.logger.info(f"送信経路 {line}")
+        
+        total_time = time.time() - job.run_started_at
+        self.logger.info(f"取得完了: {len(job.records)}件 (時間: {total_time:.2f}秒)")
+    
+    def catalog_lock(self, pref_code):
+        """都道府県ごとのエリア巡回ロック（同じ都道府県を重複して巡回しない）"""
+        with self._catalog_locks_lock:
+            return self._catalog_locks.setdefault(pref_code, threading.RLock())
+    
+    def discover_areas(self, prefecture, should_continue=None, cancel_event=None):
+        """エリア階層の巡回（ワーカースレッドから呼び出し）"""
+        pref_code = self.url_generator.prefecture_map[prefecture]
+        session = self.egress.session(self.egress.assign(f"area/{pref_code}"), cancel_event)
+        
+        with self.catalog_lock(pref_code):
+            self.area_catalog.discover(
+                pref_code,
+                self.url_generator.generate_prefecture_url(prefecture),
+                session, delay=lambda: self.smart_delay(cancel_event), should_continue=should_continue,
+                timeout=float(self.perf("timeout"))
+            )
+    
+    def plan_start_urls(self, job, search_url):
+        """開始URLの決定（一覧の巡回上限を超える件数の場合のみエリアカタログで分割）"""
+        cap = self.MAX_LIST_PAGES * MAX_LINKS_PER_PAGE
+        if job.params['max_count'] <= cap:
+            return [search_url]
+        if not job.params.get('auto_partition', True):
+            self.logger.warning(f"エリア分割が無効のため、取得できるのは最大{cap}件です")
+            return [search_url]
+        
+        prefecture = job.params['prefecture']
+        city = job.params.get('city', '')
+        pref_code = self.url_generator.prefecture_map[prefecture]
+        if not self.area_catalog.is_fresh(pref_code):
+            job.notify('status', f"{prefecture}のエリアカタログを取得中...")
+            # 同じ都道府県を巡回中のジョブがあれば終わるまで待つ（停止要求で中断）
+            lock = self.catalog_lock(pref_code)
+            while not lock.acquire(timeout=0.2):
+                if job.cancel_event.is_set():
+                    return [search_url]
+            try:
+                # 待機中に他のジョブが取得を終えていれば再取得しない
+                if not self.area_catalog.is_fresh(pref_code):
+                    self.discover_areas(prefecture, should_continue=lambda: not job.cancel_event.is_set(),
+                                        cancel_event=job.cancel_event)
+            except Exception as e:
+                self.logger.warning(f"エリアカタログ取得エラー、分割せずに実行します: {e}")
+                return [search_url]
+            finally:
+                lock.release()
+        
+        if city:
+            node = self.area_catalog.find(pref_code, city)
+        else:
+            node = self.area_catalog.prefecture_node(pref_code)
+        if not node:
+            return [search_url]
+        
+        start_urls = self.area_catalog.partition(node['key'], cap)
+        if len(start_urls) > 1:
+            self.logger.info(f"エリア分割: {node['name']} ({node.get('count')}件) → {len(start_urls)}エリア")
+        return start_urls or [search_url]
+    
+    def new_browser(self, route=None):
+        """ブラウザセッション管理の生成・起動（route: 送信経路）"""
+        browser = BrowserManager(
+            lambda: self.create_driver(route), self.logger,
+            max_pages=int(self.config.get("browser_recycle_pages", 300)),
+            max_rss_mb=float(self.config.get("browser_max_rss_mb", 1500)),
+            prewarm=bool(self.config.get("browser_prewarm", True)),
+            timeouts=lambda: float(self.perf("page_load_timeout")),
+            route=route
+        )
+        browser.start()
+        return browser
+    
+    def create_driver(self, route=None):
+        """WebDriver生成（BrowserManagerから呼び出される）"""
+        chrome_options = Options()
+        
+        if self.config.get("headless", True):
+            chrome_options.add_argument("--headless")
+        
+        # 高速化オプション
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--disable-images")
+        chrome_options.add_argument("--disable-javascript")
+        chrome_options.add_argument("--ignore-ssl-errors")
+        chrome_options.add_argument("--ignore-certificate-errors")
+        
+        window_size = self.config.get("window_size", "1280,720")
+        chrome_options.add_argument(f"--window-size={window_size}")
+        
+        user_agent = route.user_agent if route and route.user_agent else self.config.get("user_agent", "")
+        if user_agent:
+            chrome_options.add_argument(f"--user-agent={user_agent}")
+        
+        # 送信経路のプロキシ（認証付きプロキシはChromeの起動引数では指定できない）
+        if route and route.proxy:
+            chrome_options.add_argument(f"--proxy-server={route.proxy}")
+        
+        driver_path = self.get_chromedriver_path()
+        if not driver_path:
+            raise Exception("ChromeDriverが見つかりません。")
+        
+        service = Service(driver_path, log_path='nul')
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        driver.set_page_load_timeout(float(self.perf("page_load_timeout")))
+        return driver
+    
+    def get_chromedriver_path(self):
+        """ChromeDriverパス取得（専用フォルダ対応）"""
+        # 1. 専用driversフォルダを最優先
+        if self.chromedriver_path.exists():
+            self.logger.info(f"専用フォルダのChromeDriverを使用: {self.chromedriver_path}")
+            return str(self.chromedriver_path)
+        
+        # 2. レガシー：実行フォルダ直下（後方互換性）
+        legacy_driver = self.app_dir / "chromedriver.exe"
+        if legacy_driver.exists():
+            self.logger.info(f"実行フォルダ直下のChromeDriverを使用: {legacy_driver}")
+            # 専用フォルダに移動
+            try:
+                shutil.move(str(legacy_driver), str(self.chromedriver_path))
+                self.logger.info(f"ChromeDriverを専用フォルダに移動しました")
+                return str(self.chromedriver_path)
+            except Exception as e:
+                self.logger.warning(f"移動失敗: {e}")
+                return str(legacy_driver)
+        
+        # 3. webdriver-manager（最後の手段）
+        if WEBDRIVER_MANAGER_AVAILABLE:
+            try:
+                self.logger.info("webdriver-managerでChromeDriverを取得")
+                downloaded_path = ChromeDriverManager().install()
+                # 専用フォルダにコピー
+                shutil.copy2(downloaded_path, self.chromedriver_path)
+                self.logger.info(f"webdriver-managerから専用フォルダにコピー")
+                return str(self.chromedriver_path)
+            except Exception as e:
+                self.logger.error(f"webdriver-manager エラー: {e}")
+        
+        return None
+    
+    def store_record(self, job, database, store_data):
+        """取得レコード保存（パイプラインの書き込み段から呼び出される）"""
+        job.records.append(store_data)
+        for field in job.stats.add(store_data):
+            self.logger.warning(f"{field}の取得率が急低下しています "
+                                f"(直近{LiveStats.RECENT_WINDOW}件、全体{job.stats.fill_rate(field) * 100:.0f}%)")
+        if database:
+            database.write(store_data, job.params['prefecture'], job.params.get('city', ''))
+        if job.checkpoint is not None:
+            # 出力ファイルは終了時にまとめて書くため、再開用にレコードごと追記する
+            job.checkpoint.write(json.dumps(store_data, ensure_ascii=False) + "\n")
+        collected_count = len(job.records)
+        max_count = job.params['max_count']
+        
+        # 画面等への通知はジョブの通知先に委譲
+        progress = min((collected_count / max_count) * 100, 100)
+        elapsed_time = time.time() - job.run_started_at
+        job.notify('record', collected_count)
+        job.notify('progress', progress)
+        job.notify('status', f"店舗取得中... ({collected_count}/{max_count})")
+        job.notify('time', f"処理時間: {elapsed_time:.1f}秒")
+        job.notify('stats', job.stats.describe())
+    
+    def record_error(self, job, error, retry):
+        """取得エラーの集計（パイプラインから呼び出される）"""
+        job.stats.record_error(error, retry)
+        job.notify('stats', job.stats.describe())
+    
+    def close_database(self, database):
+        """ローカルDBの書き込み確定"""
+        if database is None:
+            return
+        try:
+            database.close()
+            self.logger.info(f"DB保存完了: {database.db_path}")
+        except Exception as e:
+            self.logger.error(f"DB保存エラー: {e}")
+    
+    @staticmethod
+    def output_base(params):
+        """出力ファイルの拡張子なしパス"""
+        filename = params['filename']
+        if filename.endswith('.xlsx'):
+            filename = filename[:-len('.xlsx')]
+        return os.path.join(params['save_path'], filename)
+    
+    def save_trace(self, tracer, params):
+        """トレースファイル出力（保存先フォルダに *_trace.json）"""
+        trace_path = f"{self.output_base(params)}_trace.json"
+        try:
+            tracer.write(trace_path)
+            if tracer.dropped:
+                self.logger.warning(f"トレース記録上限超過: {tracer.dropped}件を破棄")
+            self.logger.info(f"トレース保存完了: {trace_path}")
+        except Exception as e:
+            self.logger.error(f"トレース保存エラー: {e}")
+    
+    def save_profile(self, profiler, params):
+        """プロファイル結果出力（保存先フォルダに *_profile.*）"""
+        profiler.stop()
+        for line in profiler.summary():
+            self.logger.info(f"プロファイル: {line}")
+        try:
+            paths = profiler.write(self.output_base(params))
+            self.logger.info(f"プロファイル保存完了: {', '.join(paths)}")
+        except Exception as e:
+            self.logger.error(f"プロファイル保存エラー: {e}")
+    
+    def export(self, job, path, file_format='xlsx', params=None):
+        """取得結果の出力（xlsx / csv / json）"""
+        params = params or job.params
+        df = job.records.to_dataframe()
+        outside_count = self.annotate_addresses(df, params)
+        
+        if file_format == 'csv':
+            self.project_columns(df, params).to_csv(path, index=False, encoding='utf-8-sig')
+        elif file_format == 'json':
+            self.project_columns(df, params).to_json(path, orient='records', force_ascii=False, indent=2)
+        else:
+            self.export_excel(job, df, path, outside_count, params)
+        job.output_path = path
+        label = 'Excel' if file_format == 'xlsx' else file_format.upper()
+        self.logger.info(f"{label}保存完了: {path}")
+        return path
+    
+    @classmethod
+    def project_columns(cls, df, params):
+        """出力列の絞り込み（params['fields'] 指定時。URL・取得日時は常に出力する）"""
+        fields = params.get('fields')
+        if not fields:
+            return df
+        columns = [column for column in df.columns
+                   if column in ('URL', '取得日時') or column in fields
+                   or (column in cls.ADDRESS_COLUMNS and '住所' in fields)]
+        return df[columns]
+    
+    def annotate_addresses(self, df, params):
+        """住所の正規化・市区町村コード付与と検索エリアの確認
+        
+        Returns:
+            int or None: 検索エリア外の住所の件数（市区町村表がない場合は None）
+        """
+        if not self.address_index:
+            return None
+        prefecture = params['prefecture']
+        codes = self.address_index.lookup_column(df['住所'].tolist())
+        # 列名は ADDRESS_COLUMNS と対応
+        df['正規化住所'] = [normalized for _, _, normalized in codes]
+        df['都道府県コード'] = [pref_code for pref_code, _, _ in codes]
+        df['市区町村コード'] = [city_code for _, city_code, _ in codes]
+        if not prefecture:
+            return None
+        area_codes = self.address_index.area_codes(prefecture, params.get('city', ''))
+        outside_count = sum(1 for pref_code, city_code, _ in codes
+                            if self.address_index.in_area(pref_code, city_code, prefecture, area_codes) is False)
+        if outside_count:
+            self.logger.warning(f"検索エリア外の住所: {outside_count}件")
+        return outside_count
+    
+    def export_excel(self, job, df, full_path, outside_count=None, params=None):
+        """Excel出力（データ・取得統計・頻度集計・取得概要・重複候補・取得失敗URL）"""
+        params = params or job.params
+        prefecture = params['prefecture']
+        listing_only, _ = plan_fields(params.get('fields'), params.get('listing_only', False))
+        with pd.ExcelWriter(full_path, engine='openpyxl') as writer:
+            self.project_columns(df, params).to_excel(writer, sheet_name='おすすめ店舗データ', index=False)
+            
+            # 統計シート（取得中の逐次集計をそのまま出力）
+            stats_df = pd.DataFrame(job.stats.stats_rows(prefecture), columns=['項目', '値', '充足率'])
+            stats_df.to_excel(writer, sheet_name='取得統計', index=False)
+            
+            frequency_rows = job.stats.frequency_rows()
+            if frequency_rows:
+                frequency_df = pd.DataFrame(frequency_rows, columns=['区分', '値', '件数'])
+                frequency_df.to_excel(writer, sheet_name='頻度集計', index=False)
+            
+            # 概要シート
+            summary_data = {
+                '設定項目': ['検索対象', '検索URL', '取得店舗数', '取得モード', '取得日時'],
+                '内容': [
+                    f"指定店舗 {len(params['shop_ids'])}件" if params.get('shop_ids') else f"{prefecture}のおすすめ店舗",
+                    "-" if params.get('shop_ids') else
+                    f"https://r.gnavi.co.jp/area/{self.url_generator.prefecture_map.get(prefecture, '')}/rs/",
+                    f"{len(df)}件",
+                    "一覧のみ" if listing_only else "詳細ページ",
+                    datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
+                ]
+            }
+            if params.get('fields'):
+                summary_data['設定項目'].append('取得項目')
+                summary_data['内容'].append('、'.join(params['fields']))
+            if outside_count is not None:
+                summary_data['設定項目'].append('検索エリア外の住所')
+                summary_data['内容'].append(f"{outside_count}件")
+            summary_df = pd.DataFrame(summary_data)
+            summary_df.to_excel(writer, sheet_name='取得概要', index=False)
+            
+            # 重複候補シート（別の店舗IDで掲載されている同一店舗の候補）
+            duplicates_df = self.find_duplicates(df)
+            if duplicates_df is not None:
+                duplicates_df.to_excel(writer, sheet_name='重複候補', index=False)
+            
+            # 取得失敗シート（再試行上限に達したURL）
+            if job.failed_urls:
+                failed_df = pd.DataFrame(job.failed_urls, columns=['URL', '試行回数', '最終エラー'])
+                failed_df.to_excel(writer, sheet_name='取得失敗URL', index=False)
+            
+            # 列幅調整
+            for sheet_name in writer.sheets:
+                worksheet = writer.sheets[sheet_name]
+                for column in worksheet.columns:
+                    max_length = 0
+                    column_letter = column[0].column_letter
+                    for cell in column:
+                        try:
+                            if len(str(cell.value)) > max_length:
+                                max_length = len(str(cell.value))
+                        except:
+                            pass
+                    adjusted_width = min(max_length + 2, 50)
+                    worksheet.column_dimensions[column_letter].width = adjusted_width
+    
+    def find_duplicates(self, df):
+        """重複候補の検出（該当なしの場合は None）"""
+        try:
+            finder = DuplicateFinder(self.address_index, window=self.config.get("dedup_bucket_window"))
+            clusters = finder.find(df.to_dict('records'))
+        except Exception as e:
+            self.logger.error(f"重複検出エラー: {e}")
+            return None
+        if not clusters:
+            return None
+        
+        rows = []
+        for number, (members, reasons) in enumerate(clusters, 1):
+            for index in members:
+                record = df.iloc[index]
+                rows.append([number, '・'.join(sorted(reasons)), record['URL'], record['店舗名'],
+                             record['電話番号'], record['住所']])
+        self.logger.info(f"重複候補: {len(clusters)}グループ ({len(rows)}件)")
+        return pd.DataFrame(rows, columns=['重複グループ', '根拠', 'URL', '店舗名', '電話番号', '住所'])
+
+class JobService:
+    """取得ジョブのキュー管理（ローカルHTTPサービスの本体）
+    
+    投入されたジョブを workers 本のワーカースレッドが順に ScrapeEngine で実行し、
+    完了後に output_dir へ job_<ID>.<形式> として出力する。ブラウザ・エリアカタログ・
+    セレクタ統計・アクセス頻度制限はエンジンが全ジョブで共用する。
+    """
+    
+    FORMATS = ('xlsx', 'csv', 'json')
+    MAX_COUNT = MAX_STORE_COUNT
+    
+    def __init__(self, engine, output_dir, workers=2):
+        self.engine = engine
+        self.logger = engine.logger
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs = {}
+        self._active = set()        # 実行中・出力中のジョブID
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._workers = [threading.Thread(target=self._worker, name=f"job-worker-{index}", daemon=True)
+                         for index in range(max(int(workers), 1))]
+        for thread in self._workers:
+            thread.start()
+    
+    def submit(self, spec):
+        """ジョブ投入（指定内容が不正な場合は ValueError）"""
+        if not isinstance(spec, dict):
+            raise ValueError("ジョブ指定はJSONオブジェクトで指定してください")
+        
+        prefecture = spec.get('prefecture')
+        if prefecture not in self.engine.url_generator.prefecture_map:
+            raise ValueError(f"都道府県が不正です: {prefecture}")
+        city = spec.get('city') or ''
+        if city and city not in self.engine.url_generator.get_supported_cities(prefecture):
+            raise ValueError(f"市区町村が不正です: {city}")
+        
+        max_count = spec.get('max_count')
+        if isinstance(max_count, bool) or not isinstance(max_count, int) or not 1 <= max_count <= self.MAX_COUNT:
+            raise ValueError(f"max_count は1-{self.MAX_COUNT}の整数で指定してください")
+        
+        file_format = spec.get('format', 'xlsx')
+        if file_format not in self.FORMATS:
+            raise ValueError(f"format は {', '.join(self.FORMATS)} のいずれかで指定してください")
+        
+        fields = spec.get('fields') or []
+        if not isinstance(fields, list) or any(field not in STORE_FIELDS for field in fields):
+            raise ValueError(f"fields は {', '.join(STORE_FIELDS)} から選択してください")
+        
+        # プロファイルはプロセス全体を計測するため、ジョブ単位では受け付けない
+        job = ScrapeJob({
+            'prefecture': prefecture,
+            'city': city,
+            'max_count': max_count,
+            'format': file_format,
+            'fields': fields,
+            'listing_only': bool(spec.get('listing_only', False)),
+            'auto_partition': bool(spec.get('auto_partition', self.engine.config.get("auto_partition", True))),
+            'trace': bool(spec.get('trace', False)),
+            'save_path': str(self.output_dir)
+        })
+        job.params['filename'] = f"job_{job.id}"
+        with self._lock:
+            self.jobs[job.id] = job
+        self._queue.put(job)
+        self.logger.info(f"ジョブ受付: {job.id} ({prefecture} {city} {max_count}件 {file_format})")
+        return job
+    
+    def get(self, job_id):
+        """ジョブ取得（存在しない場合は None）"""
+        with self._lock:
+            return self.jobs.get(job_id)
+    
+    def list(self):
+        """全ジョブ（投入順）"""
+        with self._lock:
+            return list(self.jobs.values())
+    
+    def cancel(self, job_id):
+        """ジョブ停止（実行中の場合は取得済みの分を出力して終了する）"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.state == 'queued':
+            job.state = 'cancelled'
+            job.finished_at = time.time()
+        self.logger.info(f"ジョブ停止要求: {job.id}")
+        return job
+    
+    def describe(self, job):
+        """ジョブの状態・進捗（APIの応答形式）"""
+        def timestamp(value):
+            return datetime.fromtimestamp(value).isoformat(timespec='seconds') if value else None
+        
+        with self._lock:
+            state = job.state
+            if job.id in self._active and state not in ('queued', 'running'):
+                state = 'saving'
+        progress = job.latest.get('progress')
+        status = job.latest.get('status')
+        params = job.params
+        return {
+            'id': job.id,
+            'state': state,
+            'prefecture': params['prefecture'],
+            'city': params['city'],
+            'max_count': params['max_count'],
+            'format': params['format'],
+            'fields': params['fields'],
+            'count': len(job.records),
+            'failed': len(job.failed_urls),
+            'progress': round(progress[0], 1) if progress else 0.0,
+            'status': status[0] if status else '',
+            'stats': job.stats.describe(),
+            'error': job.error,
+            'created_at': timestamp(job.created_at),
+            'started_at': timestamp(job.started_at),
+            'finished_at': timestamp(job.finished_at),
+            'result': f"/jobs/{job.id}/result" if job.output_path and state != 'saving' else None
+        }
+    
+    def _worker(self):
+        """ジョブ実行スレッド"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.cancel_event.is_set():
+                continue
+            
+            with self._lock:
+                self._active.add(job.id)
+            try:
+                self.engine.run(job)
+            except Exception as e:
+                self.logger.error(f"ジョブエラー: {job.id}: {e}")
+            
+            try:
+                if len(job.records):
+                    path = self.output_dir / f"job_{job.id}.{job.params['format']}"
+                    self.engine.export(job, str(path), job.params['format'])
+            except Exception as e:
+                job.state = 'failed'
+                job.error = f"出力エラー: {e}"
+                self.logger.error(f"ジョブ出力エラー: {job.id}: {e}")
+            finally:
+                with self._lock:
+                    self._active.discard(job.id)
+            self.logger.info(f"ジョブ終了: {job.id} ({job.state}, {len(job.records)}件)")
+    
+    def shutdown(self):
+        """全ジョブを停止してワーカーを終了"""
+        for job in self.list():
+            job.cancel_event.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        for thread in self._workers:
+            thread.join()
+    
+    def serve_forever(self, host, port):
+        """HTTPサービス開始（Ctrl+C で停止）"""
+        server = ThreadingHTTPServer((host, port), JobRequestHandler)
+        server.daemon_threads = True
+        server.service = self
+        self.logger.info(f"ジョブサービス開始: http://{host}:{server.server_port}/jobs "
+                         f"(ワーカー: {len(self._workers)}, 出力先: {self.output_dir})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info("ジョブサービス中断")
+        finally:
+            server.server_close()
+            self.shutdown()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """ジョブサービスのHTTPハンドラ（JSON API）
+    
+    POST   /jobs              ジョブ投入（prefecture, city, max_count, format, fields, listing_only,
+                              auto_partition, trace）
+    GET    /jobs              ジョブ一覧
+    GET    /jobs/<ID>         ジョブの状態・進捗
+    GET    /jobs/<ID>/result  取得結果のダウンロード
+    DELETE /jobs/<ID>         ジョブ停止（取得済みの分は出力する）
+    """
+    
+    MAX_BODY = 64 * 1024
+    CONTENT_TYPES = {
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'csv': 'text/csv; charset=utf-8',
+        'json': 'application/json; charset=utf-8'
+    }
+    
+    @property
+    def service(self):
+        return self.server.service
+    
+    def log_message(self, format, *args):
+        """アクセスログはアプリケーションのログに出力"""
+        self.service.logger.info(f"HTTP {self.address_string()} {format % args}")
+    
+    def send_json(self, status, body):
+        """JSON応答"""
+        data = json.dumps(body, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def send_error_json(self, status, message):
+        """エラー応答"""
+        self.send_json(status, {'error': message})
+    
+    def route(self):
+        """パスの分解: (ジョブ, 残りのパス) / ジョブ一覧は (None, []) / 該当なしは None"""
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        if not parts or parts[0] != 'jobs':
+            return None
+        if len(parts) == 1:
+            return None, []
+        job = self.service.get(parts[1])
+        if job is None:
+            return None
+        return job, parts[2:]
+    
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            self.send_error_json(404, "見つかりません")
+            return
+        job, rest = route
+        if job is None:
+            self.send_json(200, [self.service.describe(job) for job in self.service.list()])
+        elif not rest:
+            self.send_json(200, self.service.describe(job))
+        elif rest == ['result']:
+            self.send_result(job)
+        else:
+            self.send_error_json(404, "見つかりません")
+    
+    def send_result(self, job):
+        """取得結果ファイルの送信"""
+        description = self.service.describe(job)
+        if not description['result']:
+            self.send_error_json(409, f"取得結果はまだありません (状態: {description['state']})")
+            return
+        try:
+            with open(job.output_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            self.send_error_json(500, f"取得結果の読み込みに失敗しました: {e}")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', self.CONTENT_TYPES[job.params['format']])
+        self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(job.output_path)}"')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip('/') != '/jobs':
+            self.send_error_json(404, "見つかりません")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= self.MAX_BODY:
+            self.send_error_json(400, f"ジョブ指定（JSON、{self.MAX_BODY}バイト以内）が必要です")
+            return
+        try:
+            spec = json.loads(self.rfile.read(length).decode('utf-8'))
+            job = self.service.submit(spec)
+        except ValueError as e:
+            # JSONの構文エラーも ValueError
+            self.send_error_json(400, str(e))
+            return
+        self.send_json(201, self.service.describe(job))
+    
+    def do_DELETE(self):
+        route = self.route()
+        if route is None or route[0] is None or route[1]:
+            self.send_error_json(404, "見つかりません")
+            return
+        job = self.service.cancel(route[0].id)
+        self.send_json(200, self.service.describe(job))
+
+class GurunaviScraper:
+    """ぐるなびスクレイピングメインクラス"""
+    
+    # UI更新キュー設定
+    UI_POLL_MS = 100           # キュー処理間隔(ms)
+    UI_BATCH_MAX = 500         # 1回の処理で取り出す最大イベント数
+    RESULT_VIEW_ROWS = 15      # 結果表示に同時に描画する最大行数
+    
+    # ログ設定
+    LOG_MAX_BYTES = 5 * 1024 * 1024   # ログファイルのローテーションサイズ
+    LOG_BACKUP_COUNT = 3               # 保持する旧ログファイル数
+    LOG_POLL_MS = 1000                 # ログタブ追従間隔(ms)
+    LOG_TAIL_BYTES = 64 * 1024         # ログタブ初回表示で読む末尾サイズ
+    LOG_VIEW_MAX_LINES = 2000          # ログタブに保持する最大行数
+    
+    def __init__(self, profile=False):
+        self.window = tk.Tk()
+        self.window.title("ぐるなびおすすめ店舗取得ツール v2.1")
+        self.window.geometry("950x750")
+        self.window.resizable(True, True)
+        
+        # 設定
+        self.app_dir = Path.cwd()
+        self.config_file = self.app_dir / "scraper_config.json"
+        self.log_file = self.app_dir / "scraper.log"
+        
+        # 初期化
+        self.default_save_path = os.path.join(os.path.expanduser("~"), "Downloads")
+        self.is_scraping = False
+        self.cli_profile = profile
+        
+        # 停止要求（全ての待機・取得処理が参照する）
+        self.cancel_event = threading.Event()
+        
+        # UI更新キュー（ワーカースレッド → Tkスレッド）
+        self.ui_queue = queue.Queue()
+        self.view_offset = 0
+        self.view_follow = True
+        
+        # ログ・設定
+        self.setup_logging()
+        self.load_config()
+        
+        # 取得処理本体（ブラウザ・エリアカタログ・セレクタ統計を保持）
+        self.engine = ScrapeEngine(self.config, self.logger, self.app_dir)
+        self.area_catalog = self.engine.area_catalog
+        self.url_generator = self.engine.url_generator
+        self.job = ScrapeJob(cancel_event=self.cancel_event, listener=self.post_ui)
+        
+        self.setup_ui()
+    
+    @property
+    def scraped_data(self):
+        """現在のジョブの取得結果"""
+        return self.job.records
+    
+    def setup_logging(self):
+        """ログ設定（キュー経由の非同期出力・サイズローテーション）"""
+        self.logger, self.log_listener = setup_logging(self.log_file, self.LOG_MAX_BYTES, self.LOG_BACKUP_COUNT)
+        self.logger.info("アプリケーション開始 v2.1")
+    
+    def load_config(self):
+        """設定読み込み"""
+        self.config = load_config_file(self.config_file, self.app_dir, self.logger)
     
     def save_config(self):
         """設定保存"""
@@ -355,14 +4144,31 @@ class GurunaviScraper:
         ttk.Label(search_frame, text="取得店舗数:").grid(row=1, column=0, sticky=tk.W, pady=(15, 0), padx=(0, 10))
         self.max_count_var = tk.StringVar(value="30")
         max_count_spinbox = ttk.Spinbox(search_frame, textvariable=self.max_count_var, 
-                                       from_=1, to=300, width=15)
+                                       from_=1, to=MAX_STORE_COUNT, width=15)
         max_count_spinbox.grid(row=1, column=1, pady=(15, 0))
         
+        # 一覧のみモード
+        self.listing_only_var = tk.BooleanVar(value=self.config.get("listing_only", False))
+        ttk.Checkbutton(search_frame, text="一覧ページのみで取得（高速）", 
+                       variable=self.listing_only_var).grid(row=1, column=2, columnspan=2, 
+                                                            sticky=tk.W, pady=(15, 0))
+        
+        # 取得項目（全て選択時は全項目。一覧にある項目だけなら詳細ページを取得しない）
+        ttk.Label(search_frame, text="取得項目:").grid(row=2, column=0, sticky=tk.W, pady=(10, 0), padx=(0, 10))
+        fields_frame = ttk.Frame(search_frame)
+        fields_frame.grid(row=2, column=1, columnspan=3, sticky=tk.W, pady=(10, 0))
+        selected_fields = self.config.get("fields") or LiveStats.FIELDS
+        self.field_vars = {}
+        for column, field in enumerate(LiveStats.FIELDS):
+            self.field_vars[field] = tk.BooleanVar(value=field in selected_fields)
+            ttk.Checkbutton(fields_frame, text=field, variable=self.field_vars[field]).grid(
+                row=0, column=column, sticky=tk.W, padx=(0, 8))
+        
         # URL表示
-        ttk.Label(search_frame, text="検索URL:").grid(row=2, column=0, sticky=tk.W, pady=(10, 0), padx=(0, 10))
+        ttk.Label(search_frame, text="検索URL:").grid(row=3, column=0, sticky=tk.W, pady=(10, 0), padx=(0, 10))
         self.url_var = tk.StringVar(value="都道府県を選択してください")
         url_display = ttk.Entry(search_frame, textvariable=self.url_var, width=60, state='readonly')
-        url_display.grid(row=2, column=1, columnspan=3, pady=(10, 0), sticky=(tk.W, tk.E))
+        url_display.grid(row=3, column=1, columnspan=3, pady=(10, 0), sticky=(tk.W, tk.E))
         
         # 保存設定
         save_frame = ttk.LabelFrame(self.main_tab, text="保存設定", padding="15")
@@ -425,25 +4231,39 @@ class GurunaviScraper:
         self.time_label = ttk.Label(status_info_frame, textvariable=self.time_var)
         self.time_label.pack(anchor=tk.W)
         
+        self.pipeline_var = tk.StringVar(value="")
+        self.pipeline_label = ttk.Label(status_info_frame, textvariable=self.pipeline_var)
+        self.pipeline_label.pack(anchor=tk.W)
+        
+        self.stats_var = tk.StringVar(value="")
+        self.stats_label = ttk.Label(status_info_frame, textvariable=self.stats_var)
+        self.stats_label.pack(anchor=tk.W)
+        
         # 結果表示
         result_frame = ttk.LabelFrame(self.main_tab, text="取得結果", padding="10")
         result_frame.grid(row=4, column=0, columnspan=4, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
         
+        # 仮想化表示: Treeviewには表示範囲の行だけを描画し、縦スクロールはデータ全体に対応させる
         columns = ('No.', '店舗名', '電話番号', '住所', 'ジャンル', '営業時間')
-        self.tree = ttk.Treeview(result_frame, columns=columns, show='headings', height=8)
+        self.tree = ttk.Treeview(result_frame, columns=columns, show='headings', 
+                                 height=self.RESULT_VIEW_ROWS)
         
         column_widths = {'No.': 50, '店舗名': 200, '電話番号': 120, '住所': 250, 'ジャンル': 100, '営業時間': 150}
         for col in columns:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=column_widths.get(col, 100))
         
-        v_scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.result_scrollbar = ttk.Scrollbar(result_frame, orient=tk.VERTICAL, command=self.on_result_scroll)
         h_scrollbar = ttk.Scrollbar(result_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        self.tree.bind('<MouseWheel>', self.on_result_wheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll_result_view(-1))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_result_view(1))
         
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.result_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
         h_scrollbar.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.result_scrollbar.set(0.0, 1.0)
         
         result_frame.columnconfigure(0, weight=1)
         result_frame.rowconfigure(0, weight=1)
@@ -463,16 +4283,49 @@ class GurunaviScraper:
         
         # ChromeDriverステータス表示
         ttk.Label(chrome_frame, text="ChromeDriverの場所:").grid(row=1, column=0, sticky=tk.W, pady=(10, 5))
-        driver_status = "✅ 利用可能" if self.chromedriver_path.exists() else "❌ 未設定"
-        ttk.Label(chrome_frame, text=f"{self.drivers_dir}/chromedriver.exe").grid(row=2, column=0, sticky=tk.W)
+        driver_status = "✅ 利用可能" if self.engine.chromedriver_path.exists() else "❌ 未設定"
+        ttk.Label(chrome_frame, text=f"{self.engine.drivers_dir}/chromedriver.exe").grid(row=2, column=0, sticky=tk.W)
         ttk.Label(chrome_frame, text=driver_status).grid(row=3, column=0, sticky=tk.W, pady=(5, 10))
         
         # ChromeDriver修正ボタン
         ttk.Button(chrome_frame, text="ChromeDriver修正", command=self.fix_chromedriver).grid(row=4, column=0, pady=(10, 0))
         
+        # エリアカタログ
+        area_frame = ttk.LabelFrame(self.config_tab, text="エリアカタログ", padding="15")
+        area_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        self.auto_partition_var = tk.BooleanVar(value=self.config.get("auto_partition", True))
+        ttk.Checkbutton(area_frame, text="件数の多いエリアを自動分割（10ページ上限対策）", 
+                       variable=self.auto_partition_var).grid(row=0, column=0, sticky=tk.W)
+        ttk.Button(area_frame, text="選択中の都道府県のエリアを取得", 
+                  command=self.refresh_area_catalog).grid(row=1, column=0, sticky=tk.W, pady=(10, 0))
+        self.catalog_status_var = tk.StringVar(value=f"登録都道府県: {len(self.area_catalog.prefectures)}件")
+        ttk.Label(area_frame, textvariable=self.catalog_status_var).grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        
+        # 性能プロファイル
+        perf_frame = ttk.LabelFrame(self.config_tab, text="性能プロファイル", padding="15")
+        perf_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 15))
+        
+        self.profile_var = tk.StringVar(
+            value=PROFILE_NAMES.get(self.config.get("performance_profile", "balanced"), PROFILE_NAMES['balanced']))
+        profile_combo = ttk.Combobox(perf_frame, textvariable=self.profile_var, width=12, state='readonly',
+                                     values=list(PROFILE_NAMES.values()))
+        profile_combo.grid(row=0, column=0, sticky=tk.W)
+        ttk.Button(perf_frame, text="適用（実行中も反映）", 
+                  command=self.apply_performance_profile).grid(row=0, column=1, padx=(10, 0))
+        self.profile_info_var = tk.StringVar(value=self.describe_profile())
+        ttk.Label(perf_frame, textvariable=self.profile_info_var, justify=tk.LEFT).grid(
+            row=1, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
+        self.trace_var = tk.BooleanVar(value=self.config.get("trace_enabled", False))
+        ttk.Checkbutton(perf_frame, text="処理時間トレースを出力（*_trace.json、Chrome trace形式）", 
+                       variable=self.trace_var).grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
+        self.profile_enabled_var = tk.BooleanVar(value=self.cli_profile or self.config.get("profile_enabled", False))
+        ttk.Checkbutton(perf_frame, text="プロファイル出力（*_profile.pstats / *.collapsed.txt）", 
+                       variable=self.profile_enabled_var).grid(row=3, column=0, columnspan=2, sticky=tk.W)
+        
         # フォルダ構成説明
         info_frame = ttk.LabelFrame(self.config_tab, text="フォルダ構成", padding="15")
-        info_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(15, 0))
+        info_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(15, 0))
         
         folder_info = (
             "📁 ツールのフォルダ構成:\n\n"
@@ -482,12 +4335,15 @@ class GurunaviScraper:
             f"├── output/\n"
             f"│   └── *.xlsx (取得結果ファイル)\n"
             f"├── scraper_config.json (設定ファイル)\n"
+            f"├── area_catalog.json (エリアカタログ)\n"
+            f"├── selector_stats.json (セレクタ命中統計)\n"
+            f"├── municipalities.csv (市区町村表・住所コード付与用)\n"
             f"└── scraper.log (ログファイル)"
         )
         ttk.Label(info_frame, text=folder_info, justify=tk.LEFT).grid(row=0, column=0, sticky=tk.W)
         
         # 設定保存
-        ttk.Button(self.config_tab, text="設定保存", command=self.save_current_config).grid(row=2, column=0, pady=(15, 0))
+        ttk.Button(self.config_tab, text="設定保存", command=self.save_current_config).grid(row=4, column=0, pady=(15, 0))
     
     def setup_log_tab(self):
         """ログタブ設定"""
@@ -501,7 +4357,8 @@ class GurunaviScraper:
         self.log_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         log_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        # ログ更新
+        # ログ追従（前回の読み込み位置から差分のみ読む）
+        self.log_offset = None
         self.update_log_display()
     
     def get_prefecture_list(self):
@@ -549,6 +4406,47 @@ class GurunaviScraper:
             self.logger.error(f"検索URL更新エラー: {e}")
             self.url_var.set("URL生成エラー")
     
+    def describe_profile(self):
+        """現在の性能プロファイルの内容"""
+        perf = self.engine.perf
+        return (
+            f"アクセス間隔: {perf('delay_min')}〜{perf('delay_max')}秒 / "
+            f"ページ送り待機: {perf('page_delay')}秒\n"
+            f"読み込みタイムアウト: {perf('page_load_timeout')}秒 / "
+            f"通信タイムアウト: {perf('timeout')}秒\n"
+            f"取得スレッド: {perf('fetch_workers')} / 解析プロセス: {perf('parse_workers')} / "
+            f"キュー上限: {perf('pipeline_queue_size')}\n"
+            f"※解析プロセス数・キュー上限は次回実行から反映"
+        )
+    
+    def apply_performance_profile(self):
+        """性能プロファイル適用"""
+        names = {label: name for name, label in PROFILE_NAMES.items()}
+        name = names.get(self.profile_var.get(), 'balanced')
+        self.config["performance_profile"] = name
+        self.save_config()
+        self.profile_info_var.set(self.describe_profile())
+        self.logger.info(f"性能プロファイル変更: {name}")
+    
+    def refresh_area_catalog(self):
+        """エリアカタログ更新（選択中の都道府県、バックグラウンド実行）"""
+        prefecture = self.prefecture_var.get()
+        if not prefecture:
+            messagebox.showerror("エラー", "都道府県を選択してください。")
+            return
+        
+        self.catalog_status_var.set(f"{prefecture}のエリアを取得中...")
+        
+        def worker():
+            try:
+                self.engine.discover_areas(prefecture)
+                self.post_ui('catalog', f"{prefecture}: 取得完了 (登録都道府県: {len(self.area_catalog.prefectures)}件)")
+            except Exception as e:
+                self.logger.error(f"エリアカタログ更新エラー: {e}")
+                self.post_ui('catalog', f"{prefecture}: 取得失敗")
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
     def browse_save_path(self):
         """保存先選択"""
         folder_path = filedialog.askdirectory(initialdir=self.save_path_var.get())
@@ -581,7 +4479,12 @@ class GurunaviScraper:
         try:
             self.config.update({
                 "last_save_path": self.save_path_var.get(),
-                "headless": self.headless_var.get()
+                "headless": self.headless_var.get(),
+                "listing_only": self.listing_only_var.get(),
+                "fields": self.selected_fields(),
+                "auto_partition": self.auto_partition_var.get(),
+                "trace_enabled": self.trace_var.get(),
+                "profile_enabled": self.profile_enabled_var.get()
             })
             self.save_config()
             messagebox.showinfo("設定保存", "設定が保存されました。")
@@ -589,31 +4492,93 @@ class GurunaviScraper:
             messagebox.showerror("設定エラー", f"設定保存エラー: {e}")
     
     def update_log_display(self):
-        """ログ表示更新"""
+        """ログ表示更新（追記分のみ読み込み、一定間隔で再実行）"""
         try:
             if self.log_file.exists():
-                with open(self.log_file, 'r', encoding='utf-8') as f:
-                    log_content = f.read()
-                self.log_text.delete(1.0, tk.END)
-                self.log_text.insert(tk.END, log_content)
-                self.log_text.see(tk.END)
+                size = self.log_file.stat().st_size
+                
+                skip_partial_line = False
+                if self.log_offset is None:
+                    # 初回は末尾のみ表示（途中から読む場合は先頭の欠けた行を捨てる）
+                    self.log_offset = max(size - self.LOG_TAIL_BYTES, 0)
+                    skip_partial_line = self.log_offset > 0
+                elif size < self.log_offset:
+                    # ローテーションされた場合は新ファイルの先頭から
+                    self.log_offset = 0
+                
+                if size > self.log_offset:
+                    with open(self.log_file, 'rb') as f:
+                        f.seek(self.log_offset)
+                        chunk = f.read(size - self.log_offset)
+                    
+                    # 書き込み途中の行は次回に回す
+                    last_newline = chunk.rfind(b'\n')
+                    if last_newline >= 0:
+                        chunk = chunk[:last_newline + 1]
+                        self.log_offset += len(chunk)
+                        if skip_partial_line:
+                            chunk = chunk[chunk.find(b'\n') + 1:]
+                        self.append_log_text(chunk.decode('utf-8', errors='replace'))
         except Exception as e:
             self.log_text.insert(tk.END, f"ログ読み込みエラー: {e}\n")
+        finally:
+            self.window.after(self.LOG_POLL_MS, self.update_log_display)
+    
+    def append_log_text(self, text):
+        """ログタブへ追記（最大行数を超えた分は先頭から削除）"""
+        at_bottom = self.log_text.yview()[1] >= 0.999
+        self.log_text.insert(tk.END, text)
+        
+        line_count = int(self.log_text.index('end-1c').split('.')[0])
+        excess = line_count - self.LOG_VIEW_MAX_LINES
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+        
+        if at_bottom:
+            self.log_text.see(tk.END)
     
     def start_scraping(self):
         """スクレイピング開始"""
         if not self.validate_inputs():
             return
         
+        self.cancel_event.clear()
         self.set_scraping_state(True)
-        self.scraped_data = []
         self.clear_results()
         
+        # ワーカーはTk変数に触れないよう、開始時点の入力値を渡す
+        self.job = ScrapeJob(self.collect_job_params(), cancel_event=self.cancel_event, listener=self.post_ui)
+        
         # スレッドで実行
         thread = threading.Thread(target=self.scrape_worker)
         thread.daemon = True
         thread.start()
     
+    def collect_job_params(self):
+        """画面入力値の取得（Tkスレッド専用）"""
+        try:
+            max_count = int(self.max_count_var.get())
+        except ValueError:
+            max_count = 0
+        
+        return {
+            'prefecture': self.prefecture_var.get(),
+            'city': self.city_var.get(),
+            'max_count': max_count,
+            'listing_only': self.listing_only_var.get(),
+            'auto_partition': self.auto_partition_var.get(),
+            'fields': self.selected_fields(),
+            'trace': self.trace_var.get(),
+            'profile': self.profile_enabled_var.get(),
+            'save_path': self.save_path_var.get(),
+            'filename': self.filename_var.get().strip()
+        }
+    
+    def selected_fields(self):
+        """選択中の取得項目（全て選択時は空リスト = 全項目）"""
+        fields = [field for field, var in self.field_vars.items() if var.get()]
+        return [] if len(fields) == len(self.field_vars) else fields
+    
     def validate_inputs(self):
         """入力値検証"""
         if not self.prefecture_var.get():
@@ -622,16 +4587,20 @@ class GurunaviScraper:
         
         try:
             max_count = int(self.max_count_var.get())
-            if max_count <= 0 or max_count > 300:
+            if max_count <= 0 or max_count > MAX_STORE_COUNT:
                 raise ValueError
         except ValueError:
-            messagebox.showerror("エラー", "取得店舗数は1-300の範囲で入力してください。")
+            messagebox.showerror("エラー", f"取得店舗数は1-{MAX_STORE_COUNT}の範囲で入力してください。")
             return False
         
         if not self.filename_var.get().strip():
             messagebox.showerror("エラー", "ファイル名を入力してください。")
             return False
         
+        if not any(var.get() for var in self.field_vars.values()):
+            messagebox.showerror("エラー", "取得項目を1つ以上選択してください。")
+            return False
+        
         if not SELENIUM_AVAILABLE:
             messagebox.showerror("エラー", "Seleniumが利用できません。")
             return False
@@ -645,507 +4614,202 @@ class GurunaviScraper:
         self.stop_button.config(state='normal' if is_scraping else 'disabled')
     
     def stop_scraping(self):
-        """スクレイピング停止"""
-        self.is_scraping = False
-        if self.driver:
-            try:
-                self.driver.quit()
-            except:
-                pass
-            self.driver = None
-        self.set_scraping_state(False)
-        self.status_var.set("停止されました")
-        self.logger.info("スクレイピング停止")
+        """スクレイピング停止
+        
+        停止要求を出すだけで、ブラウザの終了と途中結果の保存はワーカースレッドが行う
+        （Tkスレッドから使用中のブラウザを終了しない）。
+        """
+        self.cancel_event.set()
+        self.stop_button.config(state='disabled')
+        self.status_var.set("停止中...（取得済みデータを保存しています）")
+        self.logger.info("スクレイピング停止要求")
     
     def clear_results(self):
         """結果クリア"""
         for item in self.tree.get_children():
             self.tree.delete(item)
-        self.scraped_data = []
+        self.job = ScrapeJob(cancel_event=self.cancel_event, listener=self.post_ui)
+        self.stats_var.set("")
+        self.view_offset = 0
+        self.view_follow = True
+        self.result_scrollbar.set(0.0, 1.0)
         self.count_var.set("取得件数: 0")
         self.progress_var.set(0)
     
     def manual_export(self):
         """手動エクスポート"""
-        self.save_to_excel()
+        self.save_to_excel(self.collect_job_params())
     
     def scrape_worker(self):
         """スクレイピングワーカー"""
+        job = self.job
         start_time = time.time()
         try:
-            self.logger.info("おすすめ店舗取得開始")
-            self.status_var.set("初期化中...")
-            
-            if not self.setup_driver():
-                return
-            
-            max_count = int(self.max_count_var.get())
-            prefecture = self.prefecture_var.get()
-            
-            self.perform_scraping(max_count)
+            self.engine.run(job)
             
-            if self.is_scraping:
-                self.save_to_excel()
+            prefecture = job.params['prefecture']
+            if job.state == 'cancelled':
+                # 停止時も取得済みの分は保存する
+                elapsed_time = time.time() - start_time
+                if len(job.records):
+                    self.save_to_excel(job.params)
+                self.post_ui('time', f"処理時間: {elapsed_time:.1f}秒")
+                self.post_ui('status', f"停止されました: {len(job.records)}件取得（途中結果を保存）")
+                self.logger.info(f"スクレイピング停止: {len(job.records)}件保存")
+            else:
+                self.save_to_excel(job.params)
                 elapsed_time = time.time() - start_time
-                self.time_var.set(f"処理時間: {elapsed_time:.1f}秒")
-                self.status_var.set(f"完了: {len(self.scraped_data)}件取得")
+                self.post_ui('time', f"処理時間: {elapsed_time:.1f}秒")
+                self.post_ui('status', f"完了: {len(job.records)}件取得")
                 
-                messagebox.showinfo("完了", 
+                self.post_ui('message', 'info', "完了", 
                     f"【{prefecture}のおすすめ店舗取得完了】\n\n"
-                    f"取得件数: {len(self.scraped_data)}件\n"
+                    f"取得件数: {len(job.records)}件\n"
+                    f"取得失敗: {len(job.failed_urls)}件\n"
                     f"処理時間: {elapsed_time:.1f}秒\n\n"
                     f"Excelファイルに保存されました。")
             
         except Exception as e:
             elapsed_time = time.time() - start_time
-            self.time_var.set(f"エラー時間: {elapsed_time:.1f}秒")
+            self.post_ui('time', f"エラー時間: {elapsed_time:.1f}秒")
             self.logger.error(f"スクレイピングエラー: {e}")
-            messagebox.showerror("エラー", f"エラーが発生しました:\n{str(e)}")
+            self.post_ui('message', 'error', "エラー", f"エラーが発生しました:\n{str(e)}")
         finally:
-            self.cleanup_driver()
-            self.set_scraping_state(False)
+            self.cancel_event.clear()
+            self.post_ui('state', False)
     
-    def setup_driver(self):
-        """ドライバー設定"""
+    def save_to_excel(self, params):
+        """Excel保存"""
         try:
-            chrome_options = Options()
-            
-            if self.config.get("headless", True):
-                chrome_options.add_argument("--headless")
-            
-            # 高速化オプション
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--disable-gpu")
-            chrome_options.add_argument("--disable-images")
-            chrome_options.add_argument("--disable-javascript")
-            chrome_options.add_argument("--ignore-ssl-errors")
-            chrome_options.add_argument("--ignore-certificate-errors")
-            
-            window_size = self.config.get("window_size", "1280,720")
-            chrome_options.add_argument(f"--window-size={window_size}")
-            
-            user_agent = self.config.get("user_agent", "")
-            if user_agent:
-                chrome_options.add_argument(f"--user-agent={user_agent}")
+            if not self.scraped_data:
+                self.post_ui('message', 'warning', "警告", "保存するデータがありません。")
+                return
             
-            driver_path = self.get_chromedriver_path()
-            if not driver_path:
-                raise Exception("ChromeDriverが見つかりません。")
+            save_path = params['save_path']
+            filename = params['filename']
+            if not filename.endswith('.xlsx'):
+                filename += '.xlsx'
             
-            service = Service(driver_path, log_path='nul')
-            self.driver = webdriver.Chrome(service=service, options=chrome_options)
-            self.driver.implicitly_wait(5)
-            self.driver.set_page_load_timeout(20)
+            full_path = os.path.join(save_path, filename)
+            self.engine.export(self.job, full_path, params=params)
             
-            self.logger.info("Webドライバー初期化完了")
-            return True
+            self.config["last_save_path"] = save_path
+            self.save_config()
             
         except Exception as e:
-            self.logger.error(f"ドライバー初期化エラー: {e}")
-            messagebox.showerror("エラー", f"ブラウザドライバー初期化失敗:\n{e}")
-            return False
-    
-    def get_chromedriver_path(self):
-        """ChromeDriverパス取得（専用フォルダ対応）"""
-        # 1. 専用driversフォルダを最優先
-        if self.chromedriver_path.exists():
-            self.logger.info(f"専用フォルダのChromeDriverを使用: {self.chromedriver_path}")
-            return str(self.chromedriver_path)
-        
-        # 2. レガシー：実行フォルダ直下（後方互換性）
-        legacy_driver = self.app_dir / "chromedriver.exe"
-        if legacy_driver.exists():
-            self.logger.info(f"実行フォルダ直下のChromeDriverを使用: {legacy_driver}")
-            # 専用フォルダに移動
-            try:
-                shutil.move(str(legacy_driver), str(self.chromedriver_path))
-                self.logger.info(f"ChromeDriverを専用フォルダに移動しました")
-                return str(self.chromedriver_path)
-            except Exception as e:
-                self.logger.warning(f"移動失敗: {e}")
-                return str(legacy_driver)
-        
-        # 3. webdriver-manager（最後の手段）
-        if WEBDRIVER_MANAGER_AVAILABLE:
-            try:
-                self.logger.info("webdriver-managerでChromeDriverを取得")
-                downloaded_path = ChromeDriverManager().install()
-                # 専用フォルダにコピー
-                shutil.copy2(downloaded_path, self.chromedriver_path)
-                self.logger.info(f"webdriver-managerから専用フォルダにコピー")
-                return str(self.chromedriver_path)
-            except Exception as e:
-                self.logger.error(f"webdriver-manager エラー: {e}")
-        
-        return None
+            self.logger.error(f"Excel保存エラー: {e}")
+            self.post_ui('message', 'error', "保存エラー", f"ファイル保存エラー:\n{str(e)}")
     
-    def cleanup_driver(self):
-        """ドライバークリーンアップ"""
-        if self.driver:
-            try:
-                self.driver.quit()
-            except:
-                pass
-            self.driver = None
+    def post_ui(self, kind, *args):
+        """UIイベント投入（任意スレッドから呼び出し可）"""
+        self.ui_queue.put((kind, args))
     
-    def perform_scraping(self, max_count):
-        """スクレイピング実行"""
+    def process_ui_queue(self):
+        """UIイベント一括処理（Tkスレッドの after() で定期実行）"""
+        latest = {}
+        messages = []
+        state = None
+        has_new_records = False
+        
         try:
-            prefecture = self.prefecture_var.get()
-            city = self.city_var.get()
-            
-            if city:
-                search_url = self.url_generator.generate_city_url(prefecture, city)
-                search_target = f"{prefecture} {city}"
-            else:
-                search_url = self.url_generator.generate_prefecture_url(prefecture)
-                search_target = prefecture
-            
-            self.logger.info(f"検索URL: {search_url}")
-            self.logger.info(f"目標取得数: {max_count}件")
-            
-            self.status_var.set(f"{search_target}のおすすめ店舗にアクセス中...")
-            
-            start_time = time.time()
-            self.driver.get(search_url)
-            
-            # ページ読み込み待機
-            WebDriverWait(self.driver, 15).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            
-            collected_count = 0
-            page_num = 1
-            
-            while self.is_scraping and collected_count < max_count:
-                self.status_var.set(f"ページ {page_num} 処理中... ({collected_count}/{max_count})")
-                self.logger.info(f"ページ {page_num} 処理開始")
-                
-                # 店舗リンク抽出
-                store_links = self.extract_store_links()
-                
-                if not store_links:
-                    self.logger.info("店舗リンクが見つかりません")
-                    if self.has_next_page() and page_num < 10:
-                        self.go_to_next_page()
-                        page_num += 1
-                        time.sleep(2)
-                        continue
-                    else:
-                        break
-                
-                self.logger.info(f"ページ {page_num} で {len(store_links)} 件発見")
-                
-                # 各店舗の詳細取得
-                for i, link in enumerate(store_links):
-                    if not self.is_scraping or collected_count >= max_count:
-                        break
-                    
-                    self.status_var.set(f"店舗 {i+1}/{len(store_links)} 処理中...")
-                    
-                    store_data = self.scrape_store_detail(link)
-                    if store_data:
-                        collected_count += 1
-                        self.scraped_data.append(store_data)
-                        
-                        self.update_result_display(store_data, collected_count)
-                        
-                        progress = min((collected_count / max_count) * 100, 100)
-                        self.progress_var.set(progress)
-                        self.count_var.set(f"取得件数: {collected_count}")
-                        
-                        elapsed_time = time.time() - start_time
-                        self.time_var.set(f"処理時間: {elapsed_time:.1f}秒")
-                        
-                        self.window.update_idletasks()
-                    
-                    # 待機
-                    self.smart_delay()
-                
-                # 目標達成チェック
-                if collected_count >= max_count:
+            for _ in range(self.UI_BATCH_MAX):
+                try:
+                    kind, args = self.ui_queue.get_nowait()
+                except queue.Empty:
                     break
                 
-                # 次ページ移動
-                if self.has_next_page() and page_num < 10:
-                    self.logger.info("次ページに移動")
-                    self.go_to_next_page()
-                    page_num += 1
-                    time.sleep(2)
+                if kind == 'record':
+                    has_new_records = True
+                    latest['count'] = args
+                elif kind == 'message':
+                    messages.append(args)
+                elif kind == 'state':
+                    state = args[0]
                 else:
-                    break
-            
-            total_time = time.time() - start_time
-            self.logger.info(f"取得完了: {collected_count}件 (時間: {total_time:.2f}秒)")
-            
-        except Exception as e:
-            self.logger.error(f"スクレイピングエラー: {e}")
-            raise
-    
-    def extract_store_links(self):
-        """店舗リンク抽出"""
-        try:
-            selectors = [
-                "a[href*='r.gnavi.co.jp/'][href*='/']",
-                ".shop-info a",
-                ".restaurant-item a",
-                ".shop-list a",
-                ".shop-name a",
-                "li a[href*='r.gnavi.co.jp']"
-            ]
-            
-            links = []
-            for selector in selectors:
-                try:
-                    elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    for element in elements:
-                        href = element.get_attribute('href')
-                        if href and self.is_valid_store_url(href):
-                            if href not in links:
-                                links.append(href)
-                                if len(links) >= 30:
-                                    break
-                except:
-                    continue
-                
-                if len(links) >= 30:
-                    break
+                    # status/progress/time は最新値のみ反映
+                    latest[kind] = args
             
-            self.logger.info(f"店舗リンク抽出: {len(links)} 件")
-            return links
+            if 'status' in latest:
+                self.status_var.set(latest['status'][0])
+            if 'progress' in latest:
+                self.progress_var.set(latest['progress'][0])
+            if 'time' in latest:
+                self.time_var.set(latest['time'][0])
+            if 'pipeline' in latest:
+                self.pipeline_var.set(latest['pipeline'][0])
+            if 'stats' in latest:
+                self.stats_var.set(latest['stats'][0])
+            if 'catalog' in latest:
+                self.catalog_status_var.set(latest['catalog'][0])
+            if 'count' in latest:
+                self.count_var.set(f"取得件数: {latest['count'][0]}")
+            if has_new_records:
+                self.update_result_display()
+            if state is not None:
+                self.set_scraping_state(state)
             
+            for level, title, text in messages:
+                if level == 'error':
+                    messagebox.showerror(title, text)
+                elif level == 'warning':
+                    messagebox.showwarning(title, text)
+                else:
+                    messagebox.showinfo(title, text)
         except Exception as e:
-            self.logger.error(f"店舗リンク抽出エラー: {e}")
-            return []
+            self.logger.error(f"UI更新エラー: {e}")
+        finally:
+            self.window.after(self.UI_POLL_MS, self.process_ui_queue)
     
-    def is_valid_store_url(self, url):
-        """有効店舗URLチェック"""
-        if not url:
-            return False
+    def update_result_display(self):
+        """結果表示更新（表示範囲の行だけを描画）"""
+        total = len(self.scraped_data)
+        max_offset = max(total - self.RESULT_VIEW_ROWS, 0)
+        if self.view_follow:
+            self.view_offset = max_offset
+        self.view_offset = min(max(self.view_offset, 0), max_offset)
         
-        # 除外パターン
-        exclude_patterns = ['/rs/', '/area/', '/search', '/guide', '/api/']
-        for pattern in exclude_patterns:
-            if pattern in url:
-                return False
+        for item in self.tree.get_children():
+            self.tree.delete(item)
         
-        # 有効パターン
-        valid_patterns = [
-            r'r\.gnavi\.co\.jp/[a-zA-Z0-9]+/?'
-            r'r\.gnavi\.co\.jp/[a-zA-Z0-9]+/[a-zA-Z0-9]*/?'
-        ]
+        end = min(self.view_offset + self.RESULT_VIEW_ROWS, total)
+        for index in range(self.view_offset, end):
+            store_data = self.scraped_data[index]
+            self.tree.insert('', 'end', values=(
+                index + 1,
+                store_data.get('店舗名', '-'),
+                store_data.get('電話番号', '-'),
+                store_data.get('住所', '-'),
+                store_data.get('ジャンル', '-'),
+                store_data.get('営業時間', '-')
+            ))
         
-        return any(re.search(pattern, url) for pattern in valid_patterns)
-    
-    def scrape_store_detail(self, url):
-        """店舗詳細取得"""
-        try:
-            self.logger.debug(f"店舗詳細取得: {url}")
-            
-            self.driver.get(url)
-            time.sleep(0.5)
-            
-            # 要件に合わせた9項目を取得
-            store_data = {
-                'URL': url,
-                '店舗名': self.extract_text(['h1', '.shop-name', '.restaurant-name']),
-                '電話番号': self.extract_phone_number(),
-                '住所': self.extract_text(['.address', '.shop-address', '[class*="address"]']),
-                'ジャンル': self.extract_text(['.genre', '.category', '[class*="genre"]']),
-                '営業時間': self.extract_text(['.business-hours', '.opening-hours', '[class*="hours"]']),
-                '定休日': self.extract_text(['.holiday', '.closed', '[class*="holiday"]']),
-                'クレジットカード': self.extract_text(['.credit-card', '[class*="credit"]', '[class*="card"]']),
-                '取得日時': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            # 空の場合は「-」を設定
-            for key, value in store_data.items():
-                if key in ['URL', '取得日時']:
-                    continue
-                if not value or (isinstance(value, str) and not value.strip()):
-                    store_data[key] = '-'
-                elif isinstance(value, str):
-                    store_data[key] = value.strip()
-            
-            self.logger.debug(f"取得完了: {store_data.get('店舗名', '-')}")
-            return store_data
-            
-        except Exception as e:
-            self.logger.warning(f"店舗詳細取得エラー ({url}): {e}")
-            # エラー時も基本構造を返す
-            return {
-                'URL': url,
-                '店舗名': '-',
-                '電話番号': '-',
-                '住所': '-',
-                'ジャンル': '-',
-                '営業時間': '-',
-                '定休日': '-',
-                'クレジットカード': '-',
-                '取得日時': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-    
-    def extract_phone_number(self):
-        """電話番号抽出"""
-        selectors = ['a[href^="tel:"]', '.phone', '.tel', '[class*="phone"]']
-        text = self.extract_text(selectors)
-        if text:
-            phone_match = re.search(r'(\d{2,4}[-\s]?\d{2,4}[-\s]?\d{4})', text)
-            if phone_match:
-                return phone_match.group(1)
-        return text
-    
-    def extract_text(self, selectors):
-        """テキスト抽出"""
-        for selector in selectors:
-            try:
-                element = self.driver.find_element(By.CSS_SELECTOR, selector)
-                text = element.text.strip()
-                if text:
-                    return text
-                text = element.get_attribute('textContent')
-                if text and text.strip():
-                    return text.strip()
-            except:
-                continue
-        return ''
+        if total:
+            self.result_scrollbar.set(self.view_offset / total, end / total)
+        else:
+            self.result_scrollbar.set(0.0, 1.0)
     
-    def has_next_page(self):
-        """次ページ存在チェック"""
-        try:
-            selectors = ["a[class*='next']", ".pager_next a", ".next a"]
-            for selector in selectors:
-                try:
-                    next_button = self.driver.find_element(By.CSS_SELECTOR, selector)
-                    if next_button and next_button.is_enabled():
-                        return True
-                except:
-                    continue
-            return False
-        except:
-            return False
+    def scroll_result_view(self, delta):
+        """結果表示スクロール（行単位）"""
+        total = len(self.scraped_data)
+        max_offset = max(total - self.RESULT_VIEW_ROWS, 0)
+        self.view_offset = min(max(self.view_offset + delta, 0), max_offset)
+        self.view_follow = self.view_offset >= max_offset
+        self.update_result_display()
     
-    def go_to_next_page(self):
-        """次ページ移動"""
-        try:
-            selectors = ["a[class*='next']", ".pager_next a", ".next a"]
-            for selector in selectors:
-                try:
-                    next_button = self.driver.find_element(By.CSS_SELECTOR, selector)
-                    if next_button and next_button.is_enabled():
-                        next_button.click()
-                        time.sleep(2)
-                        return True
-                except:
-                    continue
-            return False
-        except:
-            return False
+    def on_result_scroll(self, action, value, unit=None):
+        """結果表示スクロールバー操作"""
+        if action == 'moveto':
+            total = len(self.scraped_data)
+            target = int(float(value) * total)
+            self.scroll_result_view(target - self.view_offset)
+        elif action == 'scroll':
+            step = self.RESULT_VIEW_ROWS if unit == 'pages' else 1
+            self.scroll_result_view(int(value) * step)
     
-    def smart_delay(self):
-        """遅延制御"""
-        delay = random.uniform(0.5, 1.0)
-        time.sleep(delay)
-    
-    def update_result_display(self, store_data, count):
-        """結果表示更新"""
-        self.tree.insert('', 'end', values=(
-            count,
-            store_data.get('店舗名', '-'),
-            store_data.get('電話番号', '-'),
-            store_data.get('住所', '-'),
-            store_data.get('ジャンル', '-'),
-            store_data.get('営業時間', '-')
-        ))
-        
-        if count % 5 == 0:  # 5件ごとにスクロール
-            children = self.tree.get_children()
-            if children:
-                self.tree.see(children[-1])
-    
-    def save_to_excel(self):
-        """Excel保存"""
-        try:
-            if not self.scraped_data:
-                messagebox.showwarning("警告", "保存するデータがありません。")
-                return
-            
-            df = pd.DataFrame(self.scraped_data)
-            
-            save_path = self.save_path_var.get()
-            filename = self.filename_var.get().strip()
-            if not filename.endswith('.xlsx'):
-                filename += '.xlsx'
-            
-            full_path = os.path.join(save_path, filename)
-            
-            with pd.ExcelWriter(full_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='おすすめ店舗データ', index=False)
-                
-                # 統計シート
-                prefecture = self.prefecture_var.get()
-                stats_data = {
-                    '項目': [
-                        '対象都道府県',
-                        '総取得件数', 
-                        '店舗名あり', 
-                        '電話番号あり', 
-                        '住所あり',
-                        'ジャンルあり',
-                        '営業時間あり',
-                        'クレジットカード情報あり'
-                    ],
-                    '値': [
-                        prefecture,
-                        len(df),
-                        (df['店舗名'] != '-').sum(),
-                        (df['電話番号'] != '-').sum(),
-                        (df['住所'] != '-').sum(),
-                        (df['ジャンル'] != '-').sum(),
-                        (df['営業時間'] != '-').sum(),
-                        (df['クレジットカード'] != '-').sum()
-                    ]
-                }
-                stats_df = pd.DataFrame(stats_data)
-                stats_df.to_excel(writer, sheet_name='取得統計', index=False)
-                
-                # 概要シート
-                summary_data = {
-                    '設定項目': ['検索対象', '検索URL', '取得店舗数', '取得日時'],
-                    '内容': [
-                        f"{prefecture}のおすすめ店舗",
-                        f"https://r.gnavi.co.jp/area/{self.url_generator.prefecture_map.get(prefecture, '')}/rs/",
-                        f"{len(df)}件",
-                        datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
-                    ]
-                }
-                summary_df = pd.DataFrame(summary_data)
-                summary_df.to_excel(writer, sheet_name='取得概要', index=False)
-                
-                # 列幅調整
-                for sheet_name in writer.sheets:
-                    worksheet = writer.sheets[sheet_name]
-                    for column in worksheet.columns:
-                        max_length = 0
-                        column_letter = column[0].column_letter
-                        for cell in column:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                        adjusted_width = min(max_length + 2, 50)
-                        worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            self.config["last_save_path"] = save_path
-            self.save_config()
-            
-            self.logger.info(f"Excel保存完了: {full_path}")
-            
-        except Exception as e:
-            self.logger.error(f"Excel保存エラー: {e}")
-            messagebox.showerror("保存エラー", f"ファイル保存エラー:\n{str(e)}")
+    def on_result_wheel(self, event):
+        """結果表示マウスホイール操作"""
+        self.scroll_result_view(-1 if event.delta > 0 else 1)
+        return 'break'
     
     def run(self):
         """アプリケーション実行"""
@@ -1154,17 +4818,321 @@ class GurunaviScraper:
             self.city_combo.bind('<<ComboboxSelected>>', lambda e: self.update_search_url())
             self.update_search_url()
             
+            # UIイベントキュー処理開始
+            self.window.after(self.UI_POLL_MS, self.process_ui_queue)
+            
             self.window.mainloop()
         except KeyboardInterrupt:
             self.logger.info("アプリケーション中断")
         finally:
-            self.cleanup_driver()
+            self.cancel_event.set()
+            self.engine.close()
             self.logger.info("アプリケーション終了")
+            self.log_listener.stop()
+
+def run_query_command(args):
+    """query サブコマンド: ローカルDBの検索結果を出力"""
+    if not Path(args.db).exists():
+        print(f"DBファイルが見つかりません: {args.db}", file=sys.stderr)
+        sys.exit(1)
+    
+    database = ScrapeDatabase(args.db)
+    try:
+        start = time.perf_counter()
+        rows = database.search(text=args.text, prefecture=args.prefecture, genre=args.genre,
+                               accepts_card=args.card, limit=args.limit)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    finally:
+        database.close()
+    
+    if args.format == 'json':
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        columns = ['shop_id', 'name', 'phone', 'address', 'genre', 'credit_card', 'url']
+        print("\t".join(columns))
+        for row in rows:
+            print("\t".join(str(row.get(column, '')) for column in columns))
+    print(f"{len(rows)}件 ({elapsed_ms:.1f}ms)", file=sys.stderr)
+
+def run_dedup_command(args):
+    """dedup サブコマンド: ローカルDB全体の重複候補を出力"""
+    if not Path(args.db).exists():
+        print(f"DBファイルが見つかりません: {args.db}", file=sys.stderr)
+        sys.exit(1)
+    
+    database = ScrapeDatabase(args.db)
+    try:
+        records = list(database.iter_records(prefecture=args.prefecture))
+    finally:
+        database.close()
+    
+    try:
+        address_index = AddressIndex.load()
+    except Exception as e:
+        print(f"市区町村表読み込みエラー、住所は文字列のみで比較します: {e}", file=sys.stderr)
+        address_index = None
+    
+    start = time.perf_counter()
+    clusters = DuplicateFinder(address_index, threshold=args.threshold, window=args.window).find(records)
+    elapsed = time.perf_counter() - start
+    
+    if args.format == 'json':
+        output = [{'group': number, 'reasons': sorted(reasons),
+                   'shops': [records[index] for index in members]}
+                  for number, (members, reasons) in enumerate(clusters, 1)]
+        print(json.dumps(output, ensure_ascii=False, indent=2))
+    else:
+        print("\t".join(['group', 'reasons', 'shop_id', 'name', 'phone', 'address', 'url']))
+        for number, (members, reasons) in enumerate(clusters, 1):
+            for index in members:
+                record = records[index]
+                print("\t".join(str(value) for value in [
+                    number, '・'.join(sorted(reasons)), record['店舗ID'], record['店舗名'],
+                    record['電話番号'], record['住所'], record['URL']]))
+    print(f"{len(records)}件中 {len(clusters)}グループ ({sum(len(m) for m, _ in clusters)}件) ({elapsed:.1f}秒)",
+          file=sys.stderr)
+
+def run_serve_command(args):
+    """serve サブコマンド: 取得ジョブを受け付けるローカルHTTPサービスを起動"""
+    app_dir = Path.cwd()
+    logger, listener = setup_logging(app_dir / "service.log")
+    try:
+        config = load_config_file(app_dir / "scraper_config.json", app_dir, logger)
+        workers = args.workers or int(config.get("service_workers", 2))
+        
+        engine = ScrapeEngine(config, logger, app_dir)
+        if args.rate is not None:
+            engine.rate_limiter = TokenBucket(args.rate)
+        # ジョブ間で使い回すブラウザは、全ワーカーが同時に使う数まで保持する
+        engine.browser_pool.max_idle = workers * max(int(engine.perf("fetch_workers")), 1)
+        if engine.rate_limiter.rate > 0:
+            logger.info(f"全体のアクセス頻度上限: {engine.rate_limiter.rate}回/秒")
+        
+        service = JobService(engine, args.output or config.get("last_save_path", app_dir), workers)
+        try:
+            service.serve_forever(args.host, args.port)
+        finally:
+            engine.close()
+    finally:
+        listener.stop()
+
+def run_refresh_command(args):
+    """refresh サブコマンド: 店舗ID一覧の店舗を一覧ページを経由せずに再取得"""
+    if not Path(args.input).exists():
+        print(f"入力ファイルが見つかりません: {args.input}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        shard, shards = (int(value) for value in args.shard.split('/'))
+        if not 0 <= shard < shards:
+            raise ValueError
+    except ValueError:
+        print(f"--shard は k/n（0 <= k < n）で指定してください: {args.shard}", file=sys.stderr)
+        sys.exit(1)
+    invalid_fields = [field for field in args.fields or [] if field not in STORE_FIELDS]
+    if invalid_fields:
+        print(f"取得項目が不正です: {', '.join(invalid_fields)}", file=sys.stderr)
+        sys.exit(1)
+    
+    # 分割ごとに別の出力・チェックポイントにする（出力は実行ごとに日時付き）
+    input_path = Path(args.input)
+    suffix = f"_{shard}of{shards}" if shards > 1 else ""
+    output = Path(args.output or f"refresh_{input_path.stem}{suffix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    file_format = output.suffix.lstrip('.').lower()
+    if file_format not in JobService.FORMATS:
+        print(f"出力形式は {', '.join(JobService.FORMATS)} のいずれかです: {output}", file=sys.stderr)
+        sys.exit(1)
+    checkpoint = Path(args.checkpoint or input_path.with_name(f"{input_path.stem}{suffix}.checkpoint"))
+    
+    app_dir = Path.cwd()
+    logger, listener = setup_logging(app_dir / "scraper.log")
+    engine = None
+    try:
+        config = load_config_file(app_dir / "scraper_config.json", app_dir, logger)
+        shop_ids, invalid = load_shop_ids(input_path)
+        if invalid:
+            logger.warning(f"店舗IDとして解釈できない行: {invalid}件")
+        total = len(shop_ids)
+        if shards > 1:
+            shop_ids = [shop_id for shop_id in shop_ids if in_shard(shop_id, shard, shards)]
+        
+        # 再開: チェックポイントに記録済みの店舗（レコードは今回の出力にも含める）、
+        # 指定時間内にDBへ取得済みの店舗、--skip-failed 指定時は取得失敗した店舗を除外
+        previous = []
+        if checkpoint.exists():
+            with open(checkpoint, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        previous.append(json.loads(line))
+                    except ValueError:
+                        continue    # 中断時に書きかけの行
+        done = {shop_id_from_url(record.get('URL', '')) for record in previous}
+        failed_path = checkpoint.with_suffix('.failed')
+        failed = {}
+        if failed_path.exists():
+            with open(failed_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        failed[line.split('\t', 1)[0].strip()] = line.rstrip('\n')
+        skipped_failed = 0
+        if args.skip_failed:
+            skipped_failed = sum(1 for shop_id in shop_ids if shop_id in failed and shop_id not in done)
+            done |= set(failed)
+        if args.skip_fresh_hours and Path(config.get("database_path", "")).exists():
+            database = ScrapeDatabase(config["database_path"])
+            try:
+                done |= database.fetched_since(time.time() - args.skip_fresh_hours * 3600)
+            finally:
+                database.close()
+        remaining = [shop_id for shop_id in shop_ids if shop_id not in done]
+        logger.info(f"再取得対象: {len(remaining)}件 (入力{total}件, 分割{shard}/{shards}: {len(shop_ids)}件, "
+                    f"取得済み{len(shop_ids) - len(remaining) - skipped_failed}件, 取得失敗{skipped_failed}件)")
+        if skipped_failed:
+            logger.info(f"取得失敗として記録済みの店舗は除外しました: {failed_path}")
+        elif failed:
+            logger.info(f"前回までに取得失敗した店舗も再取得します（--skip-failed で除外）: {len(failed)}件")
+        if not remaining and not previous:
+            logger.info("再取得対象がありません")
+            return
+        
+        def report(kind, *values):
+            if kind == 'record' and values[0] % 100 == 0:
+                logger.info(f"進捗: {values[0]}/{len(remaining)}件")
+        
+        engine = ScrapeEngine(config, logger, app_dir)
+        job = ScrapeJob({
+            'prefecture': '',
+            'city': '',
+            'max_count': max(len(remaining), 1),
+            'shop_ids': remaining,
+            'fields': args.fields or [],
+            'fetch_workers': args.concurrency,
+            'checkpoint': str(checkpoint),
+            'trace': False,
+            'profile': args.profile,
+            'save_path': str(output.parent),
+            'filename': output.stem
+        }, listener=report)
+        
+        def work():
+            try:
+                engine.run(job)
+            except Exception as e:
+                logger.error(f"再取得エラー: {e}")
+        
+        # Ctrl+C は停止要求として扱い、取得済みの分は出力する（チェックポイントから再開可能）
+        if remaining:
+            worker = threading.Thread(target=work, name="refresh", daemon=True)
+            worker.start()
+            try:
+                while worker.is_alive():
+                    worker.join(0.5)
+            except KeyboardInterrupt:
+                logger.info("停止要求: 取得済みの分を出力して終了します")
+                job.cancel_event.set()
+                worker.join()
+            logger.info(f"再取得終了: {len(job.records)}件取得 / 失敗{len(job.failed_urls)}件 ({job.state})")
+            logger.info(job.stats.describe())
+        
+        # 再試行上限で失敗した店舗を記録（今回取得できた店舗は外す）
+        if remaining:
+            fetched = {shop_id_from_url(record.get('URL', '')) for record in job.records}
+            for failure in job.failed_urls:
+                error = ' '.join(str(failure['最終エラー']).split())
+                shop_id = shop_id_from_url(failure['URL'])
+                failed[shop_id] = f"{shop_id}\t{failure['試行回数']}\t{error}"
+            failed = {shop_id: line for shop_id, line in failed.items() if shop_id not in fetched}
+            if failed:
+                with open(failed_path, 'w', encoding='utf-8') as f:
+                    f.writelines(f"{line}\n" for line in failed.values())
+            elif failed_path.exists():
+                failed_path.unlink()
+        
+        if previous:
+            logger.info(f"前回までの取得分を出力に含めます: {len(previous)}件")
+            for record in previous:
+                job.records.append(record)
+        if len(job.records):
+            engine.export(job, str(output), file_format)
+        
+        # 最後まで取得して出力できた場合はチェックポイントを片付ける（次回の実行は最初から取得する）。
+        # 取得失敗の記録は出力ファイルと同じ場所に「出力名.failed」として残す
+        if not remaining or job.state == 'done':
+            if checkpoint.exists():
+                checkpoint.unlink()
+                logger.info(f"チェックポイントを削除しました: {checkpoint}")
+            if failed_path.exists():
+                report_path = output.with_suffix('.failed')
+                os.replace(failed_path, report_path)
+                logger.info(f"取得失敗した店舗: {len(failed)}件 ({report_path})")
+    finally:
+        if engine is not None:
+            engine.close()
+        listener.stop()
+
+def build_arg_parser():
+    """コマンドライン引数定義（引数なしの場合はGUIを起動）"""
+    parser = argparse.ArgumentParser(description="ぐるなび店舗情報スクレイピングツール")
+    parser.add_argument('--profile', action='store_true',
+                        help="取得処理をプロファイルし、pstats・collapsed-stackを出力先フォルダに保存")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    query_parser = subparsers.add_parser('query', help="ローカルDBを検索")
+    query_parser.add_argument('--db', default=str(Path.cwd() / "gurunavi.db"), help="DBファイル")
+    query_parser.add_argument('--text', help="店舗名・住所・ジャンルの全文検索語")
+    query_parser.add_argument('--prefecture', help="都道府県（例: 東京都）")
+    query_parser.add_argument('--genre', help="ジャンル（部分一致）")
+    query_parser.add_argument('--card', action='store_true', help="クレジットカード利用可のみ")
+    query_parser.add_argument('--limit', type=int, default=100, help="最大件数")
+    query_parser.add_argument('--format', choices=['tsv', 'json'], default='tsv', help="出力形式")
+    query_parser.set_defaults(handler=run_query_command)
+    
+    dedup_parser = subparsers.add_parser('dedup', help="ローカルDBの重複店舗候補を検出")
+    dedup_parser.add_argument('--db', default=str(Path.cwd() / "gurunavi.db"), help="DBファイル")
+    dedup_parser.add_argument('--prefecture', help="都道府県（例: 東京都）。省略時は全件")
+    dedup_parser.add_argument('--threshold', type=float, default=DuplicateFinder.THRESHOLD,
+                              help="店舗名の類似度しきい値 (0-1)")
+    dedup_parser.add_argument('--window', type=int, default=DuplicateFinder.BUCKET_WINDOW,
+                              help="同一バケット内で比較する直前の件数（大きいほど見逃しが減り、遅くなる）")
+    dedup_parser.add_argument('--format', choices=['tsv', 'json'], default='tsv', help="出力形式")
+    dedup_parser.set_defaults(handler=run_dedup_command)
+    
+    serve_parser = subparsers.add_parser('serve', help="取得ジョブを受け付けるローカルHTTPサービスを起動")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="待ち受けアドレス")
+    serve_parser.add_argument('--port', type=int, default=8765, help="待ち受けポート")
+    serve_parser.add_argument('--workers', type=int, help="同時実行ジョブ数（省略時は設定の service_workers）")
+    serve_parser.add_argument('--output', help="取得結果の出力先フォルダ（省略時は前回の保存先）")
+    serve_parser.add_argument('--rate', type=float,
+                              help="全ジョブ合計のページ取得上限（回/秒、0で無制限。省略時は設定の global_rate_per_sec）")
+    serve_parser.set_defaults(handler=run_serve_command)
+    
+    refresh_parser = subparsers.add_parser('refresh', help="店舗ID・URLの一覧を一覧ページを経由せずに再取得")
+    refresh_parser.add_argument('input', help="店舗IDまたは店舗URLの一覧ファイル（1行1件）")
+    refresh_parser.add_argument('--shard', default='0/1', help="分割実行 k/n（crc32(店舗ID) %% n == k の店舗のみ）")
+    refresh_parser.add_argument('--output', help="出力ファイル（.csv/.xlsx/.json、省略時は日時付きCSV）")
+    refresh_parser.add_argument('--checkpoint', help="中断時の再開用に取得レコードを記録するファイル（省略時は入力ファイル名.checkpoint、"
+                                                     "失敗した店舗は同名の .failed に記録）。最後まで取得して出力できたら削除し、"
+                                                     ".failed は出力ファイル名.failed に移す")
+    refresh_parser.add_argument('--skip-failed', action='store_true',
+                                help="再開時、前回までに取得失敗した店舗（.failed）を再取得せず除外")
+    refresh_parser.add_argument('--skip-fresh-hours', type=float, help="指定時間内にDBへ取得済みの店舗を除外")
+    refresh_parser.add_argument('--fields', nargs='+', help="取得項目（例: 店舗名 電話番号）。省略時は全項目")
+    refresh_parser.add_argument('--concurrency', type=int, help="取得スレッド数（省略時は性能プロファイルの値）")
+    refresh_parser.set_defaults(handler=run_refresh_command)
+    
+    return parser
 
 def main():
     """メイン関数"""
+    # 解析プロセスプール用（exe化した場合の子プロセス起動に必要）
+    multiprocessing.freeze_support()
+    
+    args = build_arg_parser().parse_args()
+    if args.command:
+        args.handler(args)
+        return
+    
     try:
-        app = GurunaviScraper()
+        app = GurunaviScraper(profile=args.profile)
         app.run()
     except Exception as e:
         logging.error(f"アプリケーション起動エラー: {e}")
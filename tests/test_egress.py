@@ -0,0 +1,176 @@
+"""送信経路（TokenBucket / EgressPool / EgressSession）のテスト
+
+EgressSession はローカルに立てた代理プロキシ（http.server）を経由させて確認する。
+"""
+
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gurunavi_scraper import EgressPool, EgressRoute, TokenBucket
+
+logger = logging.getLogger("test_egress")
+
+
+class StandInProxy(BaseHTTPRequestHandler):
+    """代理プロキシ（受けた要求を記録し、server.status の応答を返す）"""
+
+    def do_GET(self):
+        self.server.seen.append((self.path, self.headers.get('User-Agent')))
+        body = b"ok"
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def proxy():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProxy)
+    server.seen = []
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_pool(count=2, max_failures=3, cooldown=60, **route_options):
+    routes = [EgressRoute(f"exit{index}", **route_options) for index in range(count)]
+    return EgressPool(routes, logger, max_failures=max_failures, cooldown=cooldown)
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    start = time.monotonic()
+    assert all(bucket.acquire() for _ in range(100))
+    assert time.monotonic() - start < 0.1
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(20)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # 最初の1回はバースト分、残り5回は 1/20 秒間隔
+    assert time.monotonic() - start >= 0.2
+
+
+def test_token_bucket_cancel():
+    bucket = TokenBucket(0.5)
+    cancel_event = threading.Event()
+    assert bucket.acquire(cancel_event)
+    cancel_event.set()
+    start = time.monotonic()
+    assert bucket.acquire(cancel_event) is False
+    assert time.monotonic() - start < 0.5
+
+
+def test_pool_requires_routes():
+    with pytest.raises(ValueError):
+        EgressPool([], logger)
+
+
+def test_assign_is_sticky_and_balanced():
+    pool = make_pool(2)
+    first = pool.assign("area/a")
+    second = pool.assign("area/b")
+    assert first is not second
+    assert all(pool.assign("area/a") is first for _ in range(5))
+    assert first.areas == 1 and second.areas == 1
+
+
+def test_assign_respects_candidates():
+    pool = make_pool(3)
+    route = pool.assign("area/a", candidates={"exit2"})
+    assert route.name == "exit2"
+
+
+def test_record_parks_route_and_moves_area():
+    pool = make_pool(2, max_failures=3)
+    route = pool.assign("area/a")
+    for _ in range(2):
+        pool.record(route, False)
+    pool.record(route, True)
+    assert route.healthy() and route.failures == 0
+
+    for _ in range(3):
+        pool.record(route, False)
+    assert not route.healthy()
+    moved = pool.assign("area/a")
+    assert moved is not route and moved.healthy()
+    assert route.areas == 0 and moved.areas == 1
+
+
+def test_all_routes_down_uses_earliest_recovery():
+    pool = make_pool(2, max_failures=1)
+    first, second = pool.routes
+    pool.record(first, False)
+    time.sleep(0.01)
+    pool.record(second, False)
+    assert pool.next_route() is first
+
+
+def test_session_goes_through_proxy(proxy):
+    pool = make_pool(1)
+    route = pool.routes[0]
+    route.proxy = proxy.url
+    route.user_agent = "UA-test"
+    response = pool.session(route).get("http://r.gnavi.co.jp/area/tokyo/rs/", timeout=5)
+    assert response.status_code == 200
+    assert proxy.seen == [("http://r.gnavi.co.jp/area/tokyo/rs/", "UA-test")]
+    assert route.requests == 1 and route.errors == 0
+
+
+def test_session_block_status_parks_route(proxy):
+    pool = make_pool(2, max_failures=2)
+    route = pool.routes[0]
+    route.proxy = proxy.url
+    proxy.status = 429
+    session = pool.session(route)
+    for _ in range(2):
+        session.get("http://r.gnavi.co.jp/area/tokyo/rs/", timeout=5)
+    assert route.errors == 2
+    assert not route.healthy()
+    assert pool.assign("area/tokyo") is pool.routes[1]
+
+
+def test_session_connection_error_is_recorded(proxy):
+    pool = make_pool(1)
+    route = pool.routes[0]
+    proxy.shutdown()
+    proxy.server_close()
+    route.proxy = proxy.url
+    with pytest.raises(requests.exceptions.RequestException):
+        pool.session(route).get("http://r.gnavi.co.jp/area/tokyo/rs/", timeout=2)
+    assert route.errors == 1
+
+
+def test_session_rate_limit_and_cancel(proxy):
+    pool = make_pool(1, rate=10)
+    route = pool.routes[0]
+    route.proxy = proxy.url
+    session = pool.session(route)
+    start = time.monotonic()
+    for _ in range(3):
+        session.get("http://r.gnavi.co.jp/", timeout=5)
+    assert time.monotonic() - start >= 0.2
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(requests.exceptions.RequestException):
+        pool.session(route, cancel_event).get("http://r.gnavi.co.jp/", timeout=5)
+    assert len(proxy.seen) == 3